@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import classes
+import module
+
+
+def parse_inputs(items):
+    '''
+    Input: 1. items - case ids, local .vital files or text files with one case id / .vital file per line
+
+    Output: list of (name, case, vital_path); name - name of the output file ('367', '0367', ...)
+    '''
+    inputs = []
+    for item in items:
+        if item.endswith('.txt') and os.path.exists(item):
+            with open(item, 'r') as list_file:
+                inputs.extend(parse_inputs([line.strip() for line in list_file if line.strip()]))
+        elif item.endswith('.vital'):
+            name = os.path.splitext(os.path.basename(item))[0]
+            # Case id from the file name if it is a number ('0367.vital' -> 367)
+            inputs.append((name, int(name) if name.isdigit() else name, item))
+        else:
+            inputs.append((item, int(item), None))
+    return inputs
+
+
+def case_abp(abp):
+    '''
+    Input: 1. abp - ABP track of the case (2D-array from module.load_tracks())
+
+    Output: ABP beats of the case (BEAT_DTYPE) and the local period track (empty if the case has no ABP)
+    '''
+    if abp.size == 0 or not np.isfinite(abp[:, 0]).any():
+        return np.zeros(0, dtype=module.BEAT_DTYPE), (np.zeros(0), np.zeros(0))
+    _, track, beats = module.abp_beats(abp, rate=module.RATES['ABP'])
+    return beats, track
+
+
+def case_features(case, vital_path=None):
+    '''
+    Input: 1. case - case id in vitaldb
+           2. vital_path - local .vital file with the case (optional)
+
+    Function run the whole pipeline for one case: loading, ECG filtering, peaks / Hr,
+    HRV windows, ABP beats and clinical events.
+
+    Output: 1. columns - dictionary {column: 1D-array} with compact types
+            2. info - dictionary with the case summary (for the run manifest)
+    '''
+    # All channels with one pass over the .vital file (or one download)
+    tracks = module.load_tracks(case, list(module.TRACKS), vital_path)
+    df_class = module.give_me_df_with_parameters(case, tracks=tracks)
+    rate = df_class.signals.rates['ECG']
+    quality = df_class.signals.quality['ECG']
+    # Peaks and Hr (NaN after the masked artifacts) once, the HRV engine is created from the same peaks
+    peaks, hr = module.whole_case_peaks(df_class.signals.channels['ECG'][:], rate=rate, workers=1, quality=quality)
+    hrv = df_class.hrv = classes.Hrv_metrics(peaks, rate=rate)
+    beats, (centers, periods) = case_abp(tracks['ABP'])
+    events = module.case_events(df_class, beats)
+    windows = hrv.rolling(window=60, step=5)
+
+    columns = {'ecg_peaks': peaks.astype(np.int32),
+               'abp_start': beats['start'].astype(np.int32),
+               # Pressure values are rounded in segment_beats()
+               'abp_dia': beats['dia'].astype(np.int16),
+               'abp_sys': beats['sys'].astype(np.int16),
+               'abp_mean': beats['mean'].astype(np.int16),
+               'abp_period_center': centers.astype(np.int32),
+               'abp_period': periods.astype(np.float32),
+               'event_start': events.start.astype(np.int32),
+               'event_stop': events.stop.astype(np.int32),
+               'event_kind': events.kind.astype(str),
+               'event_score': events.score.astype(np.float32)}
+    columns['ecg_hr'] = hr.astype(np.float32)
+    # Masked ECG artifacts (runs, kind - number in classes.Quality_mask.KINDS)
+    columns.update(ecg_quality_start=quality.start, ecg_quality_stop=quality.stop, ecg_quality_kind=quality.kind)
+    for name in windows.columns:
+        columns['hrv_' + name.lower().replace(' ', '_')] = windows.loc[:, name].to_numpy(dtype=np.float32)
+
+    summary = hrv.summary(0, df_class.signals.length())
+    info = {'seconds': df_class.signals.length() / rate, 'ecg peaks': int(hrv.peaks.size), 'abp beats': int(beats.size),
+            'events': len(events), 'masked seconds': quality.bad_samples() / rate,
+            'mean hr': summary['mean hr'], 'sdnn': summary['sdnn'], 'rmssd': summary['rmssd']}
+    return columns, info
+
+
+def process_case(name, case, vital_path, out_dir):
+    '''
+    Input: 1. name, case, vital_path - one input from parse_inputs()
+           2. out_dir - directory for the results
+
+    Function process one case (runs in the worker process) and save the columns to '<name>.npz'.
+    The file is written to the temporary name and then renamed, so an interrupted run never leaves
+    a half-written result.
+
+    Output: dictionary - row of the run manifest (status 'done' or 'failed')
+    '''
+    start = time.perf_counter()
+    row = {'case': case, 'vital': vital_path, 'file': name + '.npz'}
+    try:
+        columns, info = case_features(case, vital_path)
+        tmp_path = os.path.join(out_dir, name + '.tmp.npz')
+        np.savez_compressed(tmp_path, **columns)
+        os.replace(tmp_path, os.path.join(out_dir, name + '.npz'))
+        row.update(info, status='done')
+    except Exception:
+        row.update(status='failed', error=traceback.format_exc(limit=3))
+    row['run time'] = time.perf_counter() - start
+    return row
+
+
+def read_manifest(out_dir):
+    '''
+    Output: dictionary {name: manifest row} (empty if there is no manifest)
+    '''
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)['cases']
+
+
+def write_manifest(out_dir, cases, parameters):
+    '''
+    Function write the run manifest (temporary name and rename, as classes.Vital_cache)
+    '''
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump({'parameters': parameters, 'cases': cases}, manifest_file, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def run_pool(tasks, out_dir, workers, save):
+    '''
+    Input: 1. tasks - list of (name, case, vital_path)
+           2. out_dir - directory for the results
+           3. workers - number of processes
+           4. save - function(row, name) that is called for every finished case
+
+    Output: list of the tasks without result (a worker process crashed and the pool is broken)
+    '''
+    unfinished = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_case, name, case, vital_path, out_dir): (name, case, vital_path)
+                   for name, case, vital_path in tasks}
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except BrokenProcessPool:
+                unfinished.append(futures[future])
+                continue
+            save(row, futures[future][0])
+    return unfinished
+
+
+def run(inputs, out_dir, workers=None, retry_failed=True):
+    '''
+    Input: 1. inputs - list from parse_inputs()
+           2. out_dir - directory for the results and the run manifest
+           3. workers - number of processes (None - all cores, 1 - in this process)
+           4. retry_failed - process the failed cases of the previous runs again
+
+    Function process all cases in the process pool. The manifest is updated after every case,
+    so after an interruption the next run skips the finished cases.
+
+    Output: dictionary {name: manifest row}
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    cases = read_manifest(out_dir)
+    parameters = {'tracks': module.TRACKS, 'rates': module.RATES, 'quality': module.QUALITY, 'hrv window': 60, 'hrv step': 5}
+
+    def finished(name):
+        row = cases.get(name)
+        if row is None:
+            return False
+        if row['status'] == 'done':
+            return os.path.exists(os.path.join(out_dir, row['file']))
+        return not retry_failed
+
+    todo = [task for task in inputs if not finished(task[0])]
+    print(f'{len(inputs) - len(todo)} cases are already processed, {len(todo)} to go')
+
+    def save(row, name):
+        cases[name] = row
+        write_manifest(out_dir, cases, parameters)
+        text = f"{row['run time']:.1f} s" if row['status'] == 'done' else row['error'].strip().splitlines()[-1]
+        print(f"{name}: {row['status']} ({text})")
+
+    if workers == 1:
+        for name, case, vital_path in todo:
+            save(process_case(name, case, vital_path, out_dir), name)
+        return cases
+    unfinished = run_pool(todo, out_dir, workers, save)
+    # Crashed worker (segfault, out of memory) breaks the whole pool: the unfinished cases run again 
+    # one by one in their own process, so only the case that crashes is failed
+    for name, case, vital_path in unfinished:
+        if run_pool([(name, case, vital_path)], out_dir, 1, save):
+            save({'case': case, 'vital': vital_path, 'file': name + '.npz', 'status': 'failed',
+                  'error': 'Worker process crashed (BrokenProcessPool)', 'run time': 0.0}, name)
+    return cases
+
+
+def read_case(out_dir, name):
+    '''
+    Input: 1. out_dir - directory with the results of run()
+           2. name - name of the case (key of the manifest)
+
+    Output: dictionary {column: 1D-array} (see case_features())
+    '''
+    with np.load(os.path.join(out_dir, name + '.npz')) as columns:
+        return {column: columns[column] for column in columns.files}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Headless processing of many cases: ECG peaks / Hr, HRV, ABP beats, events')
+    parser.add_argument('inputs', nargs='+', help='case ids, .vital files or .txt files with one input per line')
+    parser.add_argument('--out', default='data/batch', help='directory for the results and the run manifest')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default - all cores)')
+    parser.add_argument('--skip-failed', action='store_true', help='do not retry the failed cases of the previous runs')
+    args = parser.parse_args()
+
+    results = run(parse_inputs(args.inputs), args.out, args.workers, retry_failed=not args.skip_failed)
+    failed = [name for name, row in results.items() if row['status'] != 'done']
+    print(f'{len(results) - len(failed)} cases done, {len(failed)} failed')
+    raise SystemExit(1 if failed else 0)
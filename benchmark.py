@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+import classes
+import module
+import rolling
+
+
+# Input sizes, seconds of the case (10 s ... 4 h)
+SIZES = [10, 60, 600, 3600, 14400]
+
+
+def synthetic_ecg(seconds, rate=500, seed=0):
+    '''
+    Input: 1. seconds - length of the signal
+           2. rate - sampling rate
+           3. seed - random seed
+
+    Function create ECG-like signal (P, QRS and T waves for every beat, heart rate drifts between 60 and 120 bpm,
+    noise and some zero runs as after the outlier removal) without any download
+
+    Output: 1D-array
+    '''
+    random = np.random.RandomState(seed)
+    size = int(seconds * rate)
+    time_s = np.arange(size) / rate
+    hr = 90 + 30 * np.sin(2 * np.pi * time_s / 1800)
+    # Phase of the beat (0...1) for every point
+    phase = np.cumsum(hr / 60 / rate) % 1.0
+    ecg = (0.1 * np.exp(-((phase - 0.15) / 0.025) ** 2)
+           + 1.0 * np.exp(-((phase - 0.30) / 0.008) ** 2)
+           - 0.15 * np.exp(-((phase - 0.33) / 0.01) ** 2)
+           + 0.25 * np.exp(-((phase - 0.60) / 0.05) ** 2))
+    ecg += 0.02 * random.randn(size) + 0.05 * np.sin(2 * np.pi * time_s / 4)
+    # Artifacts (zero runs)
+    for start in random.randint(0, max(size - rate, 1), size // (600 * rate) + 1):
+        ecg[start:start + rate // 2] = 0
+    return ecg
+
+
+def synthetic_co2(seconds, rate=62.5):
+    '''
+    Output: 1D-array with CO2-like signal (breathing every 5 s)
+    '''
+    time_s = np.arange(int(seconds * rate)) / rate
+    return 38 * np.clip(np.sin(2 * np.pi * time_s / 5) * 3, 0, 1)
+
+
+def synthetic_abp(seconds, rate=500, seed=0):
+    '''
+    Output: 2D-array with one column (as vitaldb.load_case()) with ABP-like signal
+    '''
+    random = np.random.RandomState(seed)
+    time_s = np.arange(int(seconds * rate)) / rate
+    hr = 90 + 30 * np.sin(2 * np.pi * time_s / 1800)
+    phase = np.cumsum(hr / 60 / rate) % 1.0
+    abp = 70 + 45 * np.exp(-((phase - 0.2) / 0.1) ** 2) + 10 * np.exp(-((phase - 0.45) / 0.05) ** 2)
+    return (abp + random.randn(abp.size)).reshape(-1, 1)
+
+
+def synthetic_store(seconds):
+    '''
+    Output: classes.Data_store with synthetic ECG, co2 and Hr
+    '''
+    signals = classes.Signal_store(base='ECG')
+    signals.add('ECG', synthetic_ecg(seconds), 500)
+    signals.add('co2', synthetic_co2(seconds), 62.5)
+    signals.add('Hr', 90 + 30 * np.sin(2 * np.pi * np.arange(int(seconds * 0.5)) * 2 / 1800), 0.5)
+    return classes.Data_store(signals)
+
+
+def ecg_frame(seconds):
+    '''
+    Output: df with Time and filtered ECG ('ECG_f') for find_peaks_and_hr()
+    '''
+    data_store = synthetic_store(seconds)
+    df = data_store.window_frame(0, int(seconds * 500))
+    df.loc[:, 'ECG_f'] = data_store.fourier_transform(df.loc[:, 'ECG'].to_numpy())
+    return df
+
+
+# name: (setup(seconds) -> arguments, function(*arguments), max size in seconds)
+# Setup is not measured. Every run gets new arguments (no cached tiles between runs)
+BENCHMARKS = {
+    'fir_filter': (lambda s: (synthetic_ecg(s), classes.filter_bank('ECG')),
+                   lambda ecg, h: np.array([zi for zi in classes.fir_filter(ecg, h)]), 60),
+    'fourier_transform': (lambda s: (classes.Data_store(None), synthetic_ecg(s)),
+                          lambda data_store, ecg: data_store.fourier_transform(ecg), 14400),
+    'find_peaks_and_hr': (lambda s: (classes.Data_store(None), ecg_frame(s)),
+                          lambda data_store, df: data_store.find_peaks_and_hr(df), 3600),
+    'rolling_window': (lambda s: (synthetic_abp(s)[:, 0],),
+                       lambda abp: module.rolling_window(abp, 10, 1), 14400),
+    'smooth_abp': (lambda s: (synthetic_abp(s)[:, 0],),
+                   lambda abp: module.smooth_abp(abp), 14400),
+    'find_period': (lambda s: (module.smooth_abp(synthetic_abp(s)[:, 0]),),
+                    lambda abp: module.find_period(abp, sampling_rate=500), 14400),
+    'period_track': (lambda s: (module.smooth_abp(synthetic_abp(s)[:, 0]),),
+                     lambda abp: module.period_track(abp, sampling_rate=500), 14400),
+    'find_min_max_average': (lambda s: (module.smooth_abp(synthetic_abp(s)[:, 0]),),
+                             lambda abp: module.find_min_max_average(abp, module.find_period(abp)), 3600),
+    'abp_from_raw_to_df': (lambda s: (synthetic_abp(s),),
+                           lambda abp: module.abp_from_raw_to_df(abp), 14400),
+    'data_transformation': (lambda s: (synthetic_store(s), int(s * 500)),
+                            lambda data_store, stop: module.data_transformation(data_store, 0, stop), 3600),
+    'give_values_for_streaming': (lambda s: (synthetic_store(s), int(s * 500)),
+                                  lambda data_store, stop: module.give_values_for_streaming(data_store, 0, stop - 1), 3600),
+}
+
+
+# Rolling statistics kernels for the windows 10, 100 and 1000 points (+ the former strided mean for comparison)
+for window in (10, 100, 1000):
+    for statistic in ('mean', 'max', 'std', 'median'):
+        BENCHMARKS[f'rolling_{statistic}_w{window}'] = (lambda s: (synthetic_abp(s)[:, 0],),
+                                                       lambda abp, kernel=rolling.KERNELS[statistic], window=window: kernel(abp, window), 14400)
+    BENCHMARKS[f'strided_mean_w{window}'] = (lambda s: (synthetic_abp(s)[:, 0],),
+                                             lambda abp, window=window: rolling.strided_mean(abp, window), 14400)
+
+
+def rolling_reference(values, window, statistic):
+    '''
+    Output: statistic of every full window from the strided view (O(n*w), for the parity checks)
+    '''
+    view = np.lib.stride_tricks.as_strided(values, shape=(values.size - window + 1, window),
+                                           strides=(values.strides[0], values.strides[0]))
+    return {'mean': np.mean, 'sum': np.sum, 'std': np.std, 'min': np.min, 'max': np.max,
+            'median': np.median}[statistic](view, axis=1)
+
+
+def parity(seconds=60, windows=(1, 2, 10, 100, 1000), tolerance=1e-6):
+    '''
+    Input: 1. seconds - size of the synthetic ABP
+           2. windows - window sizes
+           3. tolerance - max allowed difference
+
+    Function compare the rolling kernels with the strided reference (full signal, 'same' mode edges,
+    NaN values and the chunk by chunk Rolling_state) 
+
+    Output: 1. failed - list of the failed checks (text)
+            2. errors - list of (statistic, window, max error) of every kernel
+    '''
+    values = synthetic_abp(seconds)[:, 0]
+    with_nan = values.copy()
+    with_nan[1000:1005] = np.nan
+    failed, errors = [], []
+    for window in windows:
+        for statistic, kernel in rolling.KERNELS.items():
+            error = np.max(np.abs(kernel(values, window) - rolling_reference(values, window, statistic)))
+            errors.append((statistic, window, error))
+            if error > tolerance:
+                failed.append(f'{statistic} w={window}: error {error:.2e}')
+            # NaN in the window -> NaN, other windows are the same
+            result = kernel(with_nan, window)
+            nan_window = np.isnan(rolling_reference(with_nan, window, 'sum'))
+            if (np.isnan(result) != nan_window).any():
+                failed.append(f'{statistic} w={window}: NaN windows')
+            # 'same' mode: centered windows (shorter at the edges)
+            center = kernel(values, window, 'same')[window // 2:values.size - (window - 1 - window // 2)]
+            if np.max(np.abs(center - kernel(values, window)), initial=0) > tolerance:
+                failed.append(f'{statistic} w={window}: same mode')
+        # Chunk by chunk result is the same as the result for the whole signal
+        state = rolling.Rolling_state(window, tuple(rolling.KERNELS))
+        parts = [state.process(chunk) for chunk in np.array_split(values, 17)]
+        for statistic, kernel in rolling.KERNELS.items():
+            streamed = np.concatenate([part[statistic] for part in parts])
+            if streamed.size != values.size - window + 1 or np.max(np.abs(streamed - kernel(values, window))) > tolerance:
+                failed.append(f'{statistic} w={window}: stream')
+    # module.rolling_window (ABP smoothing) - same values as the former strided version
+    error = np.max(np.abs(module.rolling_window(values, 10, 3) - rolling.strided_mean(values, 10, 3)))
+    if error > tolerance:
+        failed.append(f'rolling_window: error {error:.2e}')
+    return failed, errors
+
+
+def measure(setup, function, seconds, repeats=3):
+    '''
+    Input: 1. setup, function - benchmark from BENCHMARKS
+           2. seconds - size of the input
+           3. repeats - number of runs (the best time is used)
+
+    Output: dictionary with 'seconds' (best wall time), 'throughput' (input samples per second)
+            and 'peak_bytes' (max memory allocated during the run, tracemalloc)
+    '''
+    best = float('inf')
+    for i in range(repeats):
+        arguments = setup(seconds)
+        start = time.perf_counter()
+        function(*arguments)
+        best = min(best, time.perf_counter() - start)
+    # Memory is measured in the separate run (tracemalloc slows the code down)
+    arguments = setup(seconds)
+    tracemalloc.start()
+    function(*arguments)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': best, 'throughput': seconds * 500 / best, 'peak_bytes': peak}
+
+
+def run(names=None, sizes=SIZES, max_seconds=None, repeats=3):
+    '''
+    Input: 1. names - list of the benchmarks (None - all)
+           2. sizes - input sizes, seconds
+           3. max_seconds - skip sizes above this value (for a quick run)
+           4. repeats - number of runs for every measurement
+
+    Output: dictionary {'name/size': result of measure()}
+    '''
+    results = {}
+    for name in names or BENCHMARKS:
+        setup, function, max_size = BENCHMARKS[name]
+        for seconds in sizes:
+            if seconds > max_size or (max_seconds and seconds > max_seconds):
+                continue
+            results[f'{name}/{seconds}'] = measure(setup, function, seconds, repeats)
+            result = results[f'{name}/{seconds}']
+            print(f"{name:28} {seconds:6d} s  {result['seconds']:9.4f} s  "
+                  f"{result['throughput']:14.0f} samples/s  {result['peak_bytes'] / 2**20:9.1f} MB")
+    return results
+
+
+def compare(results, baseline, threshold=1.25, min_seconds=0.005):
+    '''
+    Input: 1. results - result of run()
+           2. baseline - stored result of run()
+           3. threshold - allowed ratio (1.25 - 25% slower / more memory)
+           4. min_seconds - time is not compared for the very fast runs (timer noise)
+
+    Output: list of the regressions (text)
+    '''
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        if old['seconds'] >= min_seconds and result['throughput'] * threshold < old['throughput']:
+            regressions.append(f"{key}: throughput {old['throughput']:.0f} -> {result['throughput']:.0f} samples/s")
+        if result['peak_bytes'] > old['peak_bytes'] * threshold:
+            regressions.append(f"{key}: peak memory {old['peak_bytes'] / 2**20:.1f} -> {result['peak_bytes'] / 2**20:.1f} MB")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks for the hot paths of classes and module (synthetic data, no download)')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default - all): ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='input sizes, seconds')
+    parser.add_argument('--max-seconds', type=int, default=None, help='skip sizes above this value')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='JSON file with the baseline')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=1.25, help='allowed ratio before a regression is reported')
+    parser.add_argument('--parity', action='store_true', help='only check the rolling kernels against the strided reference')
+    args = parser.parse_args()
+
+    if args.parity:
+        failed, errors = parity()
+        for statistic, window, error in errors:
+            print(f'{statistic:8} w={window:5d}  max error {error:.2e}')
+        for text in failed:
+            print('PARITY FAILED ' + text)
+        raise SystemExit(1 if failed else 0)
+
+    results = run(args.names, args.sizes, args.max_seconds, args.repeats)
+    if args.save:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=1)
+        print(f"Baseline saved to '{args.baseline}'")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            raise SystemExit(1)
+        print('No regressions')
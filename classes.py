@@ -1,6 +1,78 @@
-from scipy.signal.windows import hamming
+from functools import lru_cache
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import threading
 import numpy as np
-import neurokit2 as nk
+import pandas as pd
+import hashlib
+import json
+import os
+import sys
+import time
+
+import diagnostics
+# scipy and neurokit2 are imported on the first use (fast start of the dashboard)
+
+
+# Filter parameters for every channel (sampling rate, cutoff, transition width, number of taps)
+# ECG - the original high-pass filter (ramp from 0 to 20 Hz), co2 (breath detection) and ABP (wave smoothing, 
+# module.smooth_abp) - smoothing low-pass filters
+FILTER_BANK = {'ECG': {'rate': 500, 'cutoff': 20, 'transition': 20, 'taps': 100, 'kind': 'highpass'},
+               'co2': {'rate': 62.5, 'cutoff': 5, 'transition': 3, 'taps': 32, 'kind': 'lowpass'},
+               'ABP': {'rate': 500, 'cutoff': 15, 'transition': 5, 'taps': 100, 'kind': 'lowpass'}}
+
+
+@lru_cache(maxsize=None)
+def design_fir_filter(rate=500, cutoff=20, transition=20, taps=100, kind='highpass', resolution=0.1):
+    """
+    Input: 1. rate - sampling rate of the signal, Hz
+           2. cutoff - cutoff frequency, Hz
+           3. transition - width of the linear ramp below the cutoff, Hz (transition == cutoff - ramp from 0 Hz)
+           4. taps - number of filter coefficients
+           5. kind - 'highpass' or 'lowpass'
+           6. resolution - step of the frequency grid, Hz
+
+    Function create the filter in the frequency domain and convert it to the impulse response 
+    (inverse Fourier transform + Hamming window). The result is cached by parameters, 
+    so every set of parameters is designed only once per process.
+    With default parameters the result is the same as the original 500 Hz ECG filter.
+
+    Output: finite_impuls_respons - read-only 1D-array with 'taps' coefficients
+    """
+    if not 0 < transition <= cutoff < rate / 2:
+        raise ValueError(f"Wrong filter parameters: rate={rate}, cutoff={cutoff}, transition={transition}")
+    # Frequency grid
+    n = int(round(rate / resolution))
+    half = int(round(cutoff / resolution))
+    f = np.fft.fftshift(np.fft.fftfreq(n, 1/rate))
+    # Linear ramp (|f|/cutoff) for all frequencies below the cutoff
+    c_add = np.abs(np.linspace(-1.0, 1.0, 2*half - 1, endpoint=False)[::-1])
+    # Only the last 'transition' Hz of the ramp are used
+    c_add = np.clip((c_add - (1 - transition/cutoff)) * cutoff/transition, 0, 1)
+    c_add = np.concatenate([np.zeros(n//2 - half + 1), c_add])
+    c_add = np.concatenate([c_add, np.zeros(n - c_add.size)])
+    c_filter = ((np.abs(f) >= cutoff) + c_add)
+    if kind == 'lowpass':
+        c_filter = 1 - c_filter
+    # Generate impuls respons
+    from scipy.signal.windows import hamming
+    impuls_respons = np.fft.ifft(np.fft.ifftshift(c_filter) / n, norm='forward').real
+    finite_impuls_respons = np.roll(impuls_respons, taps//2)[:taps] * hamming(taps)
+    if kind == 'lowpass':
+        # Gain 1 at 0 Hz: the level of the signal is kept (mmHg of ABP, co2 level)
+        finite_impuls_respons /= finite_impuls_respons.sum()
+    # Result is shared between all callers, so protect it from changes
+    finite_impuls_respons.setflags(write=False)
+    return finite_impuls_respons
+
+
+def filter_bank(channel):
+    """
+    Input: 1. channel - name of the channel from FILTER_BANK ('ECG', 'co2', 'ABP')
+
+    Output: cached impulse response for this channel
+    """
+    return design_fir_filter(**FILTER_BANK[channel])
 
 
 def fir_filter(y, h):
@@ -18,39 +90,1320 @@ def fir_filter(y, h):
         zi = sum(history[i]*h[h.size - i - 1] for i in range(h.size))
         yield zi
 
+
+class Block_fir_filter:
+    """
+    Block version of fir_filter(). The whole chunk of the signal is filtered 
+    at once (lfilter-style convolution), and the filter state (last M-1 input values) 
+    is carried between chunks, so the chunked output is the same as the output 
+    of the fir_filter() generator (sample for sample, including the delay)
+    """
+    def __init__(self, h):
+        self.h = np.asarray(h, dtype=float)
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the filter state (the same as the start of the new fir_filter() generator)
+        """
+        self.zi = np.zeros(self.h.size - 1)
+
+    def process(self, chunk):
+        """
+        Input: 1. chunk - 1D-array (next part of the signal)
+
+        Function filter the chunk and save the filter state for the next chunk
+
+        Output: 1D-array with filtered values (same size as chunk)
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.size == 0:
+            return np.zeros(0)
+        from scipy.signal import lfilter
+        z, self.zi = lfilter(self.h, 1.0, chunk, zi=self.zi)
+        return z
+
  
+class Online_peak_detector:
+    """
+    Online R-peak detector for the filtered ECG (Pan-Tompkins style). 
+    Chunks are processed with vectorized steps (derivative, squaring, moving window integration, 
+    local maxima), only the few candidates go through the adaptive thresholds, refractory and search-back logic.
+    State has a fixed size (last points of the signals, thresholds, last RR intervals), so memory is O(1).
+    Peak is emitted when the refractory period after it is over (latency <= refractory + window).
+    """
+    def __init__(self, rate=500, window=0.15, refractory=0.2, learning=4.0):
+        self.rate = rate
+        # Moving window integration (150 ms), refractory period (200 ms) and learning period, in points
+        self.window = int(round(window * rate))
+        self.refractory = int(round(refractory * rate))
+        self.learning = int(round(learning * rate))
+        self.reset()
+
+    def reset(self):
+        # Number of processed points
+        self.n = 0
+        # Last values of filtered ECG, squared derivative and integrated signal
+        self.ecg_tail = np.zeros(self.window + 2)
+        self.square_tail = np.zeros(self.window - 1)
+        self.mwi_tail = np.zeros(2)
+        # Adaptive thresholds (signal and noise levels)
+        self.spki = 0.0
+        self.npki = 0.0
+        self.learned = False
+        self.learning_mwi = []
+        self.learning_candidates = []
+        # Last RR intervals (for the search-back), biggest candidate below threshold after the last peak
+        self.rr = deque([self.rate], maxlen=8)
+        self.missed = None
+        # Peak that waits for the end of the refractory period, last emitted peak
+        self.pending = None
+        self.last_peak = None
+
+    def process(self, chunk):
+        """
+        Input: 1. chunk - next part of the filtered ECG ('ECG_f')
+
+        Output: 1. peaks - indexes of the R-peaks (from the first processed point) confirmed in this chunk
+                2. hr - instantaneous Hr for every peak (60 / RR interval, NaN for the first peak)
+        """
+        chunk = np.nan_to_num(np.asarray(chunk, dtype=float))
+        size = chunk.size
+        peaks = []
+        if size == 0:
+            return self.result(peaks)
+
+        # Derivative and squaring (with the last point of the previous chunk)
+        ecg = np.concatenate([self.ecg_tail, chunk])
+        square = np.diff(ecg[-size - 1:]) ** 2
+        # Moving window integration with the cumulative sum
+        square = np.concatenate([self.square_tail, square])
+        csum = np.concatenate([[0.0], np.cumsum(square)])
+        mwi = (csum[self.window:] - csum[:-self.window]) / self.window
+        # Local maxima of the integrated signal (index of the maximum - from the first processed point)
+        mwi_ext = np.concatenate([self.mwi_tail, mwi])
+        local = np.flatnonzero((mwi_ext[1:-1] > mwi_ext[:-2]) & (mwi_ext[1:-1] >= mwi_ext[2:]))
+
+        for index, value in zip(local + self.n - 1, mwi_ext[local + 1]):
+            # R-peak - maximum of the filtered ECG in the integration window
+            position = index - self.n + ecg.size - size
+            r_peak = int(index - self.window + np.argmax(ecg[position - self.window:position + 1]))
+            if not self.learned:
+                self.learning_candidates.append((index, r_peak, value))
+            else:
+                self.threshold(index, r_peak, value, peaks)
+
+        if not self.learned:
+            self.learning_mwi.append(mwi[:self.learning - self.n])
+            if self.n + size >= self.learning:
+                self.learn(peaks)
+
+        self.n += size
+        self.ecg_tail = ecg[-self.ecg_tail.size:]
+        self.square_tail = square[-self.square_tail.size:]
+        self.mwi_tail = mwi_ext[-2:]
+        # Pending peak can not be replaced anymore
+        if self.pending is not None and self.n - 1 - self.pending[0] > self.refractory + self.window:
+            self.emit(peaks)
+        return self.result(peaks)
+
+    def learn(self, peaks):
+        """
+        Initial signal / noise levels from the learning period (median of maximum values for every second, 
+        so one artifact does not change the levels), then all candidates of this period are checked
+        """
+        mwi = np.concatenate(self.learning_mwi)
+        seconds = mwi[:mwi.size // self.rate * self.rate].reshape(-1, self.rate)
+        self.spki = 0.5 * np.median(seconds.max(axis=1)) if seconds.size else mwi.max()
+        self.npki = 0.5 * np.median(mwi)
+        self.learned = True
+        for index, r_peak, value in self.learning_candidates:
+            self.threshold(index, r_peak, value, peaks)
+        self.learning_mwi = []
+        self.learning_candidates = []
+
+    def threshold(self, index, r_peak, value, peaks):
+        """
+        Adaptive thresholds, refractory and search-back logic for one candidate
+        """
+        threshold = self.npki + 0.25 * (self.spki - self.npki)
+        if value > threshold:
+            self.signal(r_peak, value, peaks)
+        else:
+            self.npki = 0.125 * value + 0.875 * self.npki
+            # Only the biggest candidate is kept (search-back takes only it), so the state does not grow on noise
+            last = self.pending[0] if self.pending is not None else self.last_peak
+            if (last is None or r_peak - last >= self.refractory) and (self.missed is None or value > self.missed[1]):
+                self.missed = (r_peak, value)
+
+        # Search-back: no peak for 1.66 RR intervals - take the biggest missed candidate above threshold / 2
+        last = self.pending[0] if self.pending is not None else self.last_peak
+        if last is None or index - last <= 1.66 * np.mean(self.rr):
+            return
+        if self.missed is not None and self.missed[0] - last >= self.refractory and self.missed[1] > threshold / 2:
+            r_peak, value = self.missed
+            self.spki = 0.25 * value + 0.75 * self.spki
+            self.signal(r_peak, value, peaks)
+
+    def signal(self, r_peak, value, peaks):
+        """
+        Candidate above the threshold: new pending peak (or replace the pending one in the refractory period)
+        """
+        if self.pending is not None and r_peak - self.pending[0] < self.refractory:
+            # Two candidates in the refractory period - keep the bigger one
+            if value > self.pending[1]:
+                self.pending = (r_peak, value)
+            return
+        if self.pending is not None:
+            self.emit(peaks)
+        self.pending = (r_peak, value)
+        # Missed candidate before the new peak is not needed anymore
+        if self.missed is not None and self.missed[0] <= r_peak:
+            self.missed = None
+
+    def emit(self, peaks):
+        """
+        Confirm the pending peak: update signal level and RR intervals, add [peak, RR interval] to the list
+        """
+        r_peak, value = self.pending
+        self.spki = 0.125 * value + 0.875 * self.spki
+        rr = r_peak - self.last_peak if self.last_peak is not None else 0
+        if rr:
+            self.rr.append(rr)
+        peaks.append([r_peak, rr])
+        self.last_peak = r_peak
+        self.pending = None
+
+    def result(self, peaks):
+        """
+        Output: 1. peaks indexes, 2. Hr for every peak (NaN for the first peak)
+        """
+        peaks = np.array(peaks, dtype=np.int64).reshape(-1, 2)
+        return peaks[:, 0], np.where(peaks[:, 1] > 0, 60 * self.rate / np.maximum(peaks[:, 1], 1), np.nan)
+
+    def flush(self):
+        """
+        Output: last pending peak (end of the signal), same format as process()
+        """
+        peaks = []
+        if self.pending is not None:
+            self.emit(peaks)
+        return self.result(peaks)
+
+
+class Vital_cache:
+    """
+    Persistent cache for the vital tracks. 
+    Every track (resampled with the requested interval) is saved as .npy file 
+    and opened as a read-only memory-mapped array, small 'manifest.json' contains metadata.
+    Source of the data - local .vital file (if it exist) or vitaldb api (network).
+    Modification time and size of the local file are kept for every track, 
+    tracks of the changed file are stale and are read again.
+    Several processes can open the same cache and share the same memory pages.
+    """
+    def __init__(self, cache_dir='data/cache'):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+
+    def read_manifest(self):
+        """
+        Output: dictionary with metadata for every cached track (empty if cache not exist)
+        """
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+
+    def key(self, case, track_name, interval):
+        """
+        Output: unique name of the track in the cache (also used as a file name)
+        """
+        return f"{case}_{track_name.replace('/', '_')}_{interval:g}"
+
+    def source_stamp(self, vital_path=None):
+        """
+        Output: dictionary with modification time and size of the local .vital file (None - vitaldb api)
+        """
+        if vital_path and os.path.exists(vital_path):
+            stat = os.stat(vital_path)
+            return {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+        return None
+
+    def is_cached(self, manifest, key, stamp):
+        """
+        Output: True if the track is in the cache and was read from the same version of the source
+        """
+        return key in manifest and manifest[key].get('source') == stamp
+
+    def load(self, case, track_names, interval, vital_path=None):
+        """
+        Input: 1. case - case id (used for the vitaldb api and as a part of the cache key)
+               2. track_names - name of the track or list of the names
+               3. interval - time between two samples, s (= 1 / sample rate)
+               4. vital_path - local .vital file (if None or not exist - use vitaldb api)
+
+        Function return the tracks from the cache. If some track is not in the cache, 
+        function read it from the source and save to the cache.
+
+        Output: 2D-array (Row by time and Column by track) - same as vitaldb.load_case()
+        """
+        if isinstance(track_names, str):
+            track_names = [track_names]
+        manifest = self.read_manifest()
+        stamp = self.source_stamp(vital_path)
+        keys = [self.key(case, name, interval) for name in track_names]
+        missing = [name for name, key in zip(track_names, keys) if not self.is_cached(manifest, key, stamp)]
+        if missing:
+            self.save(case, missing, interval, self.read_source(case, missing, interval, vital_path), stamp)
+            manifest = self.read_manifest()
+
+        tracks = [np.load(os.path.join(self.cache_dir, manifest[key]['file']), mmap_mode='r') for key in keys]
+        # One track - no copy at all, only memory-mapped array
+        if len(tracks) == 1:
+            return tracks[0].reshape(-1, 1)
+        # Tracks from different sources can have different length
+        length = max(track.size for track in tracks)
+        values = np.full((length, len(tracks)), np.nan, dtype=np.result_type(*tracks))
+        for i, track in enumerate(tracks):
+            values[:track.size, i] = track
+        return values
+
+    def load_many(self, case, requests, vital_path=None):
+        """
+        Input: 1. case, vital_path - see load()
+               2. requests - list of (track_names, interval), one for every channel
+
+        Function read all missing tracks with one pass over the source (see read_sources()), 
+        then return them from the cache
+
+        Output: list of 2D-arrays (one for every request, same as load())
+        """
+        manifest = self.read_manifest()
+        stamp = self.source_stamp(vital_path)
+        requests = [([names] if isinstance(names, str) else names, interval) for names, interval in requests]
+        missing = [([name for name in names if not self.is_cached(manifest, self.key(case, name, interval), stamp)], interval) 
+                   for names, interval in requests]
+        missing = [(names, interval) for names, interval in missing if names]
+        if missing:
+            for (names, interval), values in zip(missing, self.read_sources(case, missing, vital_path)):
+                self.save(case, names, interval, values, stamp)
+        return [self.load(case, names, interval, vital_path) for names, interval in requests]
+
+    def read_sources(self, case, requests, vital_path=None):
+        """
+        Input: 1. case, vital_path - see load()
+               2. requests - list of (track_names, interval)
+
+        Function parse the local .vital file (or download the case of the open dataset) only once 
+        for all requests (tracks with different intervals)
+
+        Output: list of 2D-arrays (one for every request)
+        """
+        import vitaldb
+        all_names = sorted({name for names, _ in requests for name in names})
+        vital_file = vitaldb.VitalFile(vital_path if vital_path and os.path.exists(vital_path) else case, all_names)
+        return [vital_file.to_numpy(names, interval) for names, interval in requests]
+
+    def read_source(self, case, track_names, interval, vital_path=None):
+        """
+        Output: 2D-array with tracks from the local .vital file or from vitaldb api
+        """
+        import vitaldb
+        if vital_path and os.path.exists(vital_path):
+            return vitaldb.VitalFile(vital_path, track_names).to_numpy(track_names, interval)
+        return vitaldb.load_case(case, track_names, interval)
+
+    def save(self, case, track_names, interval, values, stamp=None):
+        """
+        Input: 1. case - case id
+               2. track_names - list of the names (one name for every column of values)
+               3. interval - time between two samples, s
+               4. values - 2D-array (Row by time and Column by track)
+               5. stamp - version of the source (source_stamp())
+
+        Function save every column as .npy file and add the metadata to the manifest.
+        Files are written to the temporary name and then renamed, 
+        so other processes never see a half-written track.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest = self.read_manifest()
+        for i, name in enumerate(track_names):
+            key = self.key(case, name, interval)
+            file_name = key + '.npy'
+            tmp_path = os.path.join(self.cache_dir, key + '.tmp.npy')
+            np.save(tmp_path, np.ascontiguousarray(values[:, i]))
+            os.replace(tmp_path, os.path.join(self.cache_dir, file_name))
+            manifest[key] = {'file': file_name, 'case': case, 'track': name, 'interval': interval,
+                             'size': int(values.shape[0]), 'dtype': str(values.dtype), 'source': stamp}
+
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+
+class Compact_array:
+    """
+    Compact storage of one channel: float32 or scaled int16 codes (value = code * scale + offset, 
+    NaN - code 'missing'). Only the requested slice is decoded (to float64), 
+    so windows cost O(window) and the whole channel is never held in float64.
+    """
+    __slots__ = ('codes', 'scale', 'offset')
+    # int16 code for NaN values
+    missing = -32768
+
+    def __init__(self, values, dtype='float32'):
+        """
+        Input: 1. values - 1D-array with the channel values
+               2. dtype - 'float32', 'float64' or 'int16' (scale and offset are found from the min and max values)
+        """
+        values = np.asarray(values, dtype=float)
+        self.scale = 1.0
+        self.offset = 0.0
+        if dtype == 'int16':
+            finite = np.isfinite(values)
+            if finite.any():
+                low, high = values[finite].min(), values[finite].max()
+                self.offset = (high + low) / 2
+                # Codes from -32766 to 32766 (-32768 is reserved for NaN)
+                self.scale = (high - low) / 65532 or 1.0
+            codes = np.full(values.size, self.missing, dtype=np.int16)
+            codes[finite] = np.round((values[finite] - self.offset) / self.scale)
+            self.codes = codes
+        else:
+            self.codes = values.astype(dtype)
+
+    @classmethod
+    def from_codes(cls, codes, scale=1.0, offset=0.0):
+        """
+        Output: Compact_array over the existing codes (no copy, for example memory-mapped codes of the shared store)
+        """
+        array = cls.__new__(cls)
+        array.codes = codes
+        array.scale = scale
+        array.offset = offset
+        return array
+
+    @property
+    def size(self):
+        return self.codes.size
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def __len__(self):
+        return self.codes.size
+
+    def __getitem__(self, key):
+        """
+        Output: decoded values (float64) for the index / slice / array of indexes
+        """
+        codes = np.asarray(self.codes[key])
+        if self.codes.dtype != np.int16:
+            values = codes.astype(float)
+        else:
+            values = np.where(codes == self.missing, np.nan, codes * self.scale + self.offset)
+        # One index - one value (not 0-d array)
+        return values[()] if values.ndim == 0 else values
+
+    def __array__(self, dtype=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+    def valid(self):
+        """
+        Output: indexes of not NaN values
+        """
+        if self.codes.dtype == np.int16:
+            return np.flatnonzero(self.codes != self.missing)
+        return np.flatnonzero(~np.isnan(self.codes))
+
+
+class Min_max_pyramid:
+    """
+    Multi-resolution decimation pyramid for one channel. 
+    Level k contain min and max values for every bin of 2**k points (level 0 - original values). 
+    For the graph only the level with number of bins ~ figure width (pixels) is used, 
+    so the number of points is almost constant for any interval.
+    """
+    __slots__ = ('size', 'mins', 'maxs')
+
+    def __init__(self, values, dtype=np.float32):
+        """
+        Input: 1. values - 1D-array or Compact_array (level 0 is not copied)
+               2. dtype - dtype of the other levels (float32 or 'int16' - Compact_array)
+        """
+        self.size = len(values)
+        self.mins = [values]
+        self.maxs = [values]
+        mins = maxs = np.asarray(values, dtype=float)
+        # Every next level is created from the previous one (pairs of bins), O(n) for all levels
+        while mins.size > 1:
+            if mins.size % 2:
+                mins = np.append(mins, np.nan)
+                maxs = np.append(maxs, np.nan)
+            # fmin/fmax ignore NaN values
+            mins = np.fmin(mins[0::2], mins[1::2])
+            maxs = np.fmax(maxs[0::2], maxs[1::2])
+            if dtype == 'int16':
+                self.mins.append(Compact_array(mins, 'int16'))
+                self.maxs.append(Compact_array(maxs, 'int16'))
+            else:
+                self.mins.append(mins.astype(dtype))
+                self.maxs.append(maxs.astype(dtype))
+
+    @classmethod
+    def from_levels(cls, mins, maxs):
+        """
+        Input: 1. mins, maxs - lists with all levels (level 0 - the channel), no copy
+
+        Output: Min_max_pyramid (for example over the memory-mapped levels of the shared store)
+        """
+        pyramid = cls.__new__(cls)
+        pyramid.size = len(mins[0])
+        pyramid.mins = list(mins)
+        pyramid.maxs = list(maxs)
+        return pyramid
+
+    @property
+    def nbytes(self):
+        """
+        Output: bytes of all levels except level 0 (it is the channel itself)
+        """
+        return sum(array.nbytes for array in self.mins[1:] + self.maxs[1:])
+
+    def level_for(self, n_points, width):
+        """
+        Input: 1. n_points - number of original points in the interval
+               2. width - width of the figure, pixels
+
+        Output: number of the smallest level with no more than 'width' bins in the interval
+        """
+        level = 0
+        while level < len(self.mins) - 1 and -(-n_points // 2**level) > width:
+            level += 1
+        return level
+
+    def get(self, start, stop, level):
+        """
+        Input: 1. start, stop - indexes of the original points, [start, stop)
+               2. level - level of the pyramid
+
+        Output: 1. position - index of the original point for every value
+                2. values - min and max values of every bin (one after another)
+        """
+        start = min(max(start, 0), self.size)
+        stop = min(max(stop, start), self.size)
+        if level == 0:
+            return np.arange(start, stop), self.mins[0][start:stop]
+        step = 2**level
+        first = start // step
+        last = -(-stop // step)
+        bins = np.arange(first, last) * step
+        position = np.empty(2 * bins.size, dtype=int)
+        position[0::2] = bins
+        position[1::2] = bins + step // 2
+        values = np.empty(2 * bins.size)
+        values[0::2] = self.mins[level][first:last]
+        values[1::2] = self.maxs[level][first:last]
+        return position, values
+
+
+class Quality_mask:
+    """
+    Run-length mask of the bad parts of one channel: lead-off (no signal, NaN), saturation (out of the valid range),
+    clipping (stuck at the rail of the channel) and flatline. Only the runs are kept ([start, stop) in the samples
+    of the channel, kind - number in KINDS), not a flag for every sample, so hours of signal with some artifacts
+    take a few bytes. Runs of all kinds are also merged into one sorted list without overlaps,
+    so the bad and good spans of any window are found by binary search in O(log n + k).
+    """
+    KINDS = ('lead-off', 'saturation', 'clipping', 'flatline')
+    __slots__ = ('size', 'start', 'stop', 'kind', 'merged_start', 'merged_stop')
+
+    def __init__(self, size, start=(), stop=(), kind=()):
+        """
+        Input: 1. size - number of samples of the channel
+               2. start, stop, kind - runs of the bad samples (kind - number in KINDS)
+        """
+        self.size = size
+        start = np.asarray(start, dtype=np.int64)
+        order = np.argsort(start, kind='stable')
+        self.start = start[order].astype(np.int32)
+        self.stop = np.asarray(stop, dtype=np.int64)[order].astype(np.int32)
+        self.kind = np.asarray(kind, dtype=np.int8)[order]
+        # Overlapping runs (different kinds) are merged: a new run starts after the running max of the stops
+        if self.start.size:
+            max_stop = np.maximum.accumulate(self.stop)
+            first = np.flatnonzero(np.concatenate([[True], self.start[1:] > max_stop[:-1]]))
+            self.merged_start = self.start[first]
+            self.merged_stop = np.maximum.reduceat(self.stop, first)
+        else:
+            self.merged_start = self.merged_stop = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return self.merged_start.size
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.start, self.stop, self.kind, self.merged_start, self.merged_stop))
+
+    def bad_spans(self, start=0, stop=None):
+        """
+        Input: 1. start, stop - indexes of the channel samples, [start, stop) (None - to the end)
+
+        Output: starts, stops of the bad spans inside the interval (cut at its borders)
+        """
+        stop = self.size if stop is None else stop
+        first = np.searchsorted(self.merged_stop, start, side='right')
+        last = np.searchsorted(self.merged_start, stop, side='left')
+        return (np.maximum(self.merged_start[first:last], start).astype(np.int64),
+                np.minimum(self.merged_stop[first:last], stop).astype(np.int64))
+
+    def good_spans(self, start=0, stop=None, min_length=0):
+        """
+        Input: 1. start, stop - indexes of the channel samples, [start, stop) (cut at the end of the channel)
+               2. min_length - shorter good spans are skipped
+
+        Output: list of (start, stop) of the good spans inside the interval
+        """
+        stop = min(self.size if stop is None else stop, self.size)
+        if stop <= start:
+            return []
+        bad_start, bad_stop = self.bad_spans(start, stop)
+        starts = np.concatenate([[start], bad_stop])
+        stops = np.concatenate([bad_start, [stop]])
+        keep = stops - starts >= max(min_length, 1)
+        return list(zip(starts[keep].tolist(), stops[keep].tolist()))
+
+    def mask(self, start=0, stop=None):
+        """
+        Output: 1D boolean array for the interval [start, stop) (True - bad sample)
+        """
+        stop = self.size if stop is None else stop
+        bad_start, bad_stop = self.bad_spans(start, stop)
+        edges = np.zeros(max(stop - start, 0) + 1, dtype=np.int8)
+        edges[bad_start - start] += 1
+        edges[bad_stop - start] -= 1
+        return np.cumsum(edges[:-1]) > 0
+
+    def overlaps(self, starts, stops):
+        """
+        Input: 1. starts, stops - 1D-arrays with the intervals [start, stop) (for example RR intervals)
+
+        Output: 1D boolean array (True - the interval contain bad samples)
+        """
+        return (np.searchsorted(self.merged_start, stops, side='left')
+                > np.searchsorted(self.merged_stop, starts, side='right'))
+
+    def bad_samples(self, start=0, stop=None):
+        """
+        Output: number of bad samples in the interval [start, stop)
+        """
+        bad_start, bad_stop = self.bad_spans(start, stop)
+        return int((bad_stop - bad_start).sum())
+
+    def frame(self):
+        """
+        Output: df with start, stop and kind of all runs (before the merge)
+        """
+        return pd.DataFrame({'start': self.start, 'stop': self.stop, 'kind': np.array(self.KINDS)[self.kind]})
+
+
+class Signal_store:
+    """
+    Multi-rate signal store. Every channel is kept as its own Compact_array with its own sampling rate 
+    (time of the sample = index / rate, no stored 'Time' column), so any time window is found by integer 
+    index arithmetic, without merges on the float 'Time' column. 
+    Window extraction costs O(window), not O(case).
+    """
+    __slots__ = ('base', 'channels', 'rates', 'valid', 'pyramids', 'quality')
+
+    def __init__(self, base='ECG'):
+        # Base channel define the time grid of the frames (ECG - 500 Hz)
+        self.base = base
+        self.channels = {}
+        self.rates = {}
+        # Indexes of not NaN values (only for the channels that were interpolated)
+        self.valid = {}
+        # Min/max pyramids (only for the channels that were drawn)
+        self.pyramids = {}
+        # Quality_mask of the channels (bad parts are skipped by the processing)
+        self.quality = {}
+
+    def add(self, name, values, rate, dtype='float32'):
+        """
+        Input: 1. name - name of the channel ('ECG', 'co2', 'Hr', ...)
+               2. values - 1D-array with the channel values
+               3. rate - sampling rate of the channel, Hz
+               4. dtype - storage type of the values ('float32', 'float64' or 'int16', see Compact_array)
+        """
+        self.channels[name] = Compact_array(values, dtype)
+        self.rates[name] = rate
+        self.valid.pop(name, None)
+        self.pyramids.pop(name, None)
+        self.quality.pop(name, None)
+
+    def pyramid(self, name):
+        """
+        Output: Min_max_pyramid for the channel (created once, on first request)
+        """
+        if name not in self.pyramids:
+            # Levels are kept in the same compact form as the channel
+            values = self.channels[name]
+            self.pyramids[name] = Min_max_pyramid(values, 'int16' if values.codes.dtype == np.int16 else np.float32)
+        return self.pyramids[name]
+
+    def index(self, name, time):
+        """
+        Output: index of the first sample of the channel with sample time >= time
+        """
+        # Rounding removes float noise (for example 1000 / 500 * 62.5)
+        return max(0, int(np.ceil(round(time * self.rates[name], 6))))
+
+    def length(self):
+        """
+        Output: number of points in the base time grid that covers all channels
+        """
+        base_rate = self.rates[self.base]
+        return max(int(round((values.size - 1) * base_rate / self.rates[name])) + 1 
+                   for name, values in self.channels.items())
+
+    def window(self, names, t0, t1):
+        """
+        Input: 1. names - list of the channels
+               2. t0, t1 - time interval [t0, t1), s
+
+        Output: dictionary {name: (time, values)}, values - decoded values of the window only
+        """
+        result = {}
+        for name in names:
+            values = self.channels[name]
+            i0 = min(self.index(name, t0), values.size)
+            i1 = min(self.index(name, t1), values.size)
+            result[name] = (np.arange(i0, i1) / self.rates[name], values[i0:i1])
+        return result
+
+    def interpolate(self, name, time):
+        """
+        Input: 1. name - name of the channel
+               2. time - 1D-array with time values (sorted)
+
+        Function linear interpolate the channel (NaN values are skipped) to the time points. 
+        Only the samples inside the time range + one valid neighbour on each side are used.
+        Before the first valid sample - NaN, after the last valid sample - last value (as pandas 'interpolate').
+
+        Output: 1D-array with interpolated values
+        """
+        values = self.channels[name]
+        rate = self.rates[name]
+        if name not in self.valid:
+            self.valid[name] = values.valid().astype(np.int32)
+        valid = self.valid[name]
+        result = np.full(time.size, np.nan)
+        if valid.size == 0 or time.size == 0:
+            return result
+        # Valid samples around the time range
+        left = max(np.searchsorted(valid, self.index(name, time[0]), side='left') - 1, 0)
+        right = min(np.searchsorted(valid, self.index(name, time[-1]), side='left') + 1, valid.size)
+        idx = valid[left:right]
+        result[:] = np.interp(time, idx / rate, values[idx])
+        result[time < valid[0] / rate] = np.nan
+        return result
+
+    @diagnostics.timed('window frame', samples=lambda self, start, stop, *args, **kwargs: stop - start)
+    def frame(self, start, stop, names=None, interpolate=()):
+        """
+        Input: 1. start, stop - indexes of the base time grid (for ECG == time in seconds * 500), [start, stop)
+               2. names - channels in the frame (None - all channels)
+               3. interpolate - channels that are interpolated to every point of the time grid 
+                  (other channels are aligned: values only in their own sample times, NaN in other rows)
+
+        Output: df (index - base grid index, columns - 'Time' and channels)
+        """
+        names = list(self.channels) if names is None else names
+        base_rate = self.rates[self.base]
+        grid = np.arange(start, stop)
+        time = grid / base_rate
+        df = pd.DataFrame({'Time': time}, index=grid)
+
+        for name in names:
+            values = self.channels[name]
+            rate = self.rates[name]
+            if name in interpolate:
+                df[name] = self.interpolate(name, time)
+                continue
+            column = np.full(grid.size, np.nan)
+            i0 = min(self.index(name, start / base_rate), values.size)
+            i1 = min(self.index(name, stop / base_rate), values.size)
+            # Position of every sample of the channel in the base grid
+            position = np.round(np.arange(i0, i1) * base_rate / rate).astype(int) - start
+            keep = position < grid.size
+            column[position[keep]] = values[i0:i1][keep]
+            df[name] = column
+        return df
+
+    def memory_report(self):
+        """
+        Output: dictionary {'channel name' / 'pyramid name' / 'valid name' / 'quality name': bytes}, 
+                arrays of the Shared_case_store have the 'shared ' prefix (pages are shared by all processes)
+        """
+        def key(kind, name, array):
+            array = getattr(array, 'codes', array)
+            return f'shared {kind} {name}' if isinstance(array, np.memmap) else f'{kind} {name}'
+
+        report = {key('channel', name, values): values.nbytes for name, values in self.channels.items()}
+        report.update({key('pyramid', name, pyramid.mins[-1]): pyramid.nbytes for name, pyramid in self.pyramids.items()})
+        report.update({key('valid', name, valid): valid.nbytes for name, valid in self.valid.items()})
+        report.update({key('quality', name, quality.start): quality.nbytes for name, quality in self.quality.items()})
+        return report
+
+
+class Tile_cache:
+    """
+    LRU cache for the processed tiles and results. Size of the cache is limited by memory (bytes of all arrays), 
+    the least recently used entries are removed first. 
+    compute() is single-flight: when several threads (sessions) ask for the same missing key at the same time, 
+    only one computation runs and the others wait for its result. 
+    Cached arrays are read-only, so one caller can not change the result of the others.
+    Values bigger than the whole cache are returned to the caller, but not stored.
+    """
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        # Callers that waited for the computation of the other caller
+        self.waits = 0
+        # Values that were not stored (bigger than max_bytes)
+        self.oversized = 0
+        # Futures of the keys that are computed now
+        self.pending = {}
+        # Tiles can be requested from several threads (streaming workers, sessions)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Output: cached value (dictionary with arrays) or None
+        """
+        with self.lock:
+            value = self.tiles.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Input: 1. key - any hashable key
+               2. value - dictionary with arrays (arrays become read-only)
+
+        Output: True if the value is stored (False - it is bigger than the whole cache)
+        """
+        for array in value.values():
+            array.setflags(write=False)
+        size = self.size(value)
+        with self.lock:
+            if key in self.tiles:
+                self.nbytes -= self.size(self.tiles.pop(key))
+            # One huge value (whole case analysis) would push out all other entries
+            if size > self.max_bytes:
+                self.oversized += 1
+                return False
+            self.tiles[key] = value
+            self.nbytes += size
+            # Remove old tiles
+            while self.nbytes > self.max_bytes:
+                _, old_value = self.tiles.popitem(last=False)
+                self.nbytes -= self.size(old_value)
+        return True
+
+    def compute(self, key, function):
+        """
+        Input: 1. key - any hashable key
+               2. function - function() that return the value (dictionary with arrays)
+
+        Output: cached value, value of the computation that runs now (wait for it) or new value
+        """
+        owner = None
+        with self.lock:
+            value = self.tiles.get(key)
+            if value is not None:
+                self.hits += 1
+                self.tiles.move_to_end(key)
+                return value
+            future = self.pending.get(key)
+            if future is not None:
+                self.waits += 1
+            else:
+                self.misses += 1
+                future = self.pending[key] = Future()
+                future.set_running_or_notify_cancel()
+                owner = future
+        if owner is not future:
+            return future.result()
+        try:
+            value = function()
+            self.put(key, value)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+        return value
+
+    def __contains__(self, key):
+        # Check without the counters and the LRU order (for the prefetch)
+        with self.lock:
+            return key in self.tiles
+
+    def size(self, value):
+        """
+        Output: number of bytes in all arrays of the value
+        """
+        return sum(array.nbytes for array in value.values())
+
+    def stats(self):
+        """
+        Output: dictionary with the number of entries, bytes and counters
+        """
+        with self.lock:
+            return {'entries': len(self.tiles), 'bytes': self.nbytes, 'hits': self.hits, 
+                    'misses': self.misses, 'waits': self.waits, 'oversized': self.oversized}
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.nbytes = 0
+
+
 #Data store and convert:
+class Hrv_metrics:
+    """
+    HRV and rhythm irregularity metrics for the whole case. RR intervals are found once from the R-peaks 
+    and kept as cumulative sums, so the metrics for any range cost O(log n) (two searchsorted) 
+    and the rolling windows for the whole case are vectorized, O(n).
+    Metrics: SDNN and RMSSD (ms), pNN50, coefficient of variation of RR, mean Hr and share of beats with Hr > 100 bpm.
+    """
+    __slots__ = ('rate', 'peaks', 'time', 'rr', 'reference', 'cum', 'windows')
+
+    def __init__(self, peaks, rate=500, min_rr=0.25, max_rr=2.0):
+        """
+        Input: 1. peaks - indexes of the R-peaks (ECG time grid)
+               2. rate - sampling rate of the ECG
+               3. min_rr, max_rr - RR intervals out of this range (s) are artifacts / gaps and are skipped
+        """
+        peaks = np.unique(np.asarray(peaks, dtype=np.int64))
+        self.rate = rate
+        self.peaks = peaks
+        self.rr = np.diff(peaks) / rate
+        # Every interval belongs to the time of the beat that closes it
+        self.time = peaks[1:] / rate
+        valid = (self.rr >= min_rr) & (self.rr <= max_rr)
+        # Successive differences only between two valid neighbour intervals
+        diff = np.zeros(self.rr.size)
+        diff[1:] = np.diff(self.rr)
+        diff_valid = np.zeros(self.rr.size, dtype=bool)
+        diff_valid[1:] = valid[1:] & valid[:-1]
+        # Sums of (rr - reference) keep the variance exact for the long cases
+        self.reference = float(np.median(self.rr[valid])) if valid.any() else 0.0
+        centered = np.where(valid, self.rr - self.reference, 0.0)
+        terms = np.vstack([valid, centered, centered**2, valid & (self.rr < 0.6),
+                           diff_valid, np.where(diff_valid, diff**2, 0.0), diff_valid & (np.abs(diff) > 0.05)])
+        self.cum = np.zeros((terms.shape[0], self.rr.size + 1))
+        self.cum[:, 1:] = np.cumsum(terms, axis=1)
+        # Rolling metrics for every (window, step)
+        self.windows = {}
+
+    def metrics(self, i0, i1):
+        """
+        Input: 1. i0, i1 - numbers of the first and the last (not included) intervals (numbers or arrays)
+
+        Output: dictionary {metric: value or array}, NaN if there are not enough beats
+        """
+        n, s, s2, tachy, n_diff, d2, nn50 = self.cum[:, i1] - self.cum[:, i0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = self.reference + s / n
+            # One beat - no SDNN (rounding of the sums would give inf, not NaN)
+            sdnn = np.where(n > 1, np.sqrt(np.maximum(s2 - s**2 / n, 0) / np.maximum(n - 1, 1)), np.nan)
+            return {'beats': n, 'mean hr': 60 / mean, 'sdnn': 1000 * sdnn, 'rmssd': 1000 * np.sqrt(d2 / n_diff),
+                    'pnn50': nn50 / n_diff, 'cv': sdnn / mean, 'tachycardia': tachy / n}
+
+    def summary(self, start, stop):
+        """
+        Input: 1. start, stop - indexes in the ECG time grid (time in seconds * rate), [start, stop)
+
+        Output: dictionary {metric: value} for all beats in the range
+        """
+        i0, i1 = np.searchsorted(self.time, [start / self.rate, stop / self.rate], side='left')
+        return {name: float(value) for name, value in self.metrics(i0, i1).items()}
+
+    def rolling(self, window=60, step=5):
+        """
+        Input: 1. window - length of the sliding window, s
+               2. step - step between two windows, s
+
+        Output: df with the end time of every window ('Time') and the metrics (cached for every window and step)
+        """
+        if (window, step) not in self.windows:
+            last = self.time[-1] if self.time.size else 0
+            end = np.arange(window, last + step, step, dtype=float)
+            i0 = np.searchsorted(self.time, end - window, side='left')
+            i1 = np.searchsorted(self.time, end, side='left')
+            df = pd.DataFrame(self.metrics(i0, i1))
+            df.insert(0, 'Time', end)
+            self.windows[(window, step)] = df
+        return self.windows[(window, step)]
+
+
+class Event_index:
+    """
+    Sorted interval index of the clinical events of the case. Every event has start and stop 
+    (ECG time grid, [start, stop)), kind ('tachycardia', 'co2 break', ...) and score (how strong the event is).
+    Events are sorted by start, a running max of the stops gives the range query in O(log n + k) 
+    and the nearest event in O(log n). Indexes for every kind are created once, on first request.
+    """
+    __slots__ = ('start', 'stop', 'kind', 'score', 'max_stop', 'kinds')
+
+    def __init__(self, start=(), stop=(), kind=(), score=()):
+        start = np.asarray(start, dtype=np.int64)
+        order = np.argsort(start, kind='stable')
+        self.start = start[order]
+        self.stop = np.asarray(stop, dtype=np.int64)[order]
+        self.kind = np.asarray(kind, dtype=str)[order]
+        self.score = np.asarray(score, dtype=float)[order]
+        self.max_stop = np.maximum.accumulate(self.stop) if self.stop.size else self.stop
+        self.kinds = {}
+
+    def __len__(self):
+        return self.start.size
+
+    def select(self, kind):
+        """
+        Output: Event_index only with the events of this kind
+        """
+        if kind not in self.kinds:
+            keep = self.kind == kind
+            self.kinds[kind] = Event_index(self.start[keep], self.stop[keep], self.kind[keep], self.score[keep])
+        return self.kinds[kind]
+
+    def range(self, start, stop, kind=None):
+        """
+        Input: 1. start, stop - indexes of the ECG time grid, [start, stop)
+               2. kind - only the events of this kind (None - all events)
+
+        Output: df with the events that overlap the range (sorted by start)
+        """
+        if kind is not None:
+            return self.select(kind).range(start, stop)
+        last = np.searchsorted(self.start, stop, side='left')
+        first = np.searchsorted(self.max_stop[:last], start, side='right')
+        number = np.arange(first, last)
+        return self.frame(number[self.stop[number] > start])
+
+    def nearest(self, index, kind=None):
+        """
+        Input: 1. index - index of the ECG time grid
+               2. kind - only the events of this kind (None - all events)
+
+        Output: dictionary with the nearest event (the event that contain the index, if exist) or None
+        """
+        if kind is not None:
+            return self.select(kind).nearest(index)
+        if not len(self):
+            return None
+        position = np.searchsorted(self.start, index, side='right')
+        candidates = []
+        if position > 0:
+            if self.max_stop[position - 1] > index:
+                # Some event contain the index: the first one with the stop after the index
+                first = np.searchsorted(self.max_stop[:position], index, side='right')
+                number = first + np.flatnonzero(self.stop[first:position] > index)[0]
+                return self.event(number)
+            # Event with the last stop before the index
+            candidates.append((index - self.max_stop[position - 1],
+                               np.searchsorted(self.max_stop[:position], self.max_stop[position - 1], side='left')))
+        if position < len(self):
+            candidates.append((self.start[position] - index, position))
+        return self.event(min(candidates)[1])
+
+    def event(self, number):
+        """
+        Output: dictionary with the event values
+        """
+        return {'start': int(self.start[number]), 'stop': int(self.stop[number]),
+                'kind': str(self.kind[number]), 'score': float(self.score[number])}
+
+    def frame(self, number=None):
+        """
+        Output: df with start, stop, kind and score of the events (all events or only 'number')
+        """
+        number = slice(None) if number is None else number
+        return pd.DataFrame({'start': self.start[number], 'stop': self.stop[number],
+                             'kind': self.kind[number], 'score': self.score[number]})
+
+
+class Case_loader:
+    """
+    Load the case in a background thread, so the server can serve the pages at once.
+    Pages check 'ready' (and show 'progress' / 'status' while waiting) and then use 'result'.
+    """
+    def __init__(self, function, warm_up=None, **kwargs):
+        """
+        Input: 1. function - function that return the data, gets 'progress' (function(fraction, text)) and **kwargs
+               2. warm_up - function(result) that runs after the loading (heavy imports, first tiles), optional
+        """
+        self.function = function
+        self.warm_up = warm_up
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self.progress = 0.0
+        self.status = 'Waiting'
+        self.loaded = threading.Event()
+        self.thread = None
+
+    @property
+    def ready(self):
+        return self.loaded.is_set() and self.error is None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def update(self, fraction, text):
+        self.progress = fraction
+        self.status = text
+
+    def start(self):
+        """
+        Start the loading (only once)
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='case loader', daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        try:
+            self.result = self.function(progress=self.update, **self.kwargs)
+        except Exception as error:
+            self.error = error
+            self.update(self.progress, f'Loading failed: {error}')
+            self.loaded.set()
+            return
+        self.update(1.0, 'Ready')
+        # Data is available, the warm-up only makes the first page faster
+        self.loaded.set()
+        if self.warm_up is not None:
+            try:
+                self.warm_up(self.result)
+            except Exception:
+                pass
+
+    def wait(self, timeout=None):
+        """
+        Output: result of the function (None if it is not ready after 'timeout' seconds)
+        """
+        self.start()
+        self.loaded.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
 class Data_store:
     """
     This class allows you to store information in raw form, 
     and the methods allow you to do some processing of the ECG signal 
     """
-    def __init__(self, raw_df):
-        self.raw_data = raw_df
+    # Size of one processed tile and extra points on each side (filter / peak detection edge effects)
+    tile_size = 20000
+    tile_overlap = 1000
+    # Shorter good spans between the artifacts are not processed (1 s)
+    min_span = 500
+    # Peaks closer than this number of points are the same peak (100 ms, the beat found by both tiles of the border)
+    min_distance = 50
+    __slots__ = ('signals', '_raw_data', 'tiles', 'results', 'stream_results', 'hrv', 'events')
+
+    def __init__(self, signals, cache_bytes=256 * 2**20, result_bytes=64 * 2**20, stream_bytes=16 * 2**20):
+        self.signals = signals
+        self._raw_data = None
+        self.tiles = Tile_cache(cache_bytes)
+        # Results for the ranges (module.data_transformation), shared by all sessions
+        self.results = Tile_cache(result_bytes)
+        # Streaming blocks (module.give_values_for_streaming) have their own small cache, 
+        # so live streaming does not push out the analysis results of the other sessions
+        self.stream_results = Tile_cache(stream_bytes)
+        # Hrv_metrics and Event_index of the whole case (see module.case_hrv and module.case_events)
+        self.hrv = None
+        self.events = None
+
+    @property
+    def raw_data(self):
+        """
+        Full df with all channels on the ECG time grid (as one big merged table). 
+        Created only on demand, processing functions use window frames from self.signals
+        """
+        if self._raw_data is None:
+            self._raw_data = self.signals.frame(0, self.signals.length())
+        return self._raw_data
 
-    def fourier_transform(self, ecg):
+    def window_frame(self, start, stop, interpolate=()):
+        """
+        Input: 1. start, stop - indexes in the ECG time grid (time in seconds * 500), [start, stop)
+               2. interpolate - channels that are interpolated to every row
+
+        Output: df with Time, ECG, co2 and Hr only for this interval
+        """
+        return self.signals.frame(start, stop, interpolate=interpolate)
+
+    def transform_tile(self, number):
+        """
+        Input: 1. number - number of the tile (tile contain [number * tile_size : (number + 1) * tile_size] points)
+
+        Function return the tile from the tile cache (process_tile() runs once for the tile, 
+        also when several sessions ask for it at the same time)
+
+        Output: dictionary {'ECG_f': filtered ECG for the tile, 
+                            'peaks': peaks indexes (ECG time grid) inside the tile, 'hr': calculated Hr for every peak}
+        """
+        return self.tiles.compute(number, lambda: self.process_tile(number))
+
+    @diagnostics.timed('tile', samples=lambda self, number: self.tile_size)
+    def process_tile(self, number):
+        """
+        Function filter the ECG and find peaks and Hr for the tile (with overlap on both sides)
+
+        Output: dictionary (see transform_tile())
+        """
+        start = number * self.tile_size
+        stop = start + self.tile_size
+        # Tile + overlap, so the filter and the peak detection have the data before and after the tile
+        ext_start = max(start - self.tile_overlap, 0)
+        df = self.window_frame(ext_start, stop + self.tile_overlap)
+        ecg_f, peaks, hr = self.process_spans(df, self.good_spans(ext_start, stop + self.tile_overlap))
+
+        inside = (peaks >= start) & (peaks < stop)
+        # Compact tile: float32 values and sparse peaks (indexes and Hr only for the peaks)
+        tile = {'ECG_f': ecg_f[start - ext_start:stop - ext_start].astype(np.float32),
+                'peaks': peaks[inside].astype(np.int32), 
+                'hr': hr[inside].astype(np.float32)}
+        return tile
+
+    def good_spans(self, start, stop):
+        """
+        Output: list of (start, stop) of the ECG parts without artifacts in the interval (see Quality_mask), 
+                the whole interval if the case has no quality mask
+        """
+        quality = self.signals.quality.get('ECG') if self.signals is not None else None
+        if quality is None:
+            return [(start, stop)]
+        return quality.good_spans(start, stop, self.min_span)
+
+    def process_spans(self, df, spans):
+        """
+        Input: 1. df - window frame with the 'ECG' column (index - ECG time grid)
+               2. spans - list of (start, stop) inside the frame (see good_spans())
+
+        Function filter the ECG and find peaks only inside the spans, the masked artifacts 
+        are not filtered and give no peaks (the filter and the peak detection start again in every span)
+
+        Output: 1. ecg_f - filtered ECG for the frame (NaN outside the spans)
+                2. peaks - peaks indexes (ECG time grid)
+                3. hr - calculated Hr for every peak (NaN for the first peak of every span)
+        """
+        first = df.index[0] if len(df) else 0
+        ecg_f = np.full(len(df), np.nan)
+        peaks, hr = [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+        for span_start, span_stop in spans:
+            part = df.iloc[span_start - first:span_stop - first].copy()
+            part.loc[:, 'ECG_f'] = self.fourier_transform(part.loc[:, 'ECG'].to_numpy())
+            ecg_f[span_start - first:span_stop - first] = part.loc[:, 'ECG_f'].to_numpy()
+            df_p, _ = self.find_peaks_and_hr(part)
+            peaks.append(df_p.loc[:, 'index'].to_numpy(dtype=np.int64))
+            hr.append(df_p.loc[:, 'hr'].to_numpy(dtype=float))
+        return ecg_f, np.concatenate(peaks), np.concatenate(hr)
+
+    def transform_range(self, start, stop):
+        """
+        Input: 1. start, stop - indexes in the ECG time grid, [start, stop)
+
+        Function collect the result for any interval from the cached tiles
+
+        Output: 1. ecg_f - filtered ECG for the interval
+                2. peaks - peaks indexes (ECG time grid)
+                3. hr - calculated Hr for every peak
+        """
+        if stop <= start:
+            return np.zeros(0), np.zeros(0, dtype=int), np.zeros(0)
+        tiles = [self.transform_tile(number) for number in range(start // self.tile_size, (stop - 1) // self.tile_size + 1)]
+        first = (start // self.tile_size) * self.tile_size
+        ecg_f = np.concatenate([tile['ECG_f'] for tile in tiles])[start - first:stop - first]
+        peaks = np.concatenate([tile['peaks'] for tile in tiles])
+        hr = np.concatenate([tile['hr'] for tile in tiles])
+        inside = (peaks >= start) & (peaks < stop)
+        peaks, hr = peaks[inside], hr[inside]
+        # Stitching of the tiles: the same peak found on both sides of the border with a small shift 
+        # is merged (the first one is kept, as module.whole_case_peaks)
+        keep = np.concatenate([[True], np.diff(peaks) >= self.min_distance]) if peaks.size else np.zeros(0, dtype=bool)
+        return ecg_f, peaks[keep], hr[keep]
+
+    def memory_report(self):
+        """
+        Function count the bytes held by the case: raw channels, derived products (pyramids, 
+        interpolation indexes, processed tiles, cached results) and the full raw_data frame (only if it was created)
+
+        Output: dictionary {name: bytes} with the 'total' key (bytes of this process) 
+                and the 'shared total' key (memory-mapped arrays of the Shared_case_store)
+        """
+        report = self.signals.memory_report()
+        with self.tiles.lock:
+            report['tiles'] = self.tiles.nbytes
+        with self.results.lock:
+            report['results'] = self.results.nbytes
+        with self.stream_results.lock:
+            report['stream results'] = self.stream_results.nbytes
+        if self.hrv is not None:
+            report['hrv'] = self.hrv.cum.nbytes + self.hrv.rr.nbytes + self.hrv.time.nbytes + self.hrv.peaks.nbytes
+        if self.events is not None:
+            report['events'] = sum(array.nbytes for array in (self.events.start, self.events.stop, self.events.kind, self.events.score))
+        if self._raw_data is not None:
+            report['raw_data'] = int(self._raw_data.memory_usage(index=True, deep=True).sum())
+        shared = sum(value for name, value in report.items() if name.startswith('shared'))
+        report['total'] = sum(report.values()) - shared
+        report['shared total'] = shared
+        return report
+
+    @diagnostics.timed('fir filter', samples=lambda self, ecg, *args, **kwargs: len(ecg))
+    def fourier_transform(self, ecg, engine='block', channel='ECG'):
         """
         Input: 1. ecg - raw ECG signal
+               2. engine - 'block' (vectorized Block_fir_filter) or 'stream' (fir_filter generator)
+               3. channel - name of the channel in FILTER_BANK (filter parameters)
 
         Function use a fourier filter to smooth the signal
 
         Output: ecg_fourier - smoothed signal
         """
-        # Create filter (generate impuls respons)
-        f = np.fft.fftshift(np.fft.fftfreq(5000, 1/500))
-        c_add = np.linspace(-1.0, 1.0, 399, endpoint=False)
-        c_add = np.concatenate([np.zeros(2301), np.abs(c_add[::-1])])
-        c_add = np.concatenate([c_add, np.zeros(2300)])
-        c_filter = ((np.abs(f) >= 20) + c_add )
-        impuls_respons = np.fft.ifft(np.fft.ifftshift(c_filter) / 5000.0, norm='forward').real
-        elem = 100
-        finite_impuls_respons = np.roll(impuls_respons, elem//2)[:elem] * hamming(elem)
-        
+        # Take filter (impuls respons) from the cached filter bank
+        finite_impuls_respons = filter_bank(channel)
+
         # Use filter
-        ecg_fourier = np.array([zi for zi in fir_filter(ecg, finite_impuls_respons)])
+        if engine == 'stream':
+            ecg_fourier = np.array([zi for zi in fir_filter(ecg, finite_impuls_respons)])
+        else:
+            ecg_fourier = Block_fir_filter(finite_impuls_respons).process(ecg)
         
         return ecg_fourier
 
+    @diagnostics.timed('peak detection', samples=lambda self, ecg: len(ecg))
     def find_peaks_and_hr(self, ecg):
         """
         Input: 1. ecg - df that contain column ('ECG_f') with smoothed ECG signal
@@ -61,6 +1414,7 @@ class Data_store:
         (new column - label of peak occurrence) and a new column with the calculated Hr.
                 2. info['ECG_R_Peaks_Uncorrected'] - list of peaks indexes
         """
+        import neurokit2 as nk
         ecg = ecg.dropna(subset=['ECG_f'])
         ecg = ecg.reset_index()
         signals, info = nk.ecg_peaks(ecg.loc[:,'ECG_f'], sampling_rate=500, correct_artifacts=True, show=False)
@@ -73,10 +1427,302 @@ class Data_store:
         return df_peaks, info['ECG_R_Peaks_Uncorrected']
 
 
+
+def lock_handle(handle):
+    """
+    Input: 1. handle - open file
+
+    Function try to take the exclusive lock of the file without waiting 
+    (fcntl.flock on Linux / macOS, msvcrt.locking of the first byte on Windows)
+
+    Output: True if the lock is taken
+    """
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def unlock_handle(handle):
+    if os.name == 'nt':
+        import msvcrt
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+class Shared_case_store:
+    """
+    Case store shared between the server processes. The first process (owner, holds the lock of 'owner.lock') 
+    loads the case and publishes the arrays of every channel, pyramid level, HRV peaks and events 
+    as .npy files, other processes open them as read-only memory-mapped arrays (same pages, no copy, no loading).
+    'manifest.json' is written last (temporary name and rename, as Vital_cache), 
+    so the other processes never see half-written data.
+    Directory in the shared memory (/dev/shm/... on Linux) - no disk at all, any other directory - shared page cache.
+    """
+    # Version of the published layout (manifest keys, file names), part of the source key
+    schema = 2
+
+    def __init__(self, directory='data/shared', poll=0.2):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.lock_path = os.path.join(directory, 'owner.lock')
+        self.poll = poll
+        self.owner = False
+        # Open and locked lock file of the owner
+        self.lock_file = None
+        # Arguments of the loading function and True if the products were attached (see open())
+        self.source = None
+        self.attached = False
+
+    def code_version(self, function):
+        """
+        Output: schema version + hash of the processing code (this file and the module of the loading function), 
+                a copy published by the other version of the code is not used
+        """
+        digest = hashlib.sha1(str(self.schema).encode())
+        for path in sorted({__file__, getattr(sys.modules.get(function.__module__), '__file__', None) or __file__}):
+            with open(path, 'rb') as source_file:
+                digest.update(source_file.read())
+        return digest.hexdigest()[:16]
+
+    def read_manifest(self):
+        """
+        Output: dictionary with metadata of the published arrays (empty if nothing is published)
+        """
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+
+    def write_manifest(self, manifest):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def acquire(self):
+        """
+        Output: True - this process is the owner (it loads and publishes the case)
+        """
+        if self.owner:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        # Lock of the open file is released by the OS when the owner process is finished (also killed),
+        # so the lock of a dead owner is never left behind
+        lock_file = open(self.lock_path, 'a+')
+        if not lock_handle(lock_file):
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self.lock_file = lock_file
+        self.owner = True
+        return True
+
+    def release(self):
+        if self.owner:
+            self.owner = False
+            unlock_handle(self.lock_file)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def owner_alive(self):
+        """
+        Output: False if there is no owner (lock file is missing or not locked - the owner process is finished)
+        """
+        if self.owner:
+            return True
+        if not os.path.exists(self.lock_path):
+            return False
+        with open(self.lock_path, 'a+') as lock_file:
+            if lock_handle(lock_file):
+                unlock_handle(lock_file)
+                return False
+        return True
+
+    def save(self, name, array):
+        """
+        Output: file name of the saved array (temporary name and rename)
+        """
+        file_name = name.replace(' ', '_') + '.npy'
+        tmp_path = os.path.join(self.directory, file_name + '.tmp.npy')
+        np.save(tmp_path, np.ascontiguousarray(array))
+        os.replace(tmp_path, os.path.join(self.directory, file_name))
+        return file_name
+
+    def load(self, file_name):
+        """
+        Output: read-only memory-mapped array
+        """
+        return np.load(os.path.join(self.directory, file_name), mmap_mode='r')
+
+    def save_compact(self, name, values):
+        """
+        Output: metadata of Compact_array or array (numpy level of the pyramid)
+        """
+        if isinstance(values, Compact_array):
+            return {'file': self.save(name, values.codes), 'scale': values.scale, 'offset': values.offset}
+        return {'file': self.save(name, values)}
+
+    def load_compact(self, meta):
+        if 'scale' in meta:
+            return Compact_array.from_codes(self.load(meta['file']), meta['scale'], meta['offset'])
+        return self.load(meta['file'])
+
+    def publish_signals(self, signals):
+        """
+        Input: 1. signals - Signal_store of the case
+
+        Function publish the channels (other processes can attach the case after this call)
+        """
+        channels = {name: dict(self.save_compact(f'channel {name}', values), rate=signals.rates[name])
+                    for name, values in signals.channels.items()}
+        # Quality masks are small: runs are saved, the merged runs are created again by the other processes
+        for name, quality in signals.quality.items():
+            channels[name]['quality'] = {'size': quality.size, 'files': [self.save(f'quality {name} {field}', getattr(quality, field))
+                                                                         for field in ('start', 'stop', 'kind')]}
+        self.write_manifest({'source': self.source, 'base': signals.base, 'channels': channels})
+
+    def publish_products(self, df_class):
+        """
+        Input: 1. df_class - Data_store after the warm-up
+
+        Function publish the derived arrays: pyramids (without level 0 - it is the channel), 
+        interpolation indexes, HRV peaks and events
+        """
+        manifest = self.read_manifest()
+        signals = df_class.signals
+        products = {'pyramids': {}, 'valid': {}}
+        for name, pyramid in signals.pyramids.items():
+            products['pyramids'][name] = {
+                'mins': [self.save_compact(f'pyramid {name} {level} min', values) for level, values in enumerate(pyramid.mins) if level],
+                'maxs': [self.save_compact(f'pyramid {name} {level} max', values) for level, values in enumerate(pyramid.maxs) if level]}
+        for name, valid in signals.valid.items():
+            products['valid'][name] = self.save(f'valid {name}', valid)
+        if df_class.hrv is not None:
+            products['hrv'] = {'file': self.save('hrv peaks', df_class.hrv.peaks), 'rate': df_class.hrv.rate}
+        if df_class.events is not None:
+            events = df_class.events
+            products['events'] = {field: self.save(f'events {field}', getattr(events, field)) 
+                                  for field in ('start', 'stop', 'kind', 'score')}
+        manifest['products'] = products
+        self.write_manifest(manifest)
+
+    def attach_signals(self, manifest):
+        """
+        Output: Signal_store with the memory-mapped channels
+        """
+        signals = Signal_store(base=manifest['base'])
+        for name, meta in manifest['channels'].items():
+            signals.channels[name] = self.load_compact(meta)
+            signals.rates[name] = meta['rate']
+            if 'quality' in meta:
+                signals.quality[name] = Quality_mask(meta['quality']['size'], *[self.load(file_name) for file_name in meta['quality']['files']])
+        return signals
+
+    def attach_products(self, df_class, products):
+        """
+        Function add the memory-mapped products to the case (HRV engine is created from the shared peaks)
+        """
+        signals = df_class.signals
+        for name, levels in products['pyramids'].items():
+            channel = signals.channels[name]
+            signals.pyramids[name] = Min_max_pyramid.from_levels([channel] + [self.load_compact(meta) for meta in levels['mins']],
+                                                                 [channel] + [self.load_compact(meta) for meta in levels['maxs']])
+        for name, file_name in products['valid'].items():
+            signals.valid[name] = self.load(file_name)
+        if 'hrv' in products:
+            df_class.hrv = Hrv_metrics(self.load(products['hrv']['file']), rate=products['hrv']['rate'])
+        if 'events' in products:
+            df_class.events = Event_index(*[self.load(products['events'][field]) for field in ('start', 'stop', 'kind', 'score')])
+
+    def wait(self, key):
+        """
+        Input: 1. key - 'channels' or 'products'
+
+        Output: manifest with the key (published for the same source), 
+                None if there is no owner that can publish it
+        """
+        while True:
+            manifest = self.read_manifest()
+            if manifest.get('source') == self.source and key in manifest:
+                return manifest
+            if not self.owner_alive():
+                return None
+            time.sleep(self.poll)
+
+    def open(self, function, progress=None, **kwargs):
+        """
+        Input: 1. function - function that load the case (module.give_me_df_with_parameters), gets progress and **kwargs
+               2. progress - function(fraction, text), optional (for Case_loader)
+
+        Output: Data_store - loaded and published (owner) or attached to the published arrays
+        """
+        if progress is None:
+            progress = lambda fraction, text: None
+        # Published arrays are used only for the same arguments (case, files) and the same code
+        self.source = {key: str(value) for key, value in sorted(kwargs.items())}
+        self.source['version'] = self.code_version(function)
+        while True:
+            manifest = self.wait('channels')
+            if manifest is not None:
+                break
+            if self.acquire():
+                try:
+                    df_class = function(progress=progress, **kwargs)
+                    self.publish_signals(df_class.signals)
+                except Exception:
+                    self.release()
+                    raise
+                return df_class
+            progress(0.0, 'Waiting for the case from the other process')
+        df_class = Data_store(self.attach_signals(manifest))
+        self.attached = 'products' in manifest
+        if self.attached:
+            self.attach_products(df_class, manifest['products'])
+        return df_class
+
+    def share(self, df_class, prepare=None):
+        """
+        Input: 1. df_class - result of open()
+               2. prepare - warm-up function(df_class) (module.warm_up_case)
+
+        Owner run the warm-up and publish the products, other processes attach them 
+        (prepare() then finds the products and only creates the private tiles). 
+        If the owner is finished without products, one of the other processes takes its place.
+        """
+        while not self.owner and not self.attached:
+            manifest = self.wait('products')
+            if manifest is not None:
+                self.attach_products(df_class, manifest['products'])
+                self.attached = True
+            else:
+                self.acquire()
+        if not self.owner:
+            if prepare is not None:
+                prepare(df_class)
+            return
+        try:
+            if prepare is not None:
+                prepare(df_class)
+        finally:
+            self.publish_products(df_class)
+            self.release()
+
 if __name__ == "__main__":
     print(__doc__)
-else:
-    print(f"Module '{__name__}' is imported successfully!\n")
 
 
 
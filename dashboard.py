@@ -1,22 +1,45 @@
 # Imports
+import classes
 import module
 import dashboard_text
+import streaming
+import prefetch
+import diagnostics
 import panel as pn
-from bokeh.models import RangeSlider, Slider, ColumnDataSource
+from bokeh.models import RangeSlider, Slider
+from io import StringIO
+import pandas as pd
 
 
 import time
-df_class = module.give_me_df_with_parameters()
 
 # Create a dictionary with different events/time 
 config = module.open_config_yaml('config\config.yaml')
+# Per-stage timing (see the hidden diagnostics page: open the dashboard with '?diagnostics')
+if config.get('diagnostics'):
+    diagnostics.enable()
 operation_events = {'operation start': config['time_opstart']*500, 'operation end': config['time_opend']*500, 
                     'anestesia end': config['time_anestend']*500, 'case end': config['time_caseend']*500}
+# Targets of the 'Place of interest' page: time of the event or (start, stop) of the interval.
+# Detected events are added when the case is processed (detected_places - event for every label)
+places_targets = dict(operation_events, **{'valueble changes': (7207000, 7240000)})
+detected_places = {}
+# The case is loaded in the background: the server starts at once, pages wait for 'case.ready'.
+# Several server processes share one copy of the case: the first one loads and publishes it, 
+# the others attach the published arrays (no loading, no copies)
+shared_case = classes.Shared_case_store(config.get('shared', 'data/shared'))
+# ABP track is loaded only for the events (ABP excursions) in the warm-up, the graphs do not use it
+case = classes.Case_loader(shared_case.open, warm_up=lambda df_class: shared_case.share(df_class, lambda df_class: module.warm_up_case(
+                           df_class, [operation_events['operation start']], hrv=True, 
+                           abp=lambda: module.load_track(367, 'ABP', config['vital'], config['cache']))),
+                           function=module.give_me_df_with_parameters, vital_path=config['vital'], cache_dir=config['cache']).start()
 
 pn.extension(sizing_mode="stretch_width")
 
 # selection widget
 places = pn.widgets.Select(options=['operation start', 'operation end', 'anestesia end', 'valueble changes'], sizing_mode='stretch_both')
+# Configured places are prefetched in the background (detected events - only when they are selected)
+prefetch_places = {name: places_targets[name] for name in places.options}
 
 # Create buttons
 home_button = pn.widgets.Button(name='Home', button_type='light', align='start', width=175)
@@ -25,21 +48,59 @@ free_analysis_button = pn.widgets.Button(name='Free analysis', button_type='ligh
 slider_button = pn.widgets.Button(name='Ok', button_type='light', align='start', width=50)
 streaming_button = pn.widgets.Button(name='(Pseudo)Streaming', button_type='light', align='start', width=175)
 start_stream_button = pn.widgets.Button(name='Start', button_type='light', align='start', width=80)
+pause_stream_button = pn.widgets.Button(name='Pause', button_type='light', align='start', width=80)
+stop_stream_button = pn.widgets.Button(name='Stop', button_type='light', align='start', width=80)
 
 # Create sliders
 range_slider = RangeSlider(start=2, end=config['time_caseend'], value=(1020, 2000), step=1, title="Select the interval of interest")
-speed_slider = Slider(start=1, end=50, value=5, step=1., title="Streaming speed")
+speed_slider = Slider(start=50, end=2500, value=500, step=50., title="Streaming speed (samples/s, 500 == real time)")
 x_range_slider = Slider(start=500, end=5000, value=2000, step=50., title="Number of points (x range/500, s)")
 
+def add_detected_places():
+    '''
+    Function add the detected events of the case (if they are ready) to the places selector (only once)
+    '''
+    events = case.result.events if case.ready else None
+    if events is None or detected_places:
+        return
+    for number in range(len(events)):
+        event = events.event(number)
+        label = f"{event['kind']} at {event['start'] // 500 // 3600:02d}:{event['start'] // 500 // 60 % 60:02d}:{event['start'] // 500 % 60:02d}"
+        detected_places[label] = event
+        # Graph: start of the event (not more than 1 min) with 10 s before and after
+        places_targets[label] = (max(event['start'] - 5000, 0), min(event['stop'], event['start'] + 30000) + 5000)
+    places.options = list(places.options) + list(detected_places)
+
+
+def pd_summary():
+    '''
+    Output: df with the summary of the diagnostics records (one row for every stage)
+    '''
+    return pd.DataFrame(diagnostics.summary(), columns=['stage', 'calls', 'mean, s', 'max, s', 'last, s', 'samples/s', 'mean bytes'])
+
+
+def pd_caches():
+    '''
+    Output: df with the counters of the case caches (shared by all sessions of this process)
+    '''
+    caches = ({'tiles': case.result.tiles, 'results': case.result.results, 'stream results': case.result.stream_results} 
+              if case.ready else {})
+    return pd.DataFrame([dict(cache=name, **cache.stats()) for name, cache in caches.items()],
+                        columns=['cache', 'entries', 'bytes', 'hits', 'misses', 'waits', 'oversized'])
+
+
 def dashboard():
     #home_page = pn.pane.HTML('<h1>Welcome to the Home Page!</h1>')
 
     dashboard_column = pn.Column()
     sidebar_column = pn.Column()
+    # Streaming engine and prefetcher of this session
+    engine = {'stream': None, 'prefetch': None}
 
-    # Bind graph function and text with select widget
-    graph = pn.bind(module.graph_plotting, df_graph = df_class, places_dict=operation_events, place=places)
-    text = pn.bind(dashboard_text.text_intro, variable=places)
+    # Bind graph function and text with select widget (the graph is created only when the case is loaded)
+    graph = pn.bind(lambda place: module.graph_plotting(df_graph=case.result, places_dict=places_targets, place=place), place=places)
+    text = pn.bind(lambda place: dashboard_text.text_event(detected_places[place]) if place in detected_places 
+                   else dashboard_text.text_intro(variable=place), place=places)
 
     template = pn.template.FastListTemplate(
         title='Some key parameters of patient #0367 during surgery.',
@@ -47,6 +108,11 @@ def dashboard():
         sidebar_width=200,
         accent='#144A50')
 
+    # Hidden page, the button is shown only for the '?diagnostics' url
+    diagnostics_button = pn.widgets.Button(name='Diagnostics', button_type='light', align='start', width=175)
+    if 'diagnostics' in pn.state.session_args:
+        template.sidebar.append(diagnostics_button)
+
     # Append the sidebar and dashboard columns to the template
     template.sidebar.append(sidebar_column)
     template.main.append(dashboard_column)
@@ -58,7 +124,71 @@ def dashboard():
     dashboard_column.append(home_page_title)
     dashboard_column.append(pn.Column(pn.Spacer(height=50), dashboard_text.text_intro(variable='Start')))
 
+    def wait_for_case(page):
+        '''
+        Input: 1. page - click function of the page
+
+        Function show the loading progress instead of the page and open the page when the case is ready
+
+        Output: True - the case is ready (page can be shown now), False - page will be opened later
+        '''
+        if case.ready:
+            return True
+        dashboard_column.clear()
+        sidebar_column.clear()
+        progress = pn.indicators.Progress(value=int(case.progress * 100), max=100, width=400)
+        status = pn.pane.HTML(f'<b>Please wait, the case is loading: {case.status}</b>')
+        dashboard_column.append(status)
+        dashboard_column.append(progress)
+        callback = {}
+
+        def check():
+            progress.value = int(case.progress * 100)
+            status.object = f'<b>Please wait, the case is loading: {case.status}</b>'
+            if case.ready or case.failed:
+                callback['periodic'].stop()
+            if case.ready:
+                page(event=1)
+
+        callback['periodic'] = pn.state.add_periodic_callback(check, period=250)
+        return False
+
+    def prefetch_next(start, stop, place=None):
+        '''
+        Function start the background computation of the next likely requests of this session
+        '''
+        if not case.ready:
+            return
+        if engine['prefetch'] is None:
+            engine['prefetch'] = prefetch.Prefetcher(case.result, prefetch_places)
+        engine['prefetch'].update(start, stop, place)
+
+    def prefetch_place(event):
+        start, stop, _ = module.place_range(places_targets, event.new)
+        prefetch_next(start, stop, event.new)
+
+    def prefetch_range(attr, old, new):
+        prefetch_next(int(new[0])*500, int(new[1])*500)
+
+    def prefetch_cancel():
+        if engine['prefetch'] is not None:
+            engine['prefetch'].cancel()
+
+    # Widgets are shared by the sessions: the watchers of this session are removed with the session
+    place_watcher = places.param.watch(prefetch_place, 'value')
+    range_slider.on_change('value', prefetch_range)
+
+    def remove_watchers(session_context):
+        if engine['prefetch'] is not None:
+            # The running unit is short (one tile), the queued plans are dropped
+            engine['prefetch'].close(timeout=1)
+        places.param.unwatch(place_watcher)
+        range_slider.remove_on_change('value', prefetch_range)
+
+    pn.state.on_session_destroyed(remove_watchers)
+
     def home_click(event):
+        prefetch_cancel()
         # Clear the sidebar and dashboard layout
         dashboard_column.clear()
         sidebar_column.clear()
@@ -68,6 +198,8 @@ def dashboard():
         dashboard_column.append(pn.Column(pn.Spacer(height=50), dashboard_text.text_intro(variable='Start')))
 
     def free_analysis_click(event):
+        if not wait_for_case(free_analysis_click):
+            return
         # Clear the sidebar and dashboard layout
         dashboard_column.clear()
         sidebar_column.clear()
@@ -76,20 +208,30 @@ def dashboard():
         dashboard_column.append(range_slider)
         dashboard_column.append(pn.Spacer(height=25))
         dashboard_column.append(slider_button)
+        # The current range is prepared while the user looks at the slider
+        prefetch_range('value', None, range_slider.value)
     
     def place_of_interest_click(event):
+        if not wait_for_case(place_of_interest_click):
+            return
         # Clear the sidebar and dashboard layout
         dashboard_column.clear()
         sidebar_column.clear()
 
+        add_detected_places()
+
         # Add the contents to the sidebar layout
         sidebar_column.append(pn.pane.HTML('<b>Select the place of interest to see details:</b>'))
         sidebar_column.append(places)
 
         # Add the contents to the dashboard layout
         dashboard_column.append(pn.Row(graph, text))
+        # Other places and the windows around this one are prepared in the background
+        start, stop, _ = module.place_range(places_targets, places.value)
+        prefetch_next(start, stop, places.value)
 
     def streaming_click(event):
+        prefetch_cancel()
         # Clear the sidebar and dashboard layout
         dashboard_column.clear()
         sidebar_column.clear()
@@ -97,52 +239,99 @@ def dashboard():
         # Add the contents to the dashboard layout
         dashboard_column.append(pn.Column(range_slider, pn.Spacer(height=15), speed_slider, pn.Spacer(height=15), x_range_slider))
         dashboard_column.append(pn.Spacer(height=30))
-        dashboard_column.append(start_stream_button)
+        dashboard_column.append(pn.Row(start_stream_button, pause_stream_button, stop_stream_button))
         dashboard_column.append(pn.Spacer(height=30))
 
 
+    def diagnostics_click(event):
+        prefetch_cancel()
+        # Clear the sidebar and dashboard layout
+        dashboard_column.clear()
+        sidebar_column.clear()
+
+        record_checkbox = pn.widgets.Checkbox(name='Record stage timing', value=diagnostics.enabled)
+        refresh_button = pn.widgets.Button(name='Refresh', button_type='light', align='start', width=80)
+        export_button = pn.widgets.FileDownload(callback=lambda: StringIO(diagnostics.export_json()),
+                                                filename='diagnostics.json', button_type='light', width=175)
+        table = pn.pane.DataFrame(pd_summary(), index=False)
+        cache_table = pn.pane.DataFrame(pd_caches(), index=False)
+
+        def record_change(event):
+            if event.new:
+                diagnostics.enable()
+            else:
+                diagnostics.disable()
+
+        def refresh_click(event):
+            table.object = pd_summary()
+            cache_table.object = pd_caches()
+
+        record_checkbox.param.watch(record_change, 'value')
+        refresh_button.on_click(refresh_click)
+
+        # Add the contents to the dashboard layout
+        dashboard_column.append(pn.pane.HTML('<h2>Recent per-stage latency and throughput</h2>'))
+        dashboard_column.append(pn.Row(record_checkbox, refresh_button, export_button))
+        dashboard_column.append(table)
+        dashboard_column.append(pn.pane.HTML('<h2>Caches</h2>'))
+        dashboard_column.append(cache_table)
+
     def slider_click(event):
         # read the slider value
         a = range_slider.value
 
         # Add the contents to the dashboard layout
         dashboard_column.append(pn.pane.HTML('<b>Please wait. If the gap is too long, it may takes time.</b>'))
-        graph2 = module.graph_plotting(df_graph = df_class, start=int(a[0])*500, stop=int(a[1])*500)
+        graph2 = module.graph_plotting(df_graph = case.result, start=int(a[0])*500, stop=int(a[1])*500)
         dashboard_column.append(pn.Spacer(height=25))
         dashboard_column.append(graph2)
+        # HRV metrics of the interval (when the whole case is processed by the warm-up)
+        if case.result.hrv is not None:
+            dashboard_column.append(dashboard_text.text_hrv(case.result.hrv.summary(int(a[0])*500, int(a[1])*500)))
+        # Windows before and after this range (the next shift of the slider)
+        prefetch_range('value', None, a)
 
 
     def start_click(event):
+        # Continue after pause
+        if engine['stream'] is not None and not engine['stream'].playing and not engine['stream'].finished:
+            engine['stream'].start()
+            return
+        if not wait_for_case(start_click):
+            return
         # read the slider values
         range_s = range_slider.value
         speed = speed_slider.value
         x_range = x_range_slider.value
-        # Clear old plot (if exist)
+        # Stop and clear old stream / plot (if exist)
+        stop_click(event=1)
         streaming_click(event=1)
         
+        df_class = case.result
         # Calculate start and stop indexes
         start=int(range_s[0])*500
         stop=int(range_s[1])*500
 
-        # Add the contents to the dashboard layout
-        dashboard_column.append(pn.pane.HTML('<b>Please wait. Preprocessing in progress. It may takes time.</b>'))
-
-        # Define source and draw a graph
-        df_final = module.give_values_for_streaming(df_class, start-200, stop)
-        source = ColumnDataSource(df_final[start-100:start])
-        new_graph = module.graph_plotting_streaming(source)
+        # Define source (100 points before the start) and draw a graph
+        df_start = module.give_values_for_streaming(df_class, start-200, start-1)
+        source, events = streaming.streaming_sources(df_start.loc[start-100:start-1])
+        new_graph = module.graph_plotting_streaming(source, events)
         dashboard_column.append(new_graph)
 
-        # start data transfer to the graph with the speed of 'speed' values.
-        for i in range(start, stop, speed):
-            new_start = i
-            new_stop = i + speed 
-            
-            # Add new data. IF number of datapoints became large then 'rollover', function rewrite old values
-            source.stream({'ECG': df_final.loc[new_start:new_stop, 'ECG'], 'Time': df_final.loc[new_start:new_stop, 'Time'], 'ECG_f': df_final.loc[new_start:new_stop,
-                            'ECG_f'], 'index': df_final.loc[new_start:new_stop, 'peaks'], 'Hr': df_final.loc[new_start:new_stop, 'Hr'], 
-                            'co2': df_final.loc[new_start:new_stop, 'co2'], 'hr': df_final.loc[new_start:new_stop, 'hr'], 'peaks': df_final.loc[new_start:new_stop, 'peaks'],
-                            'error peaks': df_final.loc[new_start:new_stop, 'error peaks']}, rollover=x_range)
+        # Data is prepared block by block in the background and sent with the speed of 'speed' values per second
+        # (typed arrays, one update per browser frame). IF number of datapoints became large then 'rollover', 
+        # function rewrite old values
+        engine['stream'] = streaming.Stream_engine(df_class, source, start, stop, rate=speed, rollover=x_range, events=events)
+        engine['stream'].start()
+
+    def pause_click(event):
+        if engine['stream'] is not None:
+            engine['stream'].pause()
+
+    def stop_click(event):
+        if engine['stream'] is not None:
+            engine['stream'].stop()
+            engine['stream'] = None
 
     # Execute the click functions when the user clicks on a button
     home_button.on_click(home_click)
@@ -151,6 +340,9 @@ def dashboard():
     streaming_button.on_click(streaming_click)
     slider_button.on_click(slider_click)
     start_stream_button.on_click(start_click)
+    pause_stream_button.on_click(pause_click)
+    stop_stream_button.on_click(stop_click)
+    diagnostics_button.on_click(diagnostics_click)
 
     return template
 
@@ -37,4 +37,34 @@ def text_intro(variable):
                        "above the critical value of 100 bpm for most of the time interval. Respiration was irregular, interrupted. "
                        "The respiratory pattern was no more normal.", styles={'font-size': '16px'})
 
-    return text_box
\ No newline at end of file
+    return text_box
+
+def text_hrv(summary):
+    '''
+    Return the text with the HRV metrics of the interval (summary - classes.Hrv_metrics.summary())
+    '''
+    if not summary['beats'] or summary['beats'] < 2:
+        return Div(text="Not enough beats in the interval for the HRV metrics.", styles={'font-size': '16px'})
+    return Div(text=f"<b>Heart rate variability of the interval</b> ({summary['beats']:.0f} beats):<br \\>"
+               f"Mean Hr: {summary['mean hr']:.1f} bpm, beats above 100 bpm: {100 * summary['tachycardia']:.1f} %<br \\>"
+               f"SDNN: {summary['sdnn']:.1f} ms, RMSSD: {summary['rmssd']:.1f} ms, pNN50: {100 * summary['pnn50']:.1f} %, "
+               f"RR coefficient of variation: {summary['cv']:.3f}", styles={'font-size': '16px'})
+
+
+# Description and score of every kind of the detected events (module.detect_events)
+EVENT_TEXT = {'tachycardia': ("The calculated heart rate was above 100 bpm.", "mean Hr {:.0f} bpm"),
+              'irregular rhythm': ("The RR intervals varied strongly (irregular cardiac rhythm).", "mean RR coefficient of variation {:.2f}"),
+              'error peaks': ("Several peaks with too low filtered ECG values (highlighted on the graph).", "{:.0f} error peaks"),
+              'co2 break': ("No breaths were detected for a long time, the respiratory pattern was broken.", "gap {:.0f} s"),
+              'hypotension': ("The mean arterial pressure was below the normal level.", "mean MAP {:.0f} mmHg"),
+              'hypertension': ("The systolic blood pressure was above the normal level.", "mean Sys BP {:.0f} mmHg")}
+
+
+def text_event(event):
+    '''
+    Return the text for the detected event (event - dictionary from classes.Event_index.event())
+    '''
+    description, score = EVENT_TEXT.get(event['kind'], ("", "score {:.2f}"))
+    return Div(text=f"<b>Detected event: {event['kind']}</b> from {event['start'] / 500:.0f} s to {event['stop'] / 500:.0f} s "
+               f"({(event['stop'] - event['start']) / 500:.0f} s, " + score.format(event['score']) + ").<br \\>" + description,
+               styles={'font-size': '16px'})
@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+import tracemalloc
+from collections import deque
+from functools import wraps
+
+
+# Recording is off by default: then every hook costs only one check of this flag
+enabled = False
+# Ring buffer with the last records (one record for every call of the stage)
+records = deque(maxlen=2000)
+lock = threading.Lock()
+
+
+def enable(memory=False, size=None):
+    '''
+    Input: 1. memory - also record allocated bytes (tracemalloc, slows the code down)
+           2. size - new size of the ring buffer (None - keep the current)
+    '''
+    global enabled, records
+    if size:
+        with lock:
+            records = deque(records, maxlen=size)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def clear():
+    with lock:
+        records.clear()
+
+
+class Stage:
+    '''
+    Context manager that records wall time, number of samples and allocated bytes of the block:
+
+        with diagnostics.Stage('loading', samples=len(ecg)):
+            ...
+    '''
+    __slots__ = ('name', 'samples', 'start', 'memory')
+
+    def __init__(self, name, samples=0):
+        self.name = name
+        self.samples = samples
+
+    def __enter__(self):
+        if enabled:
+            self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if enabled and hasattr(self, 'start'):
+            seconds = time.perf_counter() - self.start
+            allocated = tracemalloc.get_traced_memory()[0] - self.memory if self.memory is not None else None
+            record = {'stage': self.name, 'time': time.time(), 'seconds': seconds, 'samples': int(self.samples),
+                      'bytes': allocated, 'thread': threading.current_thread().name}
+            with lock:
+                records.append(record)
+        return False
+
+
+def timed(name, samples=None):
+    '''
+    Input: 1. name - name of the stage
+           2. samples - function (same arguments as the decorated function) that return the number of samples
+
+    Decorator version of Stage()
+    '''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Stage(name, samples(*args, **kwargs) if samples else 0):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summary(last=None):
+    '''
+    Input: 1. last - only the last N records (None - all records in the buffer)
+
+    Output: list of dictionaries, one for every stage (calls, mean / max / last latency, throughput, bytes)
+    '''
+    with lock:
+        selected = list(records)[-last:] if last else list(records)
+    stages = {}
+    for record in selected:
+        stages.setdefault(record['stage'], []).append(record)
+    result = []
+    for name, stage_records in stages.items():
+        seconds = [record['seconds'] for record in stage_records]
+        samples = sum(record['samples'] for record in stage_records)
+        allocated = [record['bytes'] for record in stage_records if record['bytes'] is not None]
+        result.append({'stage': name, 'calls': len(stage_records), 'mean, s': sum(seconds) / len(seconds),
+                       'max, s': max(seconds), 'last, s': seconds[-1],
+                       'samples/s': samples / sum(seconds) if sum(seconds) and samples else None,
+                       'mean bytes': sum(allocated) / len(allocated) if allocated else None})
+    return sorted(result, key=lambda row: -row['mean, s'] * row['calls'])
+
+
+def export_json():
+    '''
+    Output: JSON text with all records and the summary (for the offline analysis)
+    '''
+    with lock:
+        selected = list(records)
+    return json.dumps({'records': selected, 'summary': summary()}, indent=1)
@@ -1,14 +1,19 @@
-import vitaldb
 import numpy as np
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import yaml
-from bokeh.models import CDSView, ColumnDataSource, IndexFilter
 from bokeh.layouts import column
 from bokeh.models import ColumnDataSource, RangeTool
 from bokeh.plotting import figure
 from bokeh.models import Label
 
+import time
+
 import classes
+import diagnostics
+import rolling
 
 def open_config_yaml(directory):
     '''
@@ -23,113 +28,267 @@ def open_config_yaml(directory):
     return config_dict
  
 
-def give_me_df_with_parameters():
+# Tracks of the case in vitaldb and sampling rate of every channel
+TRACKS = {'ECG': ['SNUADC/ECG_II', 'SNUADC/ECG_V5'], 'Hr': 'Solar8000/HR', 'co2': 'Primus/CO2', 'ABP': 'SNUADC/ART'}
+RATES = {'ECG': 500, 'Hr': 0.5, 'co2': 62.5, 'ABP': 500}
+# Signal quality limits (see signal_quality()): valid range, shortest flatline and run at the rail (clipping), s.
+# Flat co2 (apnea) and Hr (monitor value) are normal for a while, so their limits are longer
+QUALITY = {'ECG': {'low': -0.4, 'high': 1.4, 'flat': 0.5, 'clip': 0.02, 'gap': 0.2},
+           'co2': {'low': -5, 'high': 100, 'flat': 60, 'clip': None, 'gap': 1},
+           'Hr': {'low': 20, 'high': 250, 'flat': 600, 'clip': None, 'gap': 10}}
+
+
+def load_track(case, channel, vital_path=None, cache_dir=None):
+    '''
+    Input: 1. case - case id in vitaldb
+           2. channel - name of the channel (key of TRACKS)
+           3. vital_path - local .vital file with the case (optional)
+           4. cache_dir - directory for the memory-mapped tracks cache (if None - no cache)
+
+    Output: 2D-array (Row by time and Column by track) - same as vitaldb.load_case()
     '''
-    Input: 
+    cache = classes.Vital_cache(cache_dir) if cache_dir else classes.Vital_cache()
+    if cache_dir:
+        # Local file / cache: no network after the first start
+        return cache.load(case, TRACKS[channel], 1 / RATES[channel], vital_path)
+    track_names = TRACKS[channel] if isinstance(TRACKS[channel], list) else [TRACKS[channel]]
+    return cache.read_source(case, track_names, 1 / RATES[channel], vital_path)
+
+
+def load_tracks(case, channels, vital_path=None, cache_dir=None):
+    '''
+    Input: 1. case, vital_path, cache_dir - see load_track()
+           2. channels - list of the channels (keys of TRACKS)
+
+    Function read all channels with one pass over the source (one .vital file parsing or download)
+
+    Output: dictionary {channel: 2D-array} (same arrays as load_track())
+    '''
+    cache = classes.Vital_cache(cache_dir) if cache_dir else classes.Vital_cache()
+    requests = [(TRACKS[channel] if isinstance(TRACKS[channel], list) else [TRACKS[channel]], 1 / RATES[channel])
+                for channel in channels]
+    if cache_dir:
+        return dict(zip(channels, cache.load_many(case, requests, vital_path)))
+    return dict(zip(channels, cache.read_sources(case, requests, vital_path)))
+
+
+def give_me_df_with_parameters(case=367, vital_path=None, cache_dir=None, progress=None, tracks=None):
+    '''
+    Input: 1. case - case id in vitaldb
+           2. vital_path - local .vital file with the case (optional)
+           3. cache_dir - directory for the memory-mapped tracks cache (if None - no cache)
+           4. progress - function(fraction, text) that is called after every step (optional)
+           5. tracks - already loaded channels (load_tracks() with 'ECG', 'Hr' and 'co2'), optional
 
     Function return a df with Time, ECG, co2 and Hr parameters
 
     Output: df_class - dataframe placed in the class
     '''    
     # We can also download interesting data and import values manually, but I suppose using an api for this is easier
-    ecg_val = vitaldb.load_case(367, ['SNUADC/ECG_II','SNUADC/ECG_V5'], 1/500)
-    hr_val = vitaldb.load_case(367,'Solar8000/HR', 2)
-    co2_val = vitaldb.load_case(367, 'Primus/CO2', 1/62.5)
-    ecg = ecg_val[:,0]
-    co2 = co2_val[:,0]
-    hr = hr_val[:,0]
-
-    #remove all outliers
+    if progress is None:
+        progress = lambda fraction, text: None
+    progress(0.0, 'Loading ECG, Hr and co2')
+    with diagnostics.Stage('loading') as stage:
+        if tracks is None:
+            tracks = load_tracks(case, ['ECG', 'Hr', 'co2'], vital_path, cache_dir)
+        stage.samples = len(tracks['ECG'])
+    ecg = tracks['ECG'][:,0]
+    co2 = tracks['co2'][:,0]
+    hr = tracks['Hr'][:,0]
+
+    progress(0.8, 'Preparing signals')
+    # Artifacts of every channel (before the outlier removal, it hides the saturation)
+    with diagnostics.Stage('signal quality', samples=len(ecg)):
+        quality = {name: signal_quality(values, RATES[name], **QUALITY[name]) 
+                   for name, values in (('ECG', ecg), ('co2', co2), ('Hr', hr))}
+    #remove all outliers (only for the graph: the masked parts are skipped by the processing)
     ecg = ecg*((ecg>-0.4)&(ecg<1.4))
 
-    #Create time for every point
-    time_ecg = np.arange(0, len(ecg), 1) / 500
-    time_co2 = np.arange(0, len(co2), 1) / 62.5
-    time_hr = np.arange(0, len(hr), 1) * 2
-
-    # Data contain millions of values, so using np.array() - fastest way
-    df = pd.DataFrame(np.array([time_ecg, ecg])).T
-    df.rename(columns = {0:'Time', 1:'ECG'}, inplace = True )
-    df2 = pd.DataFrame(np.array([time_co2, co2])).T
-    df2.rename(columns = {0:'Time', 1:'co2'}, inplace = True )
-    df3 = pd.DataFrame(np.array([time_hr, hr])).T
-    df3.rename(columns = {0:'Time', 1:'Hr'}, inplace = True )
-    df = df.merge(df2, on='Time', how='outer')
-    df = df.merge(df3, on='Time', how='outer')
+    # Every channel is stored with its own rate (time for every point = index / rate), no merges on 'Time'
+    signals = classes.Signal_store(base='ECG')
+    # ECG - scaled int16 (values are limited by the outlier removal), co2 and Hr - float32
+    signals.add('ECG', ecg, RATES['ECG'], dtype='int16')
+    signals.add('co2', co2, RATES['co2'])
+    signals.add('Hr', hr, RATES['Hr'])
+    signals.quality.update(quality)
 
     # Put raw data in the class
-    df_class = classes.Data_store(df)
+    df_class = classes.Data_store(signals)
     return df_class
     
 
+def warm_up_case(df_class, places=(), hrv=False, abp=None):
+    '''
+    Input: 1. df_class - element with type class and contain all raw info
+           2. places - indexes (time in seconds * 500) that are shown first (places of interest)
+           3. hrv - also find all peaks of the case for the HRV metrics and events (case_hrv(), case_events())
+           4. abp - function that return the ABP track (2D-array, load_track()) for the ABP excursions, optional
+              (the track is used only for the events and is not kept)
+
+    Function import the heavy libraries and process the tiles around the places in advance,
+    so the first page does not wait for them (runs in the background after the loading)
+    '''
+    import neurokit2
+    df_class.signals.pyramid('ECG')
+    df_class.signals.pyramid('co2')
+    for place in places:
+        data_transformation(df_class, max(place - 10000, 0), place + 10000)
+    # HRV engine of the whole case (in this process: the warm-up runs in a thread of the server)
+    if hrv:
+        case_hrv(df_class, workers=1)
+        beats = None
+        if abp is not None:
+            # Case without the ABP track still gets the other events
+            try:
+                track = abp()
+            except Exception:
+                track = np.zeros((0, 1))
+            if track.size and np.isfinite(track[:, 0]).any():
+                _, _, beats = abp_beats(track, rate=RATES['ABP'])
+        case_events(df_class, beats)
+
+
+def frame_arrays(df, **arrays):
+    '''
+    Input: 1. df - df for the result cache
+           2. arrays - other arrays of the result
+
+    Output: dictionary with the arrays ('index', 'column <name>' for every column and the other arrays)
+    '''
+    value = {'index': df.index.to_numpy()}
+    value.update({f'column {name}': df.loc[:, name].to_numpy() for name in df.columns})
+    value.update(arrays)
+    return value
+
+
+def arrays_frame(value):
+    '''
+    Output: new df (own copy of the data) from the result of frame_arrays()
+    '''
+    return pd.DataFrame({name[7:]: array for name, array in value.items() if name.startswith('column ')}, index=value['index'])
+
+
+@diagnostics.timed('data transformation', samples=lambda Data_store, start=0, stop=10000: stop - start)
 def data_transformation(Data_store, start=0, stop=10000):
     '''
     Input: 1. Data_store - element with type class and contain all raw info
 
-    Function return a final df with all data and list of peaks indexes
+    Function return a final df with all data and list of peaks indexes. 
+    The result is computed once for all sessions (Data_store.results), every caller gets its own df.
 
-    Output: 1. df_final - df with all data including transformed ECG and calculated Hr
-            2. list_of_peaks_index - list of peaks indexes
+    Output: 1. df_final - df with all data (only for the [start:stop] interval) including transformed ECG and calculated Hr
+            2. list_of_peaks_index - list of peaks indexes (read-only)
     '''    
-    ecg_f = Data_store.fourier_transform(np.array(Data_store.raw_data.loc[:,'ECG'])[start:stop])
+    def transformation():
+        # Only the rows of the interval (index == position in the ECG time grid)
+        df_final = Data_store.window_frame(start, stop)
+        # Filtered ECG, peaks and Hr are collected from the cached tiles
+        df_final.loc[:, 'ECG_f'], peaks, hr = Data_store.transform_range(start, stop)
+        df_final.loc[:, 'peaks'] = np.nan
+        df_final.loc[:, 'hr'] = np.nan
+        df_final.loc[peaks, 'peaks'] = 1
+        df_final.loc[peaks, 'hr'] = hr
+        return frame_arrays(df_final, peaks=peaks - start)
+
+    value = Data_store.results.compute(('data transformation', start, stop), transformation)
+    return arrays_frame(value), value['peaks']
+
+
+def decimated_data(pyramid, start, stop, rate, width, column, offset=0):
+    '''
+    Input: 1. pyramid - classes.Min_max_pyramid of the channel
+           2. start, stop - indexes of the channel points, [start, stop)
+           3. rate - sampling rate of the channel
+           4. width - width of the figure, pixels
+           5. column - name of the column with values
+           6. offset - index of the first pyramid point in the channel (if pyramid created for the part of the channel)
 
-    df_ecg_f = pd.DataFrame(np.array([np.array(Data_store.raw_data.loc[:,'Time'])[start:stop], ecg_f])).T
-    df_ecg_f.rename(columns = {0:'Time', 1:'ECG_f'}, inplace = True )
-    df_final = Data_store.raw_data.merge(df_ecg_f, on='Time', how='outer')
-    df_p, list_of_peaks_index = Data_store.find_peaks_and_hr(df_final[start:stop])
-    df_final = df_final.merge(df_p.iloc[:,[1,6,7]], on='Time', how='outer')
+    Function return only the points of the pyramid level that match the figure width
 
-    return df_final, list_of_peaks_index
+    Output: dictionary for the ColumnDataSource ('Time' and column)
+    '''
+    level = pyramid.level_for(stop - start, width)
+    position, values = pyramid.get(start - offset, stop - offset, level)
+    return {'Time': (position + offset) / rate, column: values}
 
 
-def graph_plotting(df_graph, places_dict=None, start=0, stop=10000, place=None):
+def place_range(places_dict=None, place=None, start=0, stop=10000):
+    '''
+    Input: 1. places_dict - dictionary with different events/time (index or (start, stop) of the interval)
+           2. place - name of the event from places_dict
+           3. start, stop - interval if there is no such place
+
+    Output: 1. start, stop - interval of the graph
+            2. place_time - time of the event, s (0 - no event)
+    '''
+    # Use values from dictionary: time of the event (graph around it) or (start, stop) of the interval
+    if places_dict and place in places_dict:
+        if isinstance(places_dict[place], tuple):
+            return places_dict[place][0], places_dict[place][1], 0
+        start = places_dict[place] - 10000
+        stop = places_dict[place] + 10000
+        return start, stop, (stop + start)//2//500
+    return start, stop, 0
+
+
+@diagnostics.timed('plot')
+def graph_plotting(df_graph, places_dict=None, start=0, stop=10000, place=None, width=1000):
     '''
     Input: 1. df_graph - df with raw data
-           2. places_dict - dictionary with different events/time 
+           2. places_dict - dictionary with different events/time (index or (start, stop) of the interval)
            3. start - start index in dataframe == time in seconds * 500
            4. stop - stop index in dataframe == time in seconds * 500
            5. place - name of the event from places_dict
+           6. width - width of the figures, pixels
 
     Function return a plot (1 - graph with Hr and co2, 2 - ECG, ECG transformed, 3 - range tool)
+    ECG and co2 lines are decimated (min/max pyramid): number of points depends on the figure width, 
+    not on the interval. When the range tool zooms in, the finer level is sent.
 
     Output: plot
     '''   
-    place_time = 0
-
-    # Just add one more event that not connect with lab_names
-    if place == 'valueble changes':
-        start = 7207000
-        stop = 7240000
-    # Use values from dictionary
-    elif places_dict:
-        start = places_dict[place] - 10000
-        stop = places_dict[place] + 10000
-        place_time = (stop + start)//2//500
+    start, stop, place_time = place_range(places_dict, place, start, stop)
 
     # Find final df
     df, peaks_filter = data_transformation(df_graph, start=start, stop=stop)
 
     # Find df with peaks for highlighting
-    df_circle = df[start:stop].iloc[peaks_filter]
+    df_circle = df.iloc[peaks_filter]
     df_circle = df_circle.loc[df_circle.loc[:,'ECG_f'] < 0.4]
 
-    # Create filter for peaks
-    view = CDSView(filter=IndexFilter(peaks_filter))
+    # Min/max pyramids (ECG and co2 - for the whole case, created once; ECG_f - only for this interval)
+    signals = df_graph.signals
+    co2_rate = signals.rates['co2']
+    pyramid_ecg = signals.pyramid('ECG')
+    pyramid_co2 = signals.pyramid('co2')
+    pyramid_ecg_f = classes.Min_max_pyramid(df.loc[:, 'ECG_f'].to_numpy())
+
+    def lines_data(first, last):
+        # Data for ECG, ECG_f and co2 lines in the interval [first, last) (ECG time grid)
+        return (decimated_data(pyramid_ecg, first, last, 500, width, 'ECG'),
+                decimated_data(pyramid_ecg_f, first, last, 500, width, 'ECG_f', offset=start),
+                decimated_data(pyramid_co2, signals.index('co2', first/500), signals.index('co2', last/500), co2_rate, width, 'co2'))
+
     # Create Datasources
-    source_ecg = ColumnDataSource(df[start:stop])
-    source_co2 = ColumnDataSource(df[start:stop].dropna(subset=['co2']))
-    source_hr = ColumnDataSource(df[start:stop].dropna(subset=['Hr']))
-    source_hr_count = ColumnDataSource(df[start:stop].dropna(subset=['hr']))
+    data_ecg, data_ecg_f, data_co2 = lines_data(start, stop)
+    source_ecg = ColumnDataSource(data_ecg)
+    source_ecg_f = ColumnDataSource(data_ecg_f)
+    source_co2 = ColumnDataSource(data_co2)
+    # Overview for the range tool (always the whole interval)
+    source_select = ColumnDataSource(data_ecg)
+    source_peaks = ColumnDataSource(df.iloc[peaks_filter])
+    source_hr = ColumnDataSource(df.dropna(subset=['Hr']))
+    source_hr_count = ColumnDataSource(df.dropna(subset=['hr']))
 
     # Create figure 1 and add layouts
-    p = figure(height=400, width=1000, 
-            background_fill_color="#efefef", x_range=(df.loc[:,'Time'][start], df.loc[:,'Time'][stop]), y_range=(-0.5, 2))
+    p = figure(height=400, width=width, 
+            background_fill_color="#efefef", x_range=(start/500, stop/500), y_range=(-0.5, 2))
 
     p.line('Time', 'ECG', source=source_ecg, color='green', legend_label='Original ECG')
-    p.line('Time', 'ECG_f', source=source_ecg, color='red', legend_label='Fourier ECG')
+    p.line('Time', 'ECG_f', source=source_ecg_f, color='red', legend_label='Fourier ECG')
     p.yaxis.axis_label = 'ECG signal'
     p.xaxis.axis_label = 'Time, s'
-    p.scatter('Time', 'ECG_f', size=5, color='red',  hover_color="black", source=source_ecg, view=view)
+    p.scatter('Time', 'ECG_f', size=5, color='red',  hover_color="black", source=source_peaks)
     p.circle(x=df_circle['Time'], y=df_circle['ECG_f'], line_color='black', size=70, fill_alpha=0)
     
     # Add vertical line and label if place_time is active
@@ -141,7 +300,7 @@ def graph_plotting(df_graph, places_dict=None, start=0, stop=10000, place=None):
         p.add_layout(label)
 
     # Create figure 2 and add layouts
-    p2 = figure(height=400, width=1000, 
+    p2 = figure(height=400, width=width, 
             background_fill_color="#efefef", x_range=p.x_range, y_range=(-5, df.loc[:,'hr'].max()+5))
 
     p2.line('Time', 'co2', source=source_co2, color = "blue", legend_label='co2 level (breathing)')
@@ -161,22 +320,32 @@ def graph_plotting(df_graph, places_dict=None, start=0, stop=10000, place=None):
 
     # Create range tool
     select = figure(title="Drag the middle and edges of the selection box to change the range above",
-                    height=150, width=1000,    y_range=p.y_range,
+                    height=150, width=width,    y_range=p.y_range,
                     tools="", toolbar_location=None, background_fill_color="#efefef")
 
     range_tool = RangeTool(x_range=p.x_range)
     range_tool.overlay.fill_color = "navy"
     range_tool.overlay.fill_alpha = 0.2
 
-    select.line('Time', 'ECG', source=source_ecg)
+    select.line('Time', 'ECG', source=source_select)
     select.ygrid.grid_line_color = None
     select.add_tools(range_tool)
     select.toolbar.active_multi = 'auto'
 
+    def zoom(attr, old, new):
+        # Send the level of the pyramid that match the new visible interval
+        first = min(max(int(p.x_range.start * 500), start), stop)
+        last = max(min(int(p.x_range.end * 500) + 1, stop), first)
+        source_ecg.data, source_ecg_f.data, source_co2.data = lines_data(first, last)
+
+    p.x_range.on_change('start', zoom)
+    p.x_range.on_change('end', zoom)
+
     return(column(p2, p, select))
 
 
 
+@diagnostics.timed('streaming values', samples=lambda df_class, start, stop: stop - start + 1)
 def give_values_for_streaming(df_class, start, stop):
     """ 
     Input: 1. df_class - dataframe placed in the class
@@ -184,25 +353,370 @@ def give_values_for_streaming(df_class, start, stop):
            4. stop - stop index in dataframe == time in seconds * 500
 
     Function, kind of, combination between data_transformation() and first steps of the graph_plotting()
+    The result is computed once for all sessions (df_class.stream_results), every caller gets its own df.
 
-    Output: df_final - df with all data + interpolate for 'NaN' values (for the streaming)
+    Output: df_final - df with all data (only for the [start:stop] interval, both included) 
+            + interpolate for 'NaN' values (for the streaming)
     """
-    ecg_f = df_class.fourier_transform(np.array(df_class.raw_data.loc[start:stop,'ECG']))
-    df_ecg_f = pd.DataFrame(np.array([np.array(df_class.raw_data.loc[start:stop,'Time']), ecg_f])).T
-    df_ecg_f.rename(columns = {0:'Time', 1:'ECG_f'}, inplace = True )
-    new_df = df_class.raw_data.merge(df_ecg_f, on='Time', how='outer')
-
-    df_p, list_of_peaks_index = df_class.find_peaks_and_hr(new_df)
-    df_final = new_df.merge(df_p.iloc[:,[1,6,7]], on='Time', how='outer')
-    df_final.iloc[:,[2,3,6]] = df_final.iloc[:,[2,3,6]] .interpolate(method='linear', axis=0)
-    df_final.loc[:, 'error peaks'] = np.where((df_final.loc[:, 'peaks'] == 1.0)&(df_final.loc[:, 'ECG_f'] < 0.4), df_final.loc[:, 'ECG_f'], np.nan)
-    
-    return df_final
+    def values_for_streaming():
+        # co2 and Hr are interpolated by the store (neighbour values outside the interval are used too)
+        df_final = df_class.window_frame(start, stop + 1, interpolate=('co2', 'Hr'))
+        df_final.loc[:, 'ECG_f'], peaks, hr = df_class.transform_range(start, stop + 1)
+        df_final.loc[:, 'peaks'] = np.nan
+        df_final.loc[:, 'hr'] = np.nan
+        df_final.loc[peaks, 'peaks'] = 1
+        df_final.loc[peaks, 'hr'] = hr
+        df_final.loc[:, 'hr'] = df_final.loc[:, 'hr'].interpolate(method='linear', axis=0)
+        df_final.loc[:, 'error peaks'] = np.where((df_final.loc[:, 'peaks'] == 1.0)&(df_final.loc[:, 'ECG_f'] < 0.4), df_final.loc[:, 'ECG_f'], np.nan)
+        return frame_arrays(df_final)
+
+    return arrays_frame(df_class.stream_results.compute(('streaming', start, stop), values_for_streaming))
+
+
+def peak_agreement(detected, reference, tolerance=25):
+    '''
+    Input: 1. detected - indexes of the detected peaks
+           2. reference - indexes of the reference peaks (for example nk.ecg_peaks)
+           3. tolerance - max distance between the same peaks, points (25 == 50 ms for 500 Hz)
+
+    Output: dictionary with sensitivity (share of reference peaks that were found), 
+            ppv (share of detected peaks that are in the reference) and mean distance between matched peaks
+    '''
+    detected = np.sort(np.asarray(detected))
+    reference = np.sort(np.asarray(reference))
+
+    def nearest(a, b):
+        # Distance from every point of 'a' to the nearest point of 'b'
+        if b.size == 0:
+            return np.full(a.size, np.inf)
+        position = np.clip(np.searchsorted(b, a), 1, b.size) - 1
+        right = np.minimum(position + 1, b.size - 1)
+        return np.minimum(np.abs(a - b[position]), np.abs(a - b[right]))
+
+    to_detected = nearest(reference, detected)
+    to_reference = nearest(detected, reference)
+    matched = to_detected <= tolerance
+    return {'detected': int(detected.size), 'reference': int(reference.size),
+            'sensitivity': float(matched.mean()) if reference.size else float('nan'),
+            'ppv': float((to_reference <= tolerance).mean()) if detected.size else float('nan'),
+            'mean offset': float(to_detected[matched].mean()) if matched.any() else float('nan')}
+
+
+def validate_online_detector(df_class, start=0, stop=None, chunk_size=500, tolerance=25):
+    '''
+    Input: 1. df_class - dataframe placed in the class
+           2. start, stop - indexes in the ECG time grid (None - whole case)
+           3. chunk_size - number of points given to the detector at once
+           4. tolerance - max distance between the same peaks, points
+
+    Function compare classes.Online_peak_detector with the peaks from nk.ecg_peaks (cached tiles) 
+    for the same filtered ECG and measure the detector throughput
+
+    Output: dictionary with the agreement (peak_agreement()) and 'samples per second'
+    '''
+    stop = df_class.signals.channels['ECG'].size if stop is None else stop
+    ecg_f, reference, _ = df_class.transform_range(start, stop)
+
+    detector = classes.Online_peak_detector(rate=500)
+    peaks = []
+    time_start = time.perf_counter()
+    for i in range(0, ecg_f.size, chunk_size):
+        peaks.append(detector.process(ecg_f[i:i + chunk_size])[0])
+    peaks.append(detector.flush()[0])
+    elapsed = time.perf_counter() - time_start
+
+    result = peak_agreement(np.concatenate(peaks) + start, reference, tolerance)
+    result['samples per second'] = ecg_f.size / elapsed if elapsed else float('inf')
+    return result
+
+
+def peaks_for_segment(ecg, offset, start, stop, rate=500, spans=None):
+    '''
+    Input: 1. ecg - raw ECG of the segment (with overlap on both sides)
+           2. offset - index of the first point of the segment in the ECG time grid
+           3. start, stop - part of the segment that belongs to it (without overlap), [start, stop)
+           4. rate - sampling rate of the ECG
+           5. spans - good spans of the segment (ECG time grid, see classes.Quality_mask), None - the whole segment
+
+    Function filter the segment and find peaks (runs in the worker process)
+
+    Output: indexes of the peaks in [start, stop) (ECG time grid)
+    '''
+    data_store = classes.Data_store(None)
+    index = np.arange(offset, offset + ecg.size)
+    df = pd.DataFrame({'Time': index / rate, 'ECG': ecg}, index=index)
+    _, peaks, _ = data_store.process_spans(df, [(offset, offset + ecg.size)] if spans is None else spans)
+    return peaks[(peaks >= start) & (peaks < stop)]
+
+
+@diagnostics.timed('whole case peaks', samples=lambda ecg, *args, **kwargs: len(ecg))
+def whole_case_peaks(ecg, rate=500, segment=30000, overlap=1000, workers=None, min_distance=50, quality=None):
+    '''
+    Input: 1. ecg - raw ECG of the whole case (1D-array)
+           2. rate - sampling rate of the ECG
+           3. segment - number of points in one segment (30000 == 1 min)
+           4. overlap - extra points on each side of the segment (filter and peak detection edge effects)
+           5. workers - number of processes (None - all cores, 1 - in this process)
+           6. min_distance - peaks closer than this number of points are the same peak (100 ms)
+           7. quality - classes.Quality_mask of the ECG (optional): masked parts are not processed, 
+              segments without good spans are skipped
+
+    Function split the ECG into overlapping segments, filter them and find peaks in the process pool.
+    Every segment keeps only the peaks in its own part, so the overlap gives no duplicates. 
+    The same peak can still be found on both sides of the border with a small shift - 
+    such pairs (closer than min_distance) are merged (the first one is kept).
+    The result does not depend on the number of workers.
+
+    Output: 1. peaks - global index of all peaks (ECG time grid)
+            2. hr - calculated Hr for every peak (60 / RR interval, NaN for the first peak)
+    '''
+    ecg = np.asarray(ecg)
+    starts = list(range(0, ecg.size, segment))
+    tasks = []
+    for start in starts:
+        first, last = max(start - overlap, 0), min(start + segment + overlap, ecg.size)
+        spans = None if quality is None else quality.good_spans(first, last, classes.Data_store.min_span)
+        if spans == []:
+            continue
+        tasks.append((ecg[first:last], first, start, start + segment, rate, spans))
+    if workers == 1:
+        results = [peaks_for_segment(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(peaks_for_segment, *zip(*tasks)))
+
+    peaks = np.concatenate(results) if results else np.zeros(0, dtype=np.int64)
+    # Stitching: remove the second peak of the pairs found on both sides of the border
+    if peaks.size:
+        peaks = peaks[np.concatenate([[True], np.diff(peaks) >= min_distance])]
+    hr = np.full(peaks.size, np.nan)
+    hr[1:] = 60 * rate / np.diff(peaks)
+    if quality is not None and peaks.size:
+        # RR interval over the masked part is not valid
+        hr[1:][quality.overlaps(peaks[:-1], peaks[1:])] = np.nan
+    return peaks, hr
+
+
+def case_hrv(df_class, workers=None):
+    '''
+    Input: 1. df_class - dataframe placed in the class
+           2. workers - number of processes for whole_case_peaks()
+
+    Function find all peaks of the case and create the HRV engine (once, the result is kept in the class)
+
+    Output: classes.Hrv_metrics (use .summary(start, stop) for any range and .rolling(window, step) for the graphs)
+    '''
+    if df_class.hrv is None:
+        rate = df_class.signals.rates['ECG']
+        peaks, _ = whole_case_peaks(df_class.signals.channels['ECG'][:], rate=rate, workers=workers,
+                                    quality=df_class.signals.quality.get('ECG'))
+        df_class.hrv = classes.Hrv_metrics(peaks, rate=rate)
+    return df_class.hrv
+
+
+def true_runs(mask):
+    '''
+    Input: 1. mask - 1D boolean array
+
+    Output: 1. starts - index of the first element of every run of True values
+            2. stops - index after the last element of every run
+    '''
+    edges = np.diff(np.concatenate([[0], np.asarray(mask, dtype=np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
 
 
-def graph_plotting_streaming(source):
+def merge_runs(starts, stops, gap=0, min_length=0):
+    '''
+    Input: 1. starts, stops - sorted runs ([start, stop))
+           2. gap - runs with a smaller distance between them are merged into one run
+           3. min_length - shorter runs (after the merge) are removed
+
+    Output: starts, stops of the merged runs
+    '''
+    starts, stops = np.asarray(starts), np.asarray(stops)
+    if starts.size:
+        split = starts[1:] - stops[:-1] >= gap
+        starts = starts[np.concatenate([[True], split])]
+        stops = stops[np.concatenate([split, [True]])]
+    keep = stops - starts >= min_length
+    return starts[keep], stops[keep]
+
+
+def mask_events(mask, unit_start, unit_stop, values, gap=0, min_length=0):
+    '''
+    Input: 1. mask - 1D boolean array, one value for every unit (beat, window, breath)
+           2. unit_start, unit_stop - sorted position of every unit (ECG time grid)
+           3. values - value of every unit (for the score)
+           4. gap, min_length - see merge_runs() (ECG time grid)
+
+    Output: 1. starts, stops - events (runs of the units from the mask)
+            2. scores - mean value of the masked units inside every event
+    '''
+    first, last = true_runs(mask)
+    starts, stops = merge_runs(unit_start[first], unit_stop[last - 1], gap, min_length)
+    # Mean of the masked values inside every event from the cumulative sums
+    cum_values = np.concatenate([[0], np.cumsum(np.where(mask, values, 0))])
+    cum_count = np.concatenate([[0], np.cumsum(mask)])
+    i0 = np.searchsorted(unit_start, starts, side='left')
+    i1 = np.searchsorted(unit_start, stops, side='left')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = (cum_values[i1] - cum_values[i0]) / (cum_count[i1] - cum_count[i0])
+    return starts, stops, scores
+
+
+def signal_quality(values, rate, low=None, high=None, flat=None, clip=None, gap=0, tolerance=1e-6):
+    '''
+    Input: 1. values - 1D-array with the raw channel
+           2. rate - sampling rate of the channel
+           3. low, high - valid range of the values (None - no saturation check)
+           4. flat - shortest flatline (no change of the value), s (None - no check)
+           5. clip - shortest run at the min / max value of the channel (clipping), s (None - no check)
+           6. gap - runs of the same kind with a smaller distance between them are merged, s
+           7. tolerance - smaller changes of the value are no change (flatline, clipping)
+
+    Function find the artifacts of the channel with vectorized masks and runs: lead-off (NaN), 
+    saturation (values outside (low, high)), clipping (values stuck at the rail) and flatline
+
+    Output: classes.Quality_mask
+    '''
+    values = np.asarray(values, dtype=float)
+    nan = np.isnan(values)
+    runs = {'lead-off': true_runs(nan)}
+    with np.errstate(invalid='ignore'):
+        if low is not None:
+            runs['saturation'] = true_runs((values <= low) | (values >= high))
+        if clip is not None and not nan.all():
+            top, bottom = np.nanmax(values), np.nanmin(values)
+            starts, stops = true_runs((values >= top - tolerance) | (values <= bottom + tolerance))
+            keep = stops - starts >= clip * rate
+            runs['clipping'] = starts[keep], stops[keep]
+        if flat is not None:
+            # Run of k equal differences - k + 1 equal values
+            starts, stops = true_runs(np.abs(np.diff(values)) <= tolerance)
+            keep = stops - starts + 1 >= flat * rate
+            runs['flatline'] = starts[keep], stops[keep] + 1
+    runs = {kind: merge_runs(starts, stops, gap * rate) for kind, (starts, stops) in runs.items()}
+    return classes.Quality_mask(values.size,
+                                np.concatenate([starts for starts, _ in runs.values()]),
+                                np.concatenate([stops for _, stops in runs.values()]),
+                                np.concatenate([np.full(len(starts), classes.Quality_mask.KINDS.index(kind))
+                                                for kind, (starts, _) in runs.items()]))
+
+
+@diagnostics.timed('event detection')
+def detect_events(df_class, abp_beats=None, tachycardia=100, min_duration=10, merge_gap=5, irregular_cv=0.1,
+                  error_level=0.4, co2_gap=15, low_map=65, high_sys=160):
+    '''
+    Input: 1. df_class - dataframe placed in the class (case_hrv() is used for the peaks)
+           2. abp_beats - ABP beats (BEAT_DTYPE, segment_beats()) on the ECG time grid (optional)
+           3. tachycardia - calculated Hr above this value, bpm
+           4. min_duration - shorter events are skipped, s
+           5. merge_gap - events of the same kind closer than this value are merged, s
+           6. irregular_cv - coefficient of variation of RR (30 s windows) above this value - irregular rhythm
+           7. error_level - peaks with filtered ECG below this value are the error peaks (as on the graph)
+           8. co2_gap - no breaths longer than this value (and 3 median breath intervals) - co2 pattern break, s
+           9. low_map, high_sys - Mean AP below / Sys BP above these values - ABP excursion, mmHg
+
+    Function scan the whole case once (vectorized masks and runs) and find the clinical events
+
+    Output: classes.Event_index (score: tachycardia - mean Hr, irregular rhythm - mean RR cv, 
+            error peaks - number of peaks, co2 break - length of the gap in s, hypotension - mean MAP, 
+            hypertension - mean Sys BP)
+    '''
+    signals = df_class.signals
+    rate = signals.rates['ECG']
+    hrv = case_hrv(df_class)
+    gap, min_length = merge_gap * rate, min_duration * rate
+    events = {}
+
+    # Tachycardia: runs of beats with the calculated Hr above the limit
+    valid = (hrv.rr >= 0.25) & (hrv.rr <= 2.0)
+    with np.errstate(divide='ignore'):
+        hr = 60 / hrv.rr
+    events['tachycardia'] = mask_events(valid & (hr > tachycardia), hrv.peaks[:-1], hrv.peaks[1:], hr, gap, min_length)
+
+    # Irregular rhythm: RR coefficient of variation in the 30 s windows (step 5 s)
+    windows = hrv.rolling(window=30, step=5)
+    end = np.round(windows.loc[:, 'Time'].to_numpy() * rate).astype(np.int64)
+    cv = windows.loc[:, 'cv'].to_numpy()
+    irregular = (windows.loc[:, 'beats'].to_numpy() >= 10) & (cv > irregular_cv)
+    events['irregular rhythm'] = mask_events(irregular, end - 30 * rate, end, cv, gap, min_length)
+
+    # Error peaks: peaks with too low filtered ECG. Only the good spans of the ECG are filtered (block by block),
+    # the filter starts again in every span (as Data_store.process_spans), peaks in the masked parts are skipped
+    ecg = signals.channels['ECG']
+    quality = signals.quality.get('ECG')
+    spans = [(0, ecg.size)] if quality is None else quality.good_spans(0, ecg.size, classes.Data_store.min_span)
+    peak_values = np.full(hrv.peaks.size, np.nan)
+    block = 1000000
+    for span_start, span_stop in spans:
+        block_filter = classes.Block_fir_filter(classes.filter_bank('ECG'))
+        for first in range(span_start, span_stop, block):
+            last = min(first + block, span_stop)
+            ecg_f = block_filter.process(np.nan_to_num(ecg[first:last]))
+            inside = slice(*np.searchsorted(hrv.peaks, [first, last], side='left'))
+            peak_values[inside] = ecg_f[hrv.peaks[inside] - first]
+    with np.errstate(invalid='ignore'):
+        error = peak_values < error_level
+    # Groups of at least 3 error peaks (gaps below 10 s)
+    starts, stops, _ = mask_events(error, hrv.peaks, hrv.peaks + 1, peak_values, 10 * rate)
+    count = np.searchsorted(hrv.peaks[error], stops, side='left') - np.searchsorted(hrv.peaks[error], starts, side='left')
+    events['error peaks'] = (starts[count >= 3], stops[count >= 3], count[count >= 3])
+
+    # co2 pattern break: no breaths (rising crossings of the half of the high co2 level) for a long time
+    co2 = signals.channels['co2'][:]
+    co2_rate = signals.rates['co2']
+    # Masked co2 (disconnected sensor, flatline) has no breaths and gives no breaks
+    co2_quality = signals.quality.get('co2')
+    if co2_quality is not None:
+        co2[co2_quality.mask(0, co2.size)] = np.nan
+    # Low-pass filter (FILTER_BANK['co2']) removes the noise crossings of the half level (false breaths),
+    # the output is shifted back by the filter delay (taps // 2)
+    delay = classes.FILTER_BANK['co2']['taps'] // 2
+    co2_f = classes.Block_fir_filter(classes.filter_bank('co2')).process(np.concatenate([np.nan_to_num(co2), np.zeros(delay)]))[delay:]
+    co2 = np.where(np.isnan(co2), np.nan, co2_f)
+    high = np.nanpercentile(co2, 95) if np.isfinite(co2).any() else np.nan
+    breaths = np.flatnonzero(np.diff((co2 > high / 2).astype(np.int8)) == 1) + 1
+    breath_gap = np.diff(breaths) / co2_rate
+    limit = max(co2_gap, 3 * np.median(breath_gap)) if breath_gap.size else co2_gap
+    position = np.round(breaths * rate / co2_rate).astype(np.int64)
+    pattern_break = breath_gap > limit
+    if co2_quality is not None:
+        pattern_break &= ~co2_quality.overlaps(breaths[:-1], breaths[1:])
+    events['co2 break'] = mask_events(pattern_break, position[:-1], position[1:], breath_gap)
+
+    # ABP excursions: runs of beats with low Mean AP or high Sys BP
+    if abp_beats is not None and len(abp_beats) > 1:
+        beat_start = abp_beats['start'][:-1]
+        beat_stop = abp_beats['start'][1:]
+        mean_ap, sys_bp = abp_beats['mean'][:-1], abp_beats['sys'][:-1]
+        events['hypotension'] = mask_events(mean_ap < low_map, beat_start, beat_stop, mean_ap, gap, min_length)
+        events['hypertension'] = mask_events(sys_bp > high_sys, beat_start, beat_stop, sys_bp, gap, min_length)
+
+    return classes.Event_index(np.concatenate([starts for starts, _, _ in events.values()]),
+                               np.concatenate([stops for _, stops, _ in events.values()]),
+                               np.concatenate([np.full(len(starts), kind) for kind, (starts, _, _) in events.items()]),
+                               np.concatenate([scores for _, _, scores in events.values()]))
+
+
+def case_events(df_class, abp_beats=None):
+    '''
+    Input: 1. df_class - dataframe placed in the class
+           2. abp_beats - ABP beats for the ABP excursions (optional)
+
+    Function detect the events of the case once (the result is kept in the class)
+
+    Output: classes.Event_index (use .range(start, stop) and .nearest(index) for the navigation)
+    '''
+    if df_class.events is None:
+        df_class.events = detect_events(df_class, abp_beats)
+    return df_class.events
+
+
+def graph_plotting_streaming(source, events=None):
     '''
     Input: 1. source - ColumnDataSource dictionary with all datas for these graphs
+           2. events - ColumnDataSource with the error peaks (if None - 'error peaks' column of the source)
 
     Function return a plot (1 - graph with Hr and co2, 2 - ECG, ECG transformed)
 
@@ -214,7 +728,7 @@ def graph_plotting_streaming(source):
             background_fill_color="#efefef", y_range=(-0.5, 2)) 
 
     # ECG line
-    p.line('Time', 'ECG', source=source, color='green', legend_label='Original ECG')
+    ecg_line = p.line('Time', 'ECG', source=source, color='green', legend_label='Original ECG')
     # ECG transformed line
     p.line('Time', 'ECG_f', source=source, color='red', legend_label='Fourier ECG')
     
@@ -224,7 +738,9 @@ def graph_plotting_streaming(source):
     # ECG transformed dots
     p.scatter('Time', 'ECG_f', size=5, color='red',  hover_color="black", source=source) 
     # Big circles for the filtered peaks (too low values for the peaks)
-    p.circle('Time', 'error peaks', source=source, line_color='black', size=70, fill_alpha=0)
+    p.circle('Time', 'error peaks', source=source if events is None else events, line_color='black', size=70, fill_alpha=0)
+    # x range follows the ECG only (old error peaks stay in their source longer than the lines)
+    p.x_range.renderers = [ecg_line]
 
     # Create figure 2 and add layouts
     p2 = figure(height=400, width=1000, background_fill_color="#efefef", x_range=p.x_range)  
@@ -252,17 +768,112 @@ def rolling_window(np_array, window, step=1):
            2. window - the size of the window
            3. step - the size of the "sliding" action
 
-    The function return a 1D-array with smoothing data.
-    Slightly modified version of https://gist.github.com/tclements/7452c0fac3e66e08b886300b4e24e687
-    *Work 3 times faster then Pandas 'rolling'
+    The function return a 1D-array with smoothing data (mean of every full window).
+    Cumulative sums kernel (rolling.rolling_mean), O(n) for any window 
+    (the former strided version - rolling.strided_mean, O(n*w))
 
     Output: 1D-array with smoothing data
     '''
-    # Create a 2D - array with shape (np_array.size - window + 1, window) (if step == 1)
-    shape = np_array.shape[:-1] + ((np_array.shape[-1] - window + 1)//step, window)
-    strides = (np_array.strides[0] * step,) + (np_array.strides[-1],)
-    # Count mean value for each row and return mean_values 1D-array
-    return np.mean(np.lib.stride_tricks.as_strided(np_array, shape=shape, strides=strides), axis=1)
+    return rolling.rolling_mean(np_array, window, mode='valid', step=step)
+
+
+def abp_filter(first_value):
+    '''
+    Input: 1. first_value - first point of the ABP wave
+
+    Output: classes.Block_fir_filter with the ABP low-pass filter (FILTER_BANK['ABP']), 
+            the filter state is filled with the first point (no ramp from zero at the start of the wave)
+    '''
+    block_filter = classes.Block_fir_filter(classes.filter_bank('ABP'))
+    block_filter.process(np.full(block_filter.h.size - 1, first_value))
+    return block_filter
+
+
+def smooth_abp(np_array):
+    '''
+    Input: 1. np_array - 1D-array (clipped ABP wave)
+
+    The function smooths the wave with the ABP low-pass filter (FILTER_BANK['ABP']), 
+    the output is shifted back by the filter delay (taps // 2), the end is extended with the last point
+
+    Output: 1D-array with smoothing data (same size as the input)
+    '''
+    np_array = np.asarray(np_array, dtype=float)
+    if np_array.size == 0:
+        return np.zeros(0)
+    delay = classes.FILTER_BANK['ABP']['taps'] // 2
+    return abp_filter(np_array[0]).process(np.concatenate([np_array, np.full(delay, np_array[-1])]))[delay:]
+
+
+def period_track(np_array, sampling_rate=500, window=30, step=10, segment=8, band=(0.5, 3.0), chunk=256, workers=None):
+    '''
+    Input: 1. np_array - 1D-array
+           2. sampling_rate - for the 'Arterial pressure wave' rate = 500 Hz
+           3. window, step - length of the analysis window and the distance between windows, s
+           4. segment - length of one FFT segment, s (50% overlap)
+           5. band - frequency range of one oscillation, Hz (0.5 - 3.0 Hz == 30 - 180 bpm)
+           6. chunk - number of segments in one FFT call (memory ~ chunk * segment points for any signal length)
+           7. workers - number of threads for the FFT (scipy.fft, None - one thread)
+
+    Welch-style estimate of the local period: every segment - mean removed, Hann window, power spectrum.
+    Spectra of the segments inside every analysis window are averaged (cumulative sums), 
+    the frequency of the maximum is refined between the bins (parabola). 
+    Only the band bins are kept, so no full-length FFT is needed.
+    Signal shorter than one window - one window (signal shorter than one segment - one zero padded FFT), 
+    the periods are always inside the band.
+
+    Output: 1. centers - index of the center of every analysis window
+            2. periods - The number of points for one oscillation in every window
+    '''
+    from scipy import fft
+
+    np_array = np.asarray(np_array, dtype=float)
+    size = np_array.size
+    if size < 2:
+        raise ValueError(f"period_track() needs at least 2 points, got {size}")
+    length = min(int(segment * sampling_rate), size)
+    hop = max(length // 2, 1)
+    n_segments = (size - length) // hop + 1
+    # Band bins + one bin on every side for the interpolation
+    # Short signal - zero padding, so the band has at least a few bins
+    n_fft = max(length, int(2 * sampling_rate / band[0]))
+    freqs = np.fft.rfftfreq(n_fft, d=1/sampling_rate)
+    inside = np.flatnonzero((freqs >= band[0]) & (freqs <= band[1]))
+    first, last = max(inside[0] - 1, 0), min(inside[-1] + 2, freqs.size)
+
+    view = np.lib.stride_tricks.as_strided(np_array, shape=(n_segments, length), strides=(np_array.strides[0] * hop, np_array.strides[0]))
+    hann = np.hanning(length)
+    power = np.zeros((n_segments + 1, last - first))
+    for start in range(0, n_segments, chunk):
+        block = view[start:start + chunk] - view[start:start + chunk].mean(axis=1, keepdims=True)
+        # Gaps in the track (NaN) - no power, so the sums of the next windows stay valid
+        block[np.isnan(block)] = 0.0
+        block *= hann
+        spectrum = fft.rfft(block, n=n_fft, axis=1, workers=workers)[:, first:last]
+        power[start + 1:start + 1 + block.shape[0]] = spectrum.real**2 + spectrum.imag**2
+    # Cumulative sums over the segments: average spectrum of any window in O(1)
+    np.cumsum(power, axis=0, out=power)
+
+    per_window = min(max((int(window * sampling_rate) - length) // hop + 1, 1), n_segments)
+    per_step = max(int(step * sampling_rate) // hop, 1)
+    starts = np.arange(0, n_segments - per_window + 1, per_step)
+    average = (power[starts + per_window] - power[starts]) / per_window
+
+    # Maximum only in the band, neighbours for the parabola
+    band_bins = slice(inside[0] - first, inside[-1] - first + 1)
+    peak = average[:, band_bins].argmax(axis=1) + band_bins.start
+    rows = np.arange(starts.size)
+    left = average[rows, np.maximum(peak - 1, 0)]
+    center = average[rows, peak]
+    right = average[rows, np.minimum(peak + 1, average.shape[1] - 1)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.where(left - 2 * center + right < 0, 0.5 * (left - right) / (left - 2 * center + right), 0.0)
+    frequency = freqs[first + peak] + np.clip(shift, -0.5, 0.5) * freqs[1]
+    # Interpolation at the band edge (coarse bins of a short signal) can go out of the band
+    frequency = np.clip(frequency, band[0], band[1])
+
+    centers = starts * hop + ((per_window - 1) * hop + length) // 2
+    return centers, sampling_rate / frequency
 
 
 def find_period(np_array, sampling_rate=500):
@@ -270,20 +881,14 @@ def find_period(np_array, sampling_rate=500):
     Input: 1. np_array - 1D-array
            2. sampling_rate - for the 'Arterial pressure wave' rate = 500 Hz
 
-    The function searches for the Maximum period of oscillation in a certain range 
-    (unit wave element) using the Fourier transform.
+    The function searches for the period of oscillation (unit wave element) 
+    as the median of the local periods (period_track(), 0.5 - 3.0 Hz).
+    The former version returned the frequency of the spectrum maximum (0.2 - 1.5 Hz) multiplied by the rate, 
+    it was the period only at 60 bpm.
 
     Output: Period for unit wave element
     '''
-    # Standart Fourier transformation
-    c = np.fft.fft(np_array, norm='forward')
-    f = np.fft.fftfreq(np_array.size, d=1/sampling_rate)
-    # Condition that help to find only one oscilation
-    cond = (f > 0.2)&(f < 1.5)
-    # Find max value
-    fmax = f[np.argmax(np.abs(c) * cond)]
-    # Find period
-    return round(fmax*sampling_rate)
+    return int(round(np.median(period_track(np_array, sampling_rate=sampling_rate)[1])))
 
 
 def find_min_max_average(np_array, period):
@@ -341,30 +946,142 @@ def find_min_max_average(np_array, period):
     return value_list[1:]
 
 
-def abp_from_raw_to_df(np_array, rate=500):
+# Result of segment_beats() - one row for every wave
+BEAT_DTYPE = np.dtype([('dia', float), ('sys', float), ('mean', float), ('start', np.int64)])
+
+
+def find_beat_borders(np_array, period, min_left=None):
+    '''
+    Input: 1. np_array - 1D-array
+           2. period - The number of points for one oscillation (approx) + 50 
+                       or tuple (centers, periods + 50) with the local values (period_track())
+           3. min_left - index of the first left border (None - minimum of the first period)
+
+    Every window starts at the previous border, so the chain of borders is followed 
+    with one argmin per wave (no arrays are created in the loop).
+    With the local values the window of every wave is taken from the nearest analysis window.
+
+    Output: 1D-array with indexes of all borders (left border of every wave + right border of the last one)
+    '''
+    if isinstance(period, tuple):
+        centers, periods = period
+        periods = [int(value) for value in np.round(periods)]
+        first = int(centers[0])
+        hop = int(centers[1] - centers[0]) if len(centers) > 1 else 1
+        last = len(periods) - 1
+
+        def window(index):
+            return periods[min(max((index - first + hop // 2) // hop, 0), last)]
+    else:
+        def window(index):
+            return period
+
+    if min_left is None:
+        min_left = int(np_array[:window(0)].argmin())
+    borders = [min_left]
+    size = window(min_left)
+    # Do while number of points more then period
+    while np_array.size - min_left > size:
+        min_left = int(np_array[min_left + 10 : min_left + size].argmin()) + min_left + 10
+        borders.append(min_left)
+        size = window(min_left)
+    return np.array(borders)
+
+
+def beat_values(np_array, borders):
     '''
     Input: 1. np_array - 1D-array
+           2. borders - indexes of the borders (from find_beat_borders())
+
+    Diastolic, systolic and trapezoid mean pressure are calculated for all waves in bulk 
+    and written to the preallocated structured array. 
+    Waves with (max - min) < 5 are skipped.
+
+    Output: structured array (fields 'dia', 'sys', 'mean', 'start'), one row for every wave
+    '''
+    if borders.size < 2:
+        return np.zeros(0, dtype=BEAT_DTYPE)
+    min_left = borders[:-1]
+    min_right = borders[1:]
+
+    # Values for all waves (reduceat - sum / max for every [left, right) segment)
+    maximum = np.maximum.reduceat(np_array, borders)[:-1]
+    area = np.add.reduceat(np_array, borders)[:-1] - (np_array[min_left] + np_array[min_right - 1]) / 2
+    average = area / (min_right - min_left)
+    # If difference between min and max values too small ==> element not a waveform
+    waves = (maximum - np_array[min_left]) >= 5
+
+    value_list = np.zeros(np.count_nonzero(waves), dtype=BEAT_DTYPE)
+    value_list['dia'] = np.round(np_array[min_left[waves]])
+    value_list['sys'] = np.round(maximum[waves])
+    value_list['mean'] = np.round(average[waves])
+    value_list['start'] = min_left[waves]
+    return value_list
+
+
+@diagnostics.timed('beat segmentation', samples=lambda np_array, period: len(np_array))
+def segment_beats(np_array, period):
+    '''
+    Input: 1. np_array - 1D-array
+           2. period - The number of points for one oscillation (approx) 
+                       or tuple (centers, periods) with the local values (period_track())
+
+    Vectorized version of find_min_max_average() with the same rules 
+    (search window = period + 50, right border at least 10 points after the left border, 
+    waves with (max - min) < 5 are skipped).
+
+    Output: structured array (fields 'dia', 'sys', 'mean', 'start'), one row for every wave
+    '''
+    np_array = np.asarray(np_array, dtype=float)
+    if isinstance(period, tuple):
+        period = (period[0], np.asarray(period[1]) + 50)
+        first = period[1][0] if len(period[1]) else np_array.size
+    else:
+        period = first = period + 50
+    if np_array.size <= first:
+        return np.zeros(0, dtype=BEAT_DTYPE)
+    return beat_values(np_array, find_beat_borders(np_array, period))
+
+
+def abp_beats(np_array, rate=500, period=None):
+    '''
+    Input: 1. np_array - 2D-array (raw ABP track, as vitaldb.load_case())
            2. rate - for the 'Arterial pressure wave' rate = 500 Hz
+           3. period - The number of points for one oscillation (None - local period, period_track())
+
+    Output: 1. np_array - smoothed ABP wave (1D-array, smooth_abp())
+            2. period - period or period track that was used
+            3. v_list - structured array from segment_beats(), one row for every wave
+    '''
+    # Clearing the data. Anything below 25 and above 200 (new array, the input is not changed)
+    np_array = np.clip(np_array, 25, 200)
+    # Smoothing data (ABP low-pass filter)
+    np_array = smooth_abp(np_array[:,0])
+    # Find Preassure values (Sys, Dia, MAP); heart rate drifts, so the period is local by default
+    if period is None:
+        period = period_track(np_array, sampling_rate=rate)
+    return np_array, period, segment_beats(np_array, period)
+
+
+@diagnostics.timed('abp processing', samples=lambda np_array, rate=500, period=None: len(np_array))
+def abp_from_raw_to_df(np_array, rate=500, period=None):
+    '''
+    Input: 1. np_array - 2D-array (raw ABP track, as vitaldb.load_case())
+           2. rate - for the 'Arterial pressure wave' rate = 500 Hz
+           3. period - The number of points for one oscillation (None - local period, period_track())
 
     The function combine other functions and process raw ABP signal to pd DataFrame with a lot of different data
 
     Output: pd.DataFrame (columns = 'Time','ABP', 'Dia BP',	'Sys BP', 'Mean AP', 'diff')
     '''
-    # Clearing the data. Anything below 25 and above 200 
-    np_array.clip(min=25, out=np_array)
-    np_array.clip(max=200, out=np_array)
-    # Smoothing data
-    np_array = rolling_window(np_array[:,0], 10, 1)
-    # Find Preassure values (Sys, Dia, MAP)
-    period = find_period(np_array, sampling_rate=rate)
-    v_list = find_min_max_average(np_array, period)
+    np_array, _, v_list = abp_beats(np_array, rate, period)
     # Add time values
     time_abp = np.arange(0, np_array.size, 1) * 1/500
 
     # Data contain millions of values, so using np.array() - fastest way
     df1 = pd.DataFrame(np.array([time_abp, np_array])).T
     df2 = pd.DataFrame(v_list)
-    df2 = df2.set_index(3)
+    df2 = df2.set_index('start')
     # Combine all received values into one dataframe
     merged_df = pd.merge(df1, df2, left_index=True, right_index=True, how='left')
     # Rename columns
@@ -377,10 +1094,138 @@ def abp_from_raw_to_df(np_array, rate=500):
     return merged_df
 
 
+def abp_chunks(np_array, chunk_size=300000):
+    '''
+    Input: 1. np_array - 1D or 2D-array (raw ABP track)
+           2. chunk_size - number of points in one chunk (300000 == 10 min for 500 Hz)
+
+    Output: iterator over the parts (views) of the array
+    '''
+    for i in range(0, len(np_array), chunk_size):
+        yield np_array[i:i + chunk_size]
+
+
+def smooth_abp_chunks(chunks):
+    '''
+    Input: 1. chunks - iterator over the parts of raw ABP track (1D or 2D-arrays)
+
+    Streaming version of smooth_abp() for the clipped track: the filter state is carried between the chunks, 
+    the first points (filter delay) are dropped and the end is extended with the last point, 
+    so the parts together give the same points as smooth_abp() of the whole track
+
+    Output: iterator over the parts of the smoothed wave
+    '''
+    delay = classes.FILTER_BANK['ABP']['taps'] // 2
+    block_filter = None
+    # Number of dropped points (filter delay) and the last point of the track
+    dropped = 0
+    last = None
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.ndim == 2:
+            chunk = chunk[:, 0]
+        if chunk.size == 0:
+            continue
+        # Clearing the data. Anything below 25 and above 200
+        raw = np.clip(chunk, 25, 200)
+        if block_filter is None:
+            block_filter = abp_filter(raw[0])
+        last = raw[-1]
+        smooth = block_filter.process(raw)
+        drop = min(delay - dropped, smooth.size)
+        dropped += drop
+        if smooth.size > drop:
+            yield smooth[drop:]
+    if block_filter is not None:
+        yield block_filter.process(np.full(delay, last))[delay - dropped:]
+
+
+def abp_stream_to_files(chunks, out_dir, rate=500, period=None, downsample=10):
+    '''
+    Input: 1. chunks - iterator over the parts of raw ABP track (1D or 2D-arrays, for example abp_chunks())
+           2. out_dir - directory for the output files
+           3. rate - for the 'Arterial pressure wave' rate = 500 Hz
+           4. period - The number of points for one oscillation (None - local period, period_track() of every chunk)
+           5. downsample - only every 'downsample' point of the smoothed wave is saved
+
+    Streaming version of abp_from_raw_to_df(). The track is processed chunk by chunk, 
+    only the filter state (smooth_abp_chunks()) and the points after the last wave border are kept, 
+    so memory does not depend on the case length. The input arrays are not changed.
+    Results are appended to the files in out_dir:
+    'beats.bin' - BEAT_DTYPE rows, 'wave.bin' - float32 downsampled wave, 'manifest.json' - parameters.
+    With the same fixed period the beats are the same as in abp_from_raw_to_df().
+
+    Output: number of the saved waves
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    # Smoothed points from the current left border and index of the first of them
+    buffer = np.zeros(0)
+    offset = 0
+    n_smoothed = 0
+    n_beats = 0
+    min_left = None
+
+    def save_beats(buffer, min_left):
+        if period is None:
+            centers, periods = period_track(buffer, sampling_rate=rate)
+            borders = find_beat_borders(buffer, (centers, periods + 50), min_left)
+        else:
+            borders = find_beat_borders(buffer, period + 50, min_left)
+        values = beat_values(buffer, borders)
+        values['start'] += offset
+        values.tofile(beats_file)
+        return borders[-1], values.size
+
+    with open(os.path.join(out_dir, 'beats.bin'), 'wb') as beats_file, \
+         open(os.path.join(out_dir, 'wave.bin'), 'wb') as wave_file:
+        # Smoothed parts (same points as smooth_abp() for the whole track)
+        for smooth in smooth_abp_chunks(chunks):
+            smooth[(-n_smoothed) % downsample::downsample].astype(np.float32).tofile(wave_file)
+            n_smoothed += smooth.size
+            buffer = np.concatenate([buffer, smooth])
+
+            if period is None:
+                # Local period - at least one minute of the signal for the period track
+                if buffer.size < 60 * rate:
+                    continue
+            elif min_left is None and buffer.size <= period + 50:
+                continue
+            # Save finished waves and keep only the points from the last border
+            last_border, saved = save_beats(buffer, min_left)
+            n_beats += saved
+            buffer = buffer[last_border:]
+            offset += last_border
+            min_left = 0
+
+        # Rest of the track (less than one minute) with the local period
+        if period is None and buffer.size:
+            n_beats += save_beats(buffer, min_left)[1]
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump({'rate': rate, 'period': period, 'downsample': downsample, 
+                   'points': n_smoothed, 'beats': n_beats}, manifest_file, indent=1)
+    return n_beats
+
+
+def read_abp_files(out_dir):
+    '''
+    Input: 1. out_dir - directory with the results of abp_stream_to_files()
+
+    Output: 1. df_beats - pd.DataFrame (columns = 'Time', 'Dia BP', 'Sys BP', 'Mean AP', 'diff')
+            2. df_wave - pd.DataFrame (columns = 'Time', 'ABP') with the downsampled wave
+    '''
+    with open(os.path.join(out_dir, 'manifest.json'), 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    beats = np.fromfile(os.path.join(out_dir, 'beats.bin'), dtype=BEAT_DTYPE)
+    wave = np.fromfile(os.path.join(out_dir, 'wave.bin'), dtype=np.float32)
 
+    df_beats = pd.DataFrame({'Time': beats['start'] / manifest['rate'], 'Dia BP': beats['dia'], 
+                             'Sys BP': beats['sys'], 'Mean AP': beats['mean']})
+    # Duration of every wave
+    df_beats.loc[:, 'diff'] = df_beats.loc[:, 'Time'].diff(periods=1)
+    df_wave = pd.DataFrame({'Time': np.arange(wave.size) * manifest['downsample'] / manifest['rate'], 'ABP': wave})
+    return df_beats, df_wave
 
 
 if __name__ == "__main__":
-    print(__doc__)
-else:
-    print(f"Module '{__name__}' is imported successfully!\n")
\ No newline at end of file
+    print(__doc__)
\ No newline at end of file
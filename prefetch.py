@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import module
+
+
+# One low-priority worker for all sessions: prefetch never takes more than one thread of the server
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+
+
+class Prefetcher:
+    """
+    Speculative prefetch for one session. After every navigation (place of interest, range slider)
+    the prefetcher plans the next likely requests: the current range, the windows just before and after it
+    and the other places of interest. The plan is cut into small units (one tile or one cached result),
+    the worker runs them one by one with a short pause between them (the sessions come first)
+    and drops the rest of the plan when the user navigates elsewhere.
+    Results go to the caches of the case (Data_store.tiles / Data_store.results),
+    so the next interaction of any session usually finds them ready.
+    """
+    def __init__(self, df_class, places_dict=None, pause=0.05):
+        """
+        Input: 1. df_class - Data_store of the case
+               2. places_dict - places of interest that are prefetched (see module.place_range())
+               3. pause - pause before every unit, s
+        """
+        self.df_class = df_class
+        self.places_dict = places_dict or {}
+        self.pause = pause
+        # Every new plan cancels the previous one
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.done = 0
+        self.cancelled = 0
+        # Submitted plans of this session (close() waits for them)
+        self.futures = []
+        self.closed = False
+
+    def tile_units(self, start, stop):
+        """
+        Output: units for the tiles of the interval [start, stop) that are not in the cache yet
+        """
+        tile_size = self.df_class.tile_size
+        start, stop = max(start, 0), min(stop, self.df_class.signals.length())
+        if stop <= start:
+            return []
+        return [('tile', number) for number in range(start // tile_size, (stop - 1) // tile_size + 1)
+                if number not in self.df_class.tiles]
+
+    def range_units(self, start, stop):
+        """
+        Output: units for the result of data_transformation() for the interval (tiles first)
+        """
+        if ('data transformation', start, stop) in self.df_class.results:
+            return []
+        # Result (index + 7 float columns) bigger than the cache is not stored - only the tiles are prefetched
+        if (stop - start) * 8 * 8 > self.df_class.results.max_bytes:
+            return self.tile_units(start, stop)
+        return self.tile_units(start, stop) + [('range', start, stop)]
+
+    def plan(self, start, stop, place=None):
+        """
+        Input: 1. start, stop - current range (ECG time grid)
+               2. place - name of the current place of interest (None - free analysis)
+
+        Output: list of units, the most likely requests first
+        """
+        units = self.range_units(start, stop)
+        # Windows just after and before the current range (the next shift of the slider)
+        width = stop - start
+        units += self.tile_units(stop, stop + width) + self.tile_units(start - width, start)
+        # Other places of interest, nearest first
+        others = sorted((name for name in self.places_dict if name != place),
+                        key=lambda name: abs(module.place_range(self.places_dict, name)[0] - start))
+        for name in others:
+            units += self.range_units(*module.place_range(self.places_dict, name)[:2])
+        # Same tile can be in several windows
+        seen = set()
+        return [unit for unit in units if not (unit in seen or seen.add(unit))]
+
+    def update(self, start, stop, place=None):
+        """
+        Function cancel the previous plan and start the new one (see plan())
+        """
+        units = self.plan(start, stop, place)
+        with self.lock:
+            if self.closed:
+                return
+            self.generation += 1
+            self.futures = [future for future in self.futures if not future.done()]
+            self.futures.append(executor.submit(self.run, self.generation, units))
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+
+    def close(self, timeout=None):
+        """
+        Function cancel the plan, remove the plans of this session from the queue of the worker 
+        and wait for the running unit (the shared worker is not stopped, other sessions use it)
+
+        Output: True if the worker does not run the plans of this session any more
+        """
+        with self.lock:
+            self.closed = True
+            self.generation += 1
+            futures, self.futures = self.futures, []
+        running = [future for future in futures if not future.cancel()]
+        _, not_done = wait(running, timeout=timeout)
+        return not not_done
+
+    def run(self, generation, units):
+        """
+        Worker: run the units until the plan is replaced or cancelled
+        """
+        for number, unit in enumerate(units):
+            if generation != self.generation:
+                self.cancelled += len(units) - number
+                return
+            # Short pause: the server threads get the interpreter between the units
+            time.sleep(self.pause)
+            try:
+                if unit[0] == 'tile':
+                    self.df_class.transform_tile(unit[1])
+                else:
+                    module.data_transformation(self.df_class, unit[1], unit[2])
+            except Exception:
+                # Prefetch is only a guess: the session computes the data itself if it is needed
+                continue
+            self.done += 1
+
+
+if __name__ == "__main__":
+    print(__doc__)
@@ -0,0 +1,280 @@
+import numpy as np
+
+
+def strided_mean(np_array, window, step=1):
+    '''
+    Input: 1. np_array - 1D-array
+           2. window - the size of the window
+           3. step - the size of the "sliding" action
+
+    Reference implementation (former module.rolling_window): mean of every row of the strided view, O(n*w).
+    Kept for the parity checks of the kernels.
+
+    Output: 1D-array with smoothing data
+    '''
+    shape = np_array.shape[:-1] + ((np_array.shape[-1] - window + 1)//step, window)
+    strides = (np_array.strides[0] * step,) + (np_array.strides[-1],)
+    return np.mean(np.lib.stride_tricks.as_strided(np_array, shape=shape, strides=strides), axis=1)
+
+
+def window_bounds(size, window, mode='valid'):
+    '''
+    Input: 1. size - number of points
+           2. window - the size of the window
+           3. mode - 'valid' (only full windows, result[i] - window that starts at i, size - window + 1 values)
+                     or 'same' (centered window for every point, shorter windows at the edges, size values)
+
+    Output: 1. left, right - borders of every window, [left, right)
+    '''
+    if mode == 'valid':
+        left = np.arange(max(size - window + 1, 0))
+        return left, left + window
+    if mode == 'same':
+        center = np.arange(size)
+        return np.maximum(center - window // 2, 0), np.minimum(center - window // 2 + window, size)
+    raise ValueError(f"Unknown mode '{mode}' (use 'valid' or 'same')")
+
+
+def prepare(np_array):
+    '''
+    Input: 1. np_array - 1D-array
+
+    Output: 1. centered - values - reference (NaN values are 0)
+            2. nans - cumulative number of NaN values with 0 at the start (None if there are no NaN values)
+            3. reference - first valid value (it keeps the sums small)
+    '''
+    values = np.asarray(np_array, dtype=float)
+    nan = np.isnan(values)
+    reference = values[~nan][0] if not nan.all() else 0.0
+    centered = values - reference
+    if nan.any():
+        centered[nan] = 0.0
+        return centered, np.concatenate([[0], np.cumsum(nan)]), reference
+    return centered, None, reference
+
+
+def window_sums(values, window, mode='valid', chunk=65536):
+    '''
+    Input: 1. values - 1D-array (without NaN)
+           2. window - the size of the window
+           3. mode - 'valid' or 'same' (see window_bounds())
+           4. chunk - number of windows with the same cumulative sums
+
+    Function count the sum of every window from the cumulative sums (O(n) for any window). 
+    The sums start again for every chunk (with window - 1 points of overlap), so the rounding error 
+    depends on the chunk size, not on the length of the signal.
+
+    Output: 1D-array with the sums (same order as window_bounds())
+    '''
+    size = values.size
+    result = np.empty(max(size - window + 1, 0))
+    sums = np.zeros(min(chunk, result.size) + window)
+    for start in range(0, result.size, chunk):
+        part = values[start:start + chunk + window - 1]
+        np.cumsum(part, out=sums[1:part.size + 1])
+        result[start:start + part.size - window + 1] = sums[window:part.size + 1] - sums[:part.size - window + 1]
+    if mode == 'valid':
+        return result
+    # 'same': shorter windows at the edges from the prefix / suffix sums
+    left, right = window_bounds(size, window, mode)
+    head = np.cumsum(values[:window])
+    tail = np.cumsum(values[::-1][:window])
+    edges_left = left == 0
+    edges_right = (right == size) & ~edges_left
+    same = np.empty(size)
+    inside = ~(edges_left | edges_right)
+    same[inside] = result[left[inside]] if result.size else 0
+    same[edges_left] = head[right[edges_left] - 1] if size >= window else np.cumsum(values)[right[edges_left] - 1]
+    same[edges_right] = tail[size - left[edges_right] - 1]
+    return same
+
+
+def mark_nan(result, nans, left, right):
+    '''
+    Function set NaN for the windows that contain NaN values (nans - from prepare())
+    '''
+    if nans is not None:
+        result[nans[right] > nans[left]] = np.nan
+    return result
+
+
+def rolling_sum(np_array, window, mode='valid'):
+    '''
+    Output: 1D-array with the sum of every window (cumulative sums, O(n)); NaN if the window contain NaN
+    '''
+    centered, nans, reference = prepare(np_array)
+    left, right = window_bounds(centered.size, window, mode)
+    result = window_sums(centered, window, mode) + reference * (right - left)
+    return mark_nan(result, nans, left, right)
+
+
+def rolling_mean(np_array, window, mode='valid', step=1):
+    '''
+    Input: 1. np_array - 1D-array
+           2. window - the size of the window
+           3. mode - 'valid' or 'same' (see window_bounds())
+           4. step - only every 'step' window (as strided_mean())
+
+    Output: 1D-array with the mean of every window (cumulative sums, O(n)); NaN if the window contain NaN
+    '''
+    centered, nans, reference = prepare(np_array)
+    left, right = window_bounds(centered.size, window, mode)
+    result = window_sums(centered, window, mode)
+    result /= window if mode == 'valid' else right - left
+    result += reference
+    result = mark_nan(result, nans, left, right)
+    if step > 1:
+        result = result[::step][:result.size // step]
+    return result
+
+
+def rolling_std(np_array, window, mode='valid', ddof=0):
+    '''
+    Input: 1. np_array, window, mode - see rolling_mean()
+           2. ddof - delta degrees of freedom (0 - as np.std)
+
+    Output: 1D-array with the standard deviation of every window (cumulative sums of the values 
+    and the squared values, O(n))
+    '''
+    centered, nans, _ = prepare(np_array)
+    left, right = window_bounds(centered.size, window, mode)
+    count = right - left
+    s = window_sums(centered, window, mode)
+    s2 = window_sums(centered**2, window, mode)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.sqrt(np.maximum(s2 - s**2 / count, 0) / (count - ddof))
+    # One value in the window - no variance (no rounding noise)
+    result[count == 1] = 0.0 if ddof == 0 else np.nan
+    return mark_nan(result, nans, left, right)
+
+
+def rolling_extreme(np_array, window, mode='valid', kind='max'):
+    '''
+    Input: 1. np_array, window, mode - see rolling_mean()
+           2. kind - 'max' or 'min'
+
+    Van Herk / Gil-Werman algorithm: the signal is cut into blocks of 'window' points, every window
+    covers the end of one block and the start of the next one, so its extreme value =
+    extreme(suffix extreme of the first block, prefix extreme of the next block). O(n) for any window,
+    same result as the monotonic deque, but vectorized.
+
+    Output: 1D-array with the max / min of every window; NaN if the window contain NaN
+    '''
+    values = np.asarray(np_array, dtype=float)
+    size = values.size
+    function = np.maximum if kind == 'max' else np.minimum
+    neutral = -np.inf if kind == 'max' else np.inf
+    nan = np.isnan(values)
+    # 'same' - windows at the edges are shorter: pad with the neutral value
+    pad_left = window // 2 if mode == 'same' else 0
+    pad_right = window - 1 - window // 2 if mode == 'same' else 0
+    blocks = -(-(size + pad_left + pad_right) // window)
+    padded = np.full(blocks * window, neutral)
+    padded[pad_left:pad_left + size] = np.where(nan, neutral, values)
+    padded = padded.reshape(blocks, window)
+    prefix = function.accumulate(padded, axis=1).ravel()
+    suffix = function.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    count = size + pad_left + pad_right - window + 1
+    if count <= 0:
+        return np.zeros(0)
+    start = np.arange(count)
+    result = function(suffix[start], prefix[start + window - 1])
+    # NaN in the window -> NaN (as the mean)
+    if nan.any():
+        left, right = window_bounds(size, window, mode)
+        mark_nan(result, np.concatenate([[0], np.cumsum(nan)]), left, right)
+    return result
+
+
+def rolling_max(np_array, window, mode='valid'):
+    '''
+    Output: 1D-array with the max of every window (O(n), see rolling_extreme())
+    '''
+    return rolling_extreme(np_array, window, mode, 'max')
+
+
+def rolling_min(np_array, window, mode='valid'):
+    '''
+    Output: 1D-array with the min of every window (O(n), see rolling_extreme())
+    '''
+    return rolling_extreme(np_array, window, mode, 'min')
+
+
+# Longer windows of the median - skip list (pandas), shorter - rank filter (scipy.ndimage)
+RANK_FILTER_WINDOW = 32
+
+
+def rolling_median(np_array, window, mode='valid'):
+    '''
+    Input: 1. np_array, window, mode - see rolling_mean()
+
+    Exact median of every window: middle rank for the odd windows, mean of the two middle ranks 
+    for the even windows (as np.median). Short windows - compiled rank filter (scipy.ndimage), 
+    long windows - skip list of pandas rolling median, O(n*log(w)) with any scipy version 
+    (rank filter of scipy < 1.14 is O(n*w)). Exact median has no O(n) kernel, 
+    the O(n) approximation was dropped (error up to several mmHg on ABP).
+    Shorter windows at the edges ('same') - one by one.
+
+    Output: 1D-array with the median of every window; NaN if the window contain NaN
+    '''
+    values = np.asarray(np_array, dtype=float)
+    left, right = window_bounds(values.size, window, mode)
+    if left.size == 0:
+        return np.zeros(0)
+    nan = np.isnan(values)
+    filled = np.where(nan, 0.0, values)
+    result = np.empty(left.size)
+    full = (right - left) == window
+    if window <= RANK_FILTER_WINDOW:
+        from scipy.ndimage import rank_filter
+        # Rank filter is centered: point i + window // 2 has the window [i, i + window)
+        ranked = rank_filter(filled, (window - 1) // 2, size=window, mode='nearest')
+        if window % 2 == 0:
+            ranked = (ranked + rank_filter(filled, window // 2, size=window, mode='nearest')) / 2
+        result[full] = ranked[left[full] + window // 2]
+    elif full.any():
+        import pandas as pd
+        # Point i + window - 1 has the window [i, i + window)
+        ranked = pd.Series(filled).rolling(window).median().to_numpy()
+        result[full] = ranked[left[full] + window - 1]
+    for number in np.flatnonzero(~full):
+        result[number] = np.median(filled[left[number]:right[number]])
+    # NaN in the window -> NaN (as the mean)
+    if nan.any():
+        mark_nan(result, np.concatenate([[0], np.cumsum(nan)]), left, right)
+    return result
+
+
+KERNELS = {'mean': rolling_mean, 'sum': rolling_sum, 'std': rolling_std, 'min': rolling_min,
+           'max': rolling_max, 'median': rolling_median}
+
+
+class Rolling_state:
+    """
+    Rolling statistics for a stream (chunk by chunk). The last window - 1 points are carried to the next chunk,
+    so every chunk costs O(chunk + window) and the concatenated result is the same as the 'valid' result
+    for the whole signal.
+    """
+    def __init__(self, window, statistics=('mean',)):
+        self.window = window
+        self.statistics = statistics
+        self.tail = np.zeros(0)
+
+    def process(self, chunk):
+        """
+        Input: 1. chunk - 1D-array (next part of the signal)
+
+        Output: dictionary {statistic: 1D-array} with the values of the windows that end in this chunk
+        """
+        values = np.concatenate([self.tail, np.asarray(chunk, dtype=float)])
+        self.tail = values[max(values.size - self.window + 1, 0):]
+        if values.size < self.window:
+            return {name: np.zeros(0) for name in self.statistics}
+        return {name: KERNELS[name](values, self.window, 'valid') for name in self.statistics}
+
+    def reset(self):
+        self.tail = np.zeros(0)
+
+
+if __name__ == "__main__":
+    print(__doc__)
@@ -0,0 +1,216 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import panel as pn
+from bokeh.models import ColumnDataSource
+
+import module
+
+
+# Workers for the preprocessing of the next blocks (shared between all sessions)
+executor = ThreadPoolExecutor(max_workers=2)
+
+# Columns that have a value for every sample (sent in every update)
+# and sparse columns (sent to the separate source only when there are new values)
+DENSE_COLUMNS = ('Time', 'ECG', 'ECG_f', 'co2', 'Hr', 'hr')
+EVENT_COLUMNS = ('Time', 'error peaks')
+
+
+def column_buffers(df):
+    """
+    Input: 1. df - df from module.give_values_for_streaming()
+
+    Output: 1. dense - dictionary {column: contiguous typed array} (Time - float64, values - float32)
+            2. events - same dictionary only for the rows with the error peaks + 'position' (row number)
+    """
+    dense = {name: np.ascontiguousarray(df.loc[:, name].to_numpy(dtype=np.float64 if name == 'Time' else np.float32))
+             for name in DENSE_COLUMNS}
+    error_peaks = df.loc[:, 'error peaks'].to_numpy(dtype=np.float32)
+    position = np.flatnonzero(~np.isnan(error_peaks))
+    events = {'Time': dense['Time'][position], 'error peaks': error_peaks[position], 'position': position}
+    return dense, events
+
+
+def streaming_sources(df):
+    """
+    Input: 1. df - df from module.give_values_for_streaming() with the first points of the graph
+
+    Output: 1. source - ColumnDataSource with the dense columns
+            2. events - ColumnDataSource with the error peaks
+    """
+    dense, events = column_buffers(df)
+    events.pop('position')
+    return ColumnDataSource(dense), ColumnDataSource(events)
+
+
+class Stream_engine:
+    """
+    Non-blocking streaming of the case to the ColumnDataSource.
+    A periodic callback sends all samples that are due for the target rate (samples per second)
+    as one batched update of typed arrays. Sparse columns (error peaks) go to their own source
+    and only when there are new values.
+    The callback period starts at the browser frame rate and grows when the updates are late
+    (slow server / many viewers), so more samples are coalesced in one message.
+    Filtering and peak detection run in the worker threads only for a few blocks ahead of the playhead
+    (bounded queue), so the server keeps serving other sessions while the stream plays.
+    """
+    def __init__(self, df_class, source, start, stop, rate=500, rollover=2000, tick=None, block=5000, queue_size=3,
+                 events=None, frame_rate=30, max_tick=500):
+        self.df_class = df_class
+        self.source = source
+        self.events = events
+        self.stop_index = stop
+        self.rate = rate
+        self.rollover = rollover
+        # Period of the callback, ms (by default - one update per browser frame)
+        self.min_tick = tick or int(1000 / frame_rate)
+        self.max_tick = max_tick
+        self.tick = self.min_tick
+        self.block = block
+        self.queue_size = queue_size
+        # Next sample for the source and next block for the producer
+        self.playhead = start
+        self.next_block = start
+        self.queue = deque()
+        self.callback = None
+        # Time and playhead position when the stream was (re)started
+        self.start_time = None
+        self.start_playhead = start
+        # Time of the last tick and time that the last update took, s
+        self.last_send = None
+        self.send_time = 0.0
+
+    @property
+    def playing(self):
+        return self.callback is not None
+
+    @property
+    def finished(self):
+        return self.playhead >= self.stop_index
+
+    def produce(self, start, stop):
+        """
+        Input: 1. start, stop - indexes of the block in the ECG time grid, [start, stop)
+
+        Output: typed arrays of the block (see column_buffers())
+        """
+        # Extra points around the block, so the interpolated Hr is continuous between blocks
+        margin = 1000
+        df = module.give_values_for_streaming(self.df_class, max(start - margin, 0), stop - 1 + margin)
+        return column_buffers(df.loc[start:stop - 1])
+
+    def fill_queue(self):
+        """
+        Keep 'queue_size' blocks in preprocessing / ready
+        """
+        while len(self.queue) < self.queue_size and self.next_block < self.stop_index:
+            block_stop = min(self.next_block + self.block, self.stop_index)
+            self.queue.append((self.next_block, block_stop, executor.submit(self.produce, self.next_block, block_stop)))
+            self.next_block = block_stop
+
+    def start(self):
+        """
+        Start (or continue after pause) the stream
+        """
+        if self.playing or self.finished:
+            return
+        self.fill_queue()
+        self.start_time = time.monotonic()
+        self.start_playhead = self.playhead
+        self.last_send = None
+        self.callback = pn.state.add_periodic_callback(self.send, period=self.tick)
+
+    def pause(self):
+        """
+        Stop the callback, but keep the playhead and prepared blocks
+        """
+        if self.callback is not None:
+            self.callback.stop()
+            self.callback = None
+
+    def stop(self):
+        """
+        Stop the stream and cancel the preprocessing
+        """
+        self.pause()
+        for _, _, future in self.queue:
+            future.cancel()
+        self.queue.clear()
+        self.playhead = self.stop_index
+
+    def collect(self, due):
+        """
+        Input: 1. due - index of the last sample that should be sent (not included)
+
+        Output: 1. dense - list of dictionaries with the array slices (one for every block)
+                2. events - list of dictionaries with the error peaks of these slices
+        """
+        dense, events = [], []
+        while self.playhead < due and self.queue and self.queue[0][2].done():
+            block_start, block_stop, future = self.queue[0]
+            block_dense, block_events = future.result()
+            last = min(due, block_stop)
+            i0, i1 = self.playhead - block_start, last - block_start
+            dense.append({name: values[i0:i1] for name, values in block_dense.items()})
+            inside = (block_events['position'] >= i0) & (block_events['position'] < i1)
+            if inside.any():
+                events.append({name: block_events[name][inside] for name in EVENT_COLUMNS})
+            self.playhead = last
+            # Block is finished - start the preprocessing of the next one
+            if self.playhead >= block_stop:
+                self.queue.popleft()
+                self.fill_queue()
+        return dense, events
+
+    def adapt(self, now):
+        """
+        Input: 1. now - time of the current tick
+
+        Function change the callback period. If the ticks come late or the update takes a big part
+        of the period (server / websocket does not keep up), bigger batches are sent less often.
+        If everything is fast, the period goes back to the frame rate.
+        """
+        if self.last_send is None or self.callback is None:
+            return
+        period = self.tick / 1000
+        late = (now - self.last_send) - period
+        if late > period / 2 or self.send_time > period / 2:
+            tick = min(int(self.tick * 1.5), self.max_tick)
+        elif late < period / 10 and self.send_time < period / 4:
+            tick = max(int(self.tick / 1.2), self.min_tick)
+        else:
+            return
+        if tick != self.tick:
+            self.tick = tick
+            self.callback.period = tick
+
+    def send(self):
+        """
+        Periodic callback: stream all samples that are due at the target rate (one update per source)
+        """
+        now = time.monotonic()
+        self.adapt(now)
+        self.last_send = now
+        due = self.start_playhead + int((now - self.start_time) * self.rate)
+        due = min(due, self.stop_index)
+        dense, events = self.collect(due)
+        if dense:
+            self.source.stream({name: np.concatenate([part[name] for part in dense]) for name in DENSE_COLUMNS},
+                               rollover=self.rollover)
+        if events and self.events is not None:
+            # Not more error peaks than beats in the visible window (max 5 beats per second)
+            self.events.stream({name: np.concatenate([part[name] for part in events]) for name in EVENT_COLUMNS},
+                               rollover=max(self.rollover // 100, 10))
+        self.send_time = time.monotonic() - now
+        # Producer is late: continue from the current position when the data is ready
+        if self.playhead < due and self.queue and not self.queue[0][2].done():
+            self.start_time = time.monotonic()
+            self.start_playhead = self.playhead
+        if self.finished:
+            self.pause()
+
+
+if __name__ == "__main__":
+    print(__doc__)
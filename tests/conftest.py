@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules of the repository are flat (module.py, classes.py, ...), tests import them from the root directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import benchmark
+import classes
+import module
+
+
+@pytest.mark.parametrize('chunk_size', (3000, 7, 49, 50, 51, 100000))
+def test_smoothed_chunks_match_whole_track(chunk_size):
+    abp = benchmark.synthetic_abp(20)
+    smooth = module.smooth_abp(np.clip(abp[:, 0], 25, 200))
+    chunked = np.concatenate(list(module.smooth_abp_chunks(module.abp_chunks(abp, chunk_size))))
+    assert chunked.size == smooth.size == abp.shape[0]
+    np.testing.assert_allclose(chunked, smooth, rtol=0, atol=1e-9)
+
+
+def test_smooth_abp_uses_the_filter_bank():
+    # Low-pass filter: constant wave stays constant (no ramp at the start or the end),
+    # 50 Hz noise is removed, the wave is not shifted (delay is compensated)
+    assert classes.FILTER_BANK['ABP']['kind'] == 'lowpass'
+    np.testing.assert_allclose(module.smooth_abp(np.full(1000, 80.0)), 80.0)
+    time_s = np.arange(5000) / 500
+    wave = 80 + 20 * np.sin(2 * np.pi * 1.5 * time_s)
+    smooth = module.smooth_abp(wave + 5 * np.sin(2 * np.pi * 50 * time_s))
+    assert np.max(np.abs(smooth - wave)[200:-200]) < 0.5
+    assert module.smooth_abp(np.zeros(0)).size == 0
+
+
+def test_stream_matches_whole_track(tmp_path):
+    abp = benchmark.synthetic_abp(40)
+    smooth, _, expected = module.abp_beats(abp, period=300)
+    saved = module.abp_stream_to_files(module.abp_chunks(abp, 3000), str(tmp_path), period=300)
+    df_beats, df_wave = module.read_abp_files(str(tmp_path))
+    assert saved == expected.size
+    np.testing.assert_array_equal(df_beats.loc[:, 'Time'].to_numpy(), expected['start'] / 500)
+    np.testing.assert_array_equal(df_beats.loc[:, 'Sys BP'].to_numpy(), expected['sys'])
+    assert len(df_wave) == -(-smooth.size // 10)
+    np.testing.assert_allclose(df_wave.loc[:, 'ABP'].to_numpy(), smooth[::10], rtol=1e-6)
@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+import batch
+import benchmark
+import module
+
+
+def synthetic_tracks(case, channels, vital_path=None, cache_dir=None):
+    seconds = 300
+    ecg = benchmark.synthetic_ecg(seconds)
+    # Saturation artifact in the middle of the case
+    ecg[60000:61500] = 3.0
+    tracks = {'ECG': ecg.reshape(-1, 1), 'co2': benchmark.synthetic_co2(seconds).reshape(-1, 1),
+              'Hr': (90 + 10 * np.sin(np.arange(seconds // 2) / 20)).reshape(-1, 1), 'ABP': benchmark.synthetic_abp(seconds)}
+    return {channel: tracks[channel] for channel in channels}
+
+
+def test_case_features_keeps_masked_hr(monkeypatch):
+    monkeypatch.setattr(module, 'load_tracks', synthetic_tracks)
+    columns, info = batch.case_features(1)
+    peaks, hr = columns['ecg_peaks'], columns['ecg_hr']
+    assert peaks.size == hr.size == info['ecg peaks']
+    # No peaks in the artifact, Hr of the first peak after it is NaN (RR over the masked part)
+    assert not ((peaks >= 60000) & (peaks < 61500)).any()
+    after = np.searchsorted(peaks, 61500)
+    assert np.isnan(hr[after])
+    assert info['masked seconds'] >= 3
+
+
+def crashing_case_features(case, vital_path=None):
+    if case == 2:
+        os._exit(1)
+    return {'ecg_peaks': np.arange(3, dtype=np.int32)}, {'seconds': 1.0}
+
+
+def test_run_survives_crashed_worker(monkeypatch, tmp_path):
+    # Worker processes are forked, so they use the replaced function
+    if multiprocessing.get_start_method() != 'fork':
+        pytest.skip('needs fork start method')
+    monkeypatch.setattr(batch, 'case_features', crashing_case_features)
+    cases = batch.run(batch.parse_inputs(['1', '2', '3']), str(tmp_path), workers=2)
+    assert cases['1']['status'] == 'done' and cases['3']['status'] == 'done'
+    assert cases['2']['status'] == 'failed'
+    assert batch.read_case(str(tmp_path), '1')['ecg_peaks'].size == 3
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import classes
+
+
+@pytest.fixture(params=['int16', 'float32'])
+def array(request):
+    values = np.linspace(-1.0, 2.0, 101)
+    values[[3, 50, 51]] = np.nan
+    return values, classes.Compact_array(values, request.param)
+
+
+def test_scalar_index(array):
+    values, compact = array
+    assert compact[10] == pytest.approx(values[10], abs=1e-4)
+    assert np.isnan(compact[3])
+    assert np.ndim(compact[-1]) == 0
+
+
+def test_slice(array):
+    values, compact = array
+    np.testing.assert_allclose(compact[40:60], values[40:60], atol=1e-4)
+    assert np.isnan(compact[40:60]).sum() == 2
+
+
+def test_fancy_index(array):
+    values, compact = array
+    index = np.array([0, 3, 51, 100])
+    np.testing.assert_allclose(compact[index], values[index], atol=1e-4)
+    np.testing.assert_array_equal(compact.valid(), np.flatnonzero(~np.isnan(values)))
+
+
+def test_from_codes_shares_the_codes():
+    compact = classes.Compact_array(np.arange(10.0), 'int16')
+    copy = classes.Compact_array.from_codes(compact.codes, compact.scale, compact.offset)
+    assert copy.codes is compact.codes
+    np.testing.assert_allclose(np.asarray(copy), np.arange(10.0), atol=1e-3)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+import benchmark
+import classes
+import module
+
+
+def random_events(size, seed=0):
+    random = np.random.RandomState(seed)
+    start = random.randint(0, 100000, size)
+    stop = start + random.randint(1, 20000, size)
+    kind = random.choice(['tachycardia', 'co2 break', 'hypotension'], size)
+    return classes.Event_index(start, stop, kind, random.rand(size))
+
+
+def brute_range(events, start, stop, kind=None):
+    keep = (events.start < stop) & (events.stop > start)
+    if kind is not None:
+        keep &= events.kind == kind
+    return np.flatnonzero(keep)
+
+
+def brute_nearest(events, index, kind=None):
+    number = np.arange(len(events)) if kind is None else np.flatnonzero(events.kind == kind)
+    if not number.size:
+        return None
+    inside = number[(events.start[number] <= index) & (events.stop[number] > index)]
+    if inside.size:
+        return events.event(inside[0])
+    distance = np.where(events.start[number] > index, events.start[number] - index, index - events.stop[number])
+    return events.event(number[np.lexsort((number, distance))[0]])
+
+
+@pytest.mark.parametrize('size', [0, 1, 7, 300])
+def test_range(size):
+    events = random_events(size)
+    random = np.random.RandomState(1)
+    for start in random.randint(-1000, 130000, 50):
+        stop = start + random.randint(0, 30000)
+        for kind in (None, 'co2 break'):
+            frame = events.range(start, stop, kind)
+            expected = events.frame(brute_range(events, start, stop, kind))
+            np.testing.assert_array_equal(frame.loc[:, 'start'].to_numpy(), expected.loc[:, 'start'].to_numpy())
+            np.testing.assert_array_equal(frame.loc[:, 'stop'].to_numpy(), expected.loc[:, 'stop'].to_numpy())
+            np.testing.assert_array_equal(frame.loc[:, 'kind'].to_numpy(), expected.loc[:, 'kind'].to_numpy())
+
+
+@pytest.mark.parametrize('size', [0, 1, 7, 300])
+def test_nearest(size):
+    events = random_events(size, seed=2)
+    for index in np.r_[np.random.RandomState(3).randint(-1000, 130000, 200), events.start[:20], events.stop[:20]]:
+        for kind in (None, 'tachycardia', 'unknown'):
+            assert events.nearest(index, kind) == brute_nearest(events, index, kind)
+
+
+def test_nested_events():
+    # Long event contains the short ones: running max of the stops finds it
+    events = classes.Event_index([0, 100, 300], [1000, 200, 400], ['a', 'b', 'c'], [1, 2, 3])
+    assert list(events.range(500, 600).loc[:, 'kind']) == ['a']
+    assert events.nearest(150)['kind'] == 'a'
+    assert events.nearest(1100)['kind'] == 'a'
+    assert events.nearest(150, kind='c')['kind'] == 'c'
+
+
+@pytest.fixture
+def store():
+    return benchmark.synthetic_store(120)
+
+
+def test_warm_up_abp_events(store):
+    abp = benchmark.synthetic_abp(120)
+    # 30 s of low pressure (MAP ~ 45 mmHg)
+    abp[30000:45000] -= 40
+    module.warm_up_case(store, hrv=True, abp=lambda: abp)
+    hypotension = store.events.select('hypotension')
+    assert len(hypotension) == 1
+    assert abs(hypotension.start[0] - 30000) < 1000 and abs(hypotension.stop[0] - 45000) < 1000
+
+
+def test_warm_up_without_abp(store):
+    def missing():
+        raise KeyError('SNUADC/ART')
+
+    module.warm_up_case(store, hrv=True, abp=missing)
+    assert store.events is not None
+    assert len(store.events.select('hypotension')) == 0
@@ -0,0 +1,26 @@
+import numpy as np
+
+import classes
+
+
+def test_block_fir_filter_matches_fir_filter():
+    h = classes.filter_bank('ECG')
+    ecg = np.random.RandomState(0).randn(3000)
+    reference = np.array([zi for zi in classes.fir_filter(ecg, h)])
+    assert np.max(np.abs(classes.Block_fir_filter(h).process(ecg) - reference)) < 1e-12
+
+
+def test_block_fir_filter_chunks_match_whole_signal():
+    h = classes.filter_bank('ECG')
+    ecg = np.random.RandomState(1).randn(5000)
+    block_filter = classes.Block_fir_filter(h)
+    chunked = np.concatenate([block_filter.process(chunk) for chunk in np.array_split(ecg, 13)])
+    assert np.max(np.abs(chunked - classes.Block_fir_filter(h).process(ecg))) < 1e-12
+
+
+def test_fourier_transform_engines_match():
+    data_store = classes.Data_store(None)
+    ecg = np.random.RandomState(2).randn(2000)
+    block = data_store.fourier_transform(ecg, engine='block')
+    stream = data_store.fourier_transform(ecg, engine='stream')
+    assert np.max(np.abs(block - stream)) < 1e-12
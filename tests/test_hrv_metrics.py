@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import classes
+
+
+RATE = 500
+
+
+@pytest.fixture(scope='module')
+def peaks():
+    # RR 0.5...1.2 s with a gap (3 s, skipped) and a double detection (0.1 s, skipped)
+    random = np.random.RandomState(0)
+    rr = random.uniform(0.5, 1.2, 600)
+    rr[100] = 3.0
+    rr[250] = 0.1
+    return np.round(np.cumsum(np.r_[1.0, rr]) * RATE).astype(np.int64)
+
+
+def brute_metrics(peaks, t0, t1, min_rr=0.25, max_rr=2.0):
+    rr = np.diff(peaks) / RATE
+    time = peaks[1:] / RATE
+    valid = (rr >= min_rr) & (rr <= max_rr)
+    number = np.flatnonzero((time >= t0) & (time < t1))
+    values = rr[number[valid[number]]]
+    diffs = np.array([rr[j] - rr[j - 1] for j in number if j > 0 and valid[j] and valid[j - 1]])
+    nan = float('nan')
+    mean = values.mean() if values.size else nan
+    sdnn = values.std(ddof=1) if values.size > 1 else nan
+    return {'beats': values.size, 'mean hr': 60 / mean, 'sdnn': 1000 * sdnn,
+            'rmssd': 1000 * np.sqrt(np.mean(diffs**2)) if diffs.size else nan,
+            'pnn50': np.mean(np.abs(diffs) > 0.05) if diffs.size else nan,
+            'cv': sdnn / mean, 'tachycardia': np.mean(values < 0.6) if values.size else nan}
+
+
+def assert_metrics(result, expected):
+    assert set(result) == set(expected)
+    for name in expected:
+        np.testing.assert_allclose(result[name], expected[name], rtol=1e-9, atol=1e-9, err_msg=name)
+
+
+def test_summary(peaks):
+    hrv = classes.Hrv_metrics(peaks, rate=RATE)
+    one = peaks[10]
+    ranges = [(0, peaks[-1] + 1), (peaks[50], peaks[200]), (peaks[95], peaks[110]), (peaks[245], peaks[260]),
+              # Empty range, range without beats, range with one beat
+              (1000, 1000), (peaks[20] + 1, peaks[21]), (one, one + 1)]
+    for start, stop in ranges:
+        assert_metrics(hrv.summary(start, stop), brute_metrics(peaks, start / RATE, stop / RATE))
+    assert hrv.summary(one, one + 1)['beats'] == 1
+    assert np.isnan(hrv.summary(one, one + 1)['sdnn'])
+    assert hrv.summary(1000, 1000)['beats'] == 0
+
+
+@pytest.mark.parametrize('window, step', [(10, 5), (30, 5), (60, 10), (2, 1)])
+def test_rolling(peaks, window, step):
+    hrv = classes.Hrv_metrics(peaks, rate=RATE)
+    df = hrv.rolling(window=window, step=step)
+    assert df.loc[:, 'Time'].iloc[-1] >= peaks[-1] / RATE
+    for row in df.to_dict('records'):
+        end = row.pop('Time')
+        assert_metrics(row, brute_metrics(peaks, end - window, end))
+    # Short windows: some without beats and some with one beat
+    if window == 2:
+        assert (df.loc[:, 'beats'] == 0).any() and (df.loc[:, 'beats'] == 1).any()
+    assert hrv.rolling(window=window, step=step) is df
+
+
+@pytest.mark.parametrize('peaks', [[], [1000], [1000, 1400]])
+def test_few_peaks(peaks):
+    hrv = classes.Hrv_metrics(peaks, rate=RATE)
+    summary = hrv.summary(0, 10000)
+    assert summary['beats'] == max(len(peaks) - 1, 0)
+    # Case shorter than one window - no windows
+    df = hrv.rolling(window=10, step=5)
+    assert len(df) == 0 and df.columns[0] == 'Time'
@@ -0,0 +1,47 @@
+import numpy as np
+
+import benchmark
+import classes
+import module
+
+
+def run_detector(ecg_f, chunk_size=500):
+    detector = classes.Online_peak_detector(rate=500)
+    peaks = [detector.process(ecg_f[i:i + chunk_size])[0] for i in range(0, ecg_f.size, chunk_size)]
+    peaks.append(detector.flush()[0])
+    return detector, np.concatenate(peaks)
+
+
+def test_online_detector_matches_offline_peaks():
+    result = module.validate_online_detector(benchmark.synthetic_store(120))
+    assert result['reference'] > 150
+    assert result['sensitivity'] >= 0.98
+    assert result['ppv'] >= 0.98
+
+
+def state_size(detector):
+    # Points and items held by the detector between the chunks
+    size = 0
+    for value in vars(detector).values():
+        if isinstance(value, np.ndarray):
+            size += value.size
+        elif isinstance(value, (list, tuple)) or hasattr(value, 'maxlen'):
+            size += len(value)
+    return size
+
+
+def test_online_detector_state_does_not_grow():
+    # Every chunk costs O(chunk + state): the state after 4 min is the same as after 1 min
+    noise = 0.01 * np.random.RandomState(0).randn(240 * 500)
+    short, _ = run_detector(noise[:60 * 500])
+    long, _ = run_detector(noise)
+    assert short.learned and long.learned
+    assert state_size(long) == state_size(short)
+    assert long.learning_mwi == [] and long.learning_candidates == []
+    assert len(long.rr) <= long.rr.maxlen
+    assert long.missed is None or len(long.missed) == 2
+
+
+def test_online_detector_on_flat_signal():
+    detector, peaks = run_detector(np.zeros(60 * 500))
+    assert peaks.size == 0
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import benchmark
+import module
+
+
+RATE = 500
+
+
+def abp_wave(hr):
+    # ABP-like wave (as benchmark.synthetic_abp()) with the given Hr for every point
+    phase = np.cumsum(hr / 60 / RATE) % 1.0
+    abp = 70 + 45 * np.exp(-((phase - 0.2) / 0.1) ** 2) + 10 * np.exp(-((phase - 0.45) / 0.05) ** 2)
+    return abp + np.random.RandomState(0).randn(abp.size)
+
+
+@pytest.mark.parametrize('bpm', [45, 72, 150])
+def test_constant_rate(bpm):
+    abp = abp_wave(np.full(120 * RATE, float(bpm)))
+    centers, periods = module.period_track(abp, sampling_rate=RATE)
+    assert centers.size == periods.size > 1
+    np.testing.assert_allclose(periods, 60 * RATE / bpm, rtol=0.02)
+    assert abs(module.find_period(abp, sampling_rate=RATE) - 60 * RATE / bpm) <= 0.02 * 60 * RATE / bpm
+
+
+def test_drifting_rate():
+    # Hr 60...120 bpm (30 min sine), as benchmark.synthetic_abp()
+    abp = benchmark.synthetic_abp(1800)[:, 0]
+    centers, periods = module.period_track(abp, sampling_rate=RATE)
+    hr = 90 + 30 * np.sin(2 * np.pi * centers / RATE / 1800)
+    np.testing.assert_allclose(periods, 60 * RATE / hr, rtol=0.03)
+    # Track follows the drift (one global period would be 20% off at the ends)
+    assert periods.max() / periods.min() > 1.8
+
+
+@pytest.mark.parametrize('size', [3000, 1000, 200])
+def test_short_input_stays_in_band(size):
+    band = (0.5, 3.0)
+    for abp in (abp_wave(np.full(size, 72.0)), np.random.RandomState(1).randn(size)):
+        centers, periods = module.period_track(abp, sampling_rate=RATE, band=band)
+        assert centers.size == periods.size == 1
+        assert (periods >= RATE / band[1]).all() and (periods <= RATE / band[0]).all()
+
+
+def test_short_input_period():
+    abp = abp_wave(np.full(3000, 72.0))
+    assert abs(module.find_period(abp, sampling_rate=RATE) - 60 * RATE / 72) <= 0.05 * 60 * RATE / 72
+
+
+@pytest.mark.parametrize('size', [0, 1])
+def test_empty_input(size):
+    with pytest.raises(ValueError):
+        module.period_track(np.zeros(size), sampling_rate=RATE)
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+import benchmark
+import prefetch
+
+
+@pytest.fixture
+def store():
+    return benchmark.synthetic_store(120)
+
+
+@pytest.fixture
+def blocked_worker():
+    # Job of another session keeps the shared worker busy until the test releases it
+    release = threading.Event()
+    started = threading.Event()
+
+    def job():
+        started.set()
+        release.wait(10)
+
+    future = prefetch.executor.submit(job)
+    started.wait(10)
+    yield release
+    release.set()
+    future.result(10)
+
+
+def test_stale_generation_is_dropped(store, blocked_worker):
+    prefetcher = prefetch.Prefetcher(store, pause=0)
+    stale = prefetcher.plan(0, 10000)
+    current = prefetcher.plan(40000, 50000)
+    assert stale and current
+    prefetcher.update(0, 10000)
+    prefetcher.update(40000, 50000)
+    blocked_worker.set()
+    prefetcher.futures[-1].result(30)
+    assert prefetcher.cancelled == len(stale)
+    assert prefetcher.done == len(current)
+    assert 0 not in store.tiles and 2 in store.tiles
+    assert ('data transformation', 40000, 50000) in store.results
+    assert prefetcher.close(timeout=30)
+
+
+def test_close_waits_for_the_running_unit(store):
+    prefetcher = prefetch.Prefetcher(store, pause=0.05)
+    prefetcher.update(0, 40000)
+    deadline = time.time() + 30
+    while prefetcher.done == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert prefetcher.close(timeout=30)
+    done = prefetcher.done
+    # Nothing runs after close(), new plans are ignored
+    prefetcher.update(60000, 80000)
+    time.sleep(0.2)
+    assert prefetcher.done == done
+    assert prefetcher.futures == []
+    assert prefetch.executor.submit(lambda: 'free').result(10) == 'free'
+
+
+def test_close_removes_queued_plans(store, blocked_worker):
+    prefetcher = prefetch.Prefetcher(store, pause=0)
+    prefetcher.update(0, 10000)
+    # Queued plan is removed at once, the worker of the other session is not waited for
+    assert prefetcher.close(timeout=0)
+    blocked_worker.set()
+    prefetch.executor.submit(lambda: None).result(10)
+    assert prefetcher.done == 0 and prefetcher.cancelled == 0
+    assert len(store.tiles.tiles) == 0
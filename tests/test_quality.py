@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+import benchmark
+import classes
+import module
+
+
+RATE = 500
+LIMITS = module.QUALITY['ECG']
+
+
+def kinds(quality):
+    frame = quality.frame()
+    return {kind: list(zip(part.loc[:, 'start'], part.loc[:, 'stop'])) for kind, part in frame.groupby('kind')}
+
+
+def clean_ecg(seconds=20):
+    # Noise only: no flat parts, no values at the limits
+    return 0.1 * np.random.RandomState(0).randn(seconds * RATE)
+
+
+def test_clean_signal_has_no_runs():
+    quality = module.signal_quality(clean_ecg(), RATE, **LIMITS)
+    assert len(quality) == 0
+    assert quality.good_spans() == [(0, 20 * RATE)]
+
+
+def test_flatline_threshold():
+    values = clean_ecg()
+    flat = int(LIMITS['flat'] * RATE)
+    values[1000:1000 + flat] = 0.3
+    values[5000:5000 + flat - 1] = 0.3
+    assert kinds(module.signal_quality(values, RATE, **LIMITS)) == {'flatline': [(1000, 1000 + flat)]}
+
+
+def test_saturation_threshold():
+    values = clean_ecg()
+    values[2000:2100] = LIMITS['high']
+    values[4000:4010] = LIMITS['low'] - 1
+    values[6000:6100] = LIMITS['high'] - 0.01
+    runs = kinds(module.signal_quality(values, RATE, **dict(LIMITS, clip=None, flat=None)))
+    assert runs == {'saturation': [(2000, 2100), (4000, 4010)]}
+
+
+def test_lead_off_runs():
+    values = clean_ecg()
+    values[3000:3001] = np.nan
+    values[7000:7500] = np.nan
+    quality = module.signal_quality(values, RATE, **LIMITS)
+    assert kinds(quality) == {'lead-off': [(3000, 3001), (7000, 7500)]}
+    assert quality.bad_samples() == 501
+
+
+def test_clipping_threshold():
+    values = clean_ecg()
+    clip = int(LIMITS['clip'] * RATE)
+    values[8000:8000 + clip] = 1.2
+    values[9000:9000 + clip - 1] = 1.2
+    assert kinds(module.signal_quality(values, RATE, **dict(LIMITS, flat=None))) == {'clipping': [(8000, 8000 + clip)]}
+
+
+def test_mask_queries():
+    quality = classes.Quality_mask(1000, [100, 150, 600], [200, 300, 650], [1, 3, 0])
+    # Overlapping runs of different kinds are merged
+    np.testing.assert_array_equal(quality.merged_start, [100, 600])
+    np.testing.assert_array_equal(quality.merged_stop, [300, 650])
+    assert quality.good_spans(0, 1000) == [(0, 100), (300, 600), (650, 1000)]
+    assert quality.good_spans(0, 1000, min_length=200) == [(300, 600), (650, 1000)]
+    mask = quality.mask(50, 700)
+    np.testing.assert_array_equal(np.flatnonzero(mask) + 50, np.r_[100:300, 600:650])
+    np.testing.assert_array_equal(quality.overlaps(np.array([0, 290, 300, 640]), np.array([100, 310, 600, 700])),
+                                  [False, True, False, True])
+    assert quality.bad_samples(0, 1000) == 250
+
+
+@pytest.fixture(scope='module')
+def masked_store():
+    seconds = 120
+    raw = benchmark.synthetic_ecg(seconds, seed=3)
+    raw[20000:21000] = 3.0
+    raw[40000:40600] = np.nan
+    raw[50000:51000] = 3 + 0.5 * np.random.RandomState(1).randn(1000)
+    quality = module.signal_quality(raw, RATE, **LIMITS)
+    signals = classes.Signal_store(base='ECG')
+    signals.add('ECG', raw * ((raw > -0.4) & (raw < 1.4)), RATE, dtype='int16')
+    signals.add('co2', benchmark.synthetic_co2(seconds), 62.5)
+    signals.add('Hr', np.full(seconds // 2, 90.0), 0.5)
+    signals.quality['ECG'] = quality
+    return classes.Data_store(signals)
+
+
+def test_peaks_skip_masked_spans(masked_store):
+    quality = masked_store.signals.quality['ECG']
+    df, peaks = module.data_transformation(masked_store, 0, masked_store.signals.length())
+    assert peaks.size > 100
+    assert not quality.mask()[peaks].any()
+    # Filtered ECG is not computed over the masked parts
+    assert np.isnan(df.loc[:, 'ECG_f'].to_numpy()[quality.mask()]).all()
+
+    whole, hr = module.whole_case_peaks(masked_store.signals.channels['ECG'][:], workers=1, quality=quality)
+    assert not quality.mask()[whole].any()
+    # Hr over a masked part is NaN
+    after = np.searchsorted(whole, quality.merged_stop)
+    assert np.isnan(hr[after[after < whole.size]]).all()
+
+    hrv = module.case_hrv(masked_store, workers=1)
+    np.testing.assert_array_equal(hrv.peaks, whole)
+
+
+def test_no_error_peaks_in_masked_spans():
+    # Peaks of the clean ECG (found before the lead-off was masked): the peaks in the lead-off run
+    # have zero ECG and would be error peaks
+    seconds = 60
+    raw = benchmark.synthetic_ecg(seconds, seed=3)
+    peaks, _ = module.whole_case_peaks(raw, workers=1)
+    raw[10000:20000] = np.nan
+    signals = classes.Signal_store(base='ECG')
+    signals.add('ECG', raw, RATE, dtype='int16')
+    signals.add('co2', benchmark.synthetic_co2(seconds), 62.5)
+    signals.add('Hr', np.full(seconds // 2, 90.0), 0.5)
+    signals.quality['ECG'] = module.signal_quality(raw, RATE, **LIMITS)
+    store = classes.Data_store(signals)
+    store.hrv = classes.Hrv_metrics(peaks, rate=RATE)
+    assert len(module.detect_events(store).select('error peaks')) == 0
+
+    store.signals.quality.pop('ECG')
+    store.events = None
+    errors = module.detect_events(store).select('error peaks')
+    assert len(errors) == 1 and errors.start[0] >= 10000 and errors.stop[0] <= 20000 + RATE
+
+
+def test_no_co2_breaks_in_masked_spans():
+    seconds = 120
+    co2 = benchmark.synthetic_co2(seconds)
+    # Disconnected sensor for 80 s (flatline)
+    co2[1250:6250] = 0
+    signals = classes.Signal_store(base='ECG')
+    signals.add('ECG', benchmark.synthetic_ecg(seconds), RATE)
+    signals.add('co2', co2, 62.5)
+    signals.add('Hr', np.full(seconds // 2, 90.0), 0.5)
+    store = classes.Data_store(signals)
+    assert len(module.detect_events(store).select('co2 break')) == 1
+
+    signals.quality['co2'] = module.signal_quality(co2, 62.5, **module.QUALITY['co2'])
+    store.events = None
+    assert len(module.detect_events(store).select('co2 break')) == 0
@@ -0,0 +1,24 @@
+import numpy as np
+
+import benchmark
+import classes
+import module
+
+
+def test_oversized_value_is_returned_but_not_stored():
+    cache = classes.Tile_cache(max_bytes=1000)
+    cache.put('small', {'values': np.zeros(50)})
+    value = cache.compute('big', lambda: {'values': np.zeros(500)})
+    assert value['values'].size == 500
+    assert 'big' not in cache and 'small' in cache
+    assert cache.stats()['oversized'] == 1
+
+
+def test_streaming_blocks_do_not_use_the_shared_results():
+    df_class = benchmark.synthetic_store(60)
+    module.data_transformation(df_class, 0, 10000)
+    for start in range(0, 20000, 1000):
+        module.give_values_for_streaming(df_class, start, start + 1000)
+    assert ('data transformation', 0, 10000) in df_class.results
+    assert len(df_class.results.tiles) == 1
+    assert len(df_class.stream_results.tiles) == 20
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+import benchmark
+import module
+import rolling
+
+
+WINDOWS = (1, 2, 10, 101, 1000)
+
+
+@pytest.fixture(scope='module')
+def abp():
+    return benchmark.synthetic_abp(60)[:, 0]
+
+
+@pytest.mark.parametrize('statistic', sorted(rolling.KERNELS))
+@pytest.mark.parametrize('window', WINDOWS)
+def test_kernels_match_strided_reference(abp, statistic, window):
+    result = rolling.KERNELS[statistic](abp, window)
+    np.testing.assert_allclose(result, benchmark.rolling_reference(abp, window, statistic), rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('statistic', sorted(rolling.KERNELS))
+@pytest.mark.parametrize('window', WINDOWS)
+def test_same_mode_matches_centered_windows(abp, statistic, window):
+    values = abp[:3000]
+    left, right = rolling.window_bounds(values.size, window, 'same')
+    reference = np.array([benchmark.rolling_reference(values[a:b], b - a, statistic)[0] for a, b in zip(left, right)])
+    np.testing.assert_allclose(rolling.KERNELS[statistic](values, window, 'same'), reference, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('window', (rolling.RANK_FILTER_WINDOW - 1, rolling.RANK_FILTER_WINDOW,
+                                    rolling.RANK_FILTER_WINDOW + 1, rolling.RANK_FILTER_WINDOW + 2))
+@pytest.mark.parametrize('mode', ('valid', 'same'))
+def test_median_paths_are_exact(abp, window, mode):
+    # Rank filter (short windows) and skip list (long windows), odd and even windows
+    values = np.round(abp[:5000])
+    left, right = rolling.window_bounds(values.size, window, mode)
+    reference = np.array([np.median(values[i0:i1]) for i0, i1 in zip(left, right)])
+    np.testing.assert_array_equal(rolling.rolling_median(values, window, mode), reference)
+
+
+@pytest.mark.parametrize('statistic', sorted(rolling.KERNELS))
+def test_nan_windows(abp, statistic):
+    values = abp.copy()
+    values[1000:1005] = np.nan
+    result = rolling.KERNELS[statistic](values, 100)
+    reference = benchmark.rolling_reference(values, 100, statistic)
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(reference))
+    np.testing.assert_allclose(result, reference, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('window', WINDOWS)
+def test_rolling_state_matches_whole_signal(abp, window):
+    state = rolling.Rolling_state(window, tuple(rolling.KERNELS))
+    parts = [state.process(chunk) for chunk in np.array_split(abp, 17)]
+    for statistic, kernel in rolling.KERNELS.items():
+        streamed = np.concatenate([part[statistic] for part in parts])
+        np.testing.assert_allclose(streamed, kernel(abp, window), rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('step', (1, 3, 10))
+def test_rolling_window_matches_strided_mean(abp, step):
+    np.testing.assert_allclose(module.rolling_window(abp, 10, step), rolling.strided_mean(abp, 10, step), rtol=0, atol=1e-9)
+
+
+def test_parity_table_passes(capsys):
+    failed, errors = benchmark.parity(seconds=20)
+    assert failed == []
+    assert len(errors) == 5 * len(rolling.KERNELS)
+    # Library function - the table is printed only by the command line
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import benchmark
+import module
+
+
+@pytest.fixture
+def trapz(monkeypatch):
+    # find_min_max_average() uses np.trapz (numpy 1.x), numpy 2 has only np.trapezoid
+    if not hasattr(np, 'trapz'):
+        monkeypatch.setattr(np, 'trapz', np.trapezoid, raising=False)
+
+
+def reference_beats(abp, period):
+    rows = module.find_min_max_average(abp, period)
+    return rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3]
+
+
+@pytest.mark.parametrize('seconds, period', [(60, 300), (120, 330), (30, 250)])
+def test_segment_beats_matches_find_min_max_average(trapz, seconds, period):
+    abp = benchmark.synthetic_abp(seconds)[:, 0]
+    beats = module.segment_beats(abp, period)
+    dia, sys_bp, mean_ap, start = reference_beats(abp, period)
+    assert beats.size == dia.size
+    np.testing.assert_array_equal(beats['start'], start)
+    np.testing.assert_array_equal(beats['dia'], dia)
+    np.testing.assert_array_equal(beats['sys'], sys_bp)
+    np.testing.assert_array_equal(beats['mean'], mean_ap)
+
+
+def test_segment_beats_with_flat_parts(trapz):
+    # Flat parts (max - min < 5) are skipped by both versions
+    abp = benchmark.synthetic_abp(60)[:, 0]
+    abp[5000:9000] = 80
+    beats = module.segment_beats(abp, 300)
+    _, _, _, start = reference_beats(abp, 300)
+    np.testing.assert_array_equal(beats['start'], start)
@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+import benchmark
+import classes
+
+
+def load_case(progress=None, case=1):
+    return benchmark.synthetic_store(60)
+
+
+def test_attach_published_case(tmp_path):
+    owner = classes.Shared_case_store(str(tmp_path))
+    df_class = owner.open(load_case, case=1)
+    owner.share(df_class)
+    assert not owner.owner
+
+    other = classes.Shared_case_store(str(tmp_path))
+    attached = other.open(load_case, case=1)
+    assert not other.owner and other.attached
+    np.testing.assert_array_equal(np.asarray(attached.signals.channels['ECG']), np.asarray(df_class.signals.channels['ECG']))
+
+
+def test_other_code_version_is_not_attached(tmp_path, monkeypatch):
+    owner = classes.Shared_case_store(str(tmp_path))
+    owner.share(owner.open(load_case, case=1))
+
+    monkeypatch.setattr(classes.Shared_case_store, 'schema', classes.Shared_case_store.schema + 1)
+    newer = classes.Shared_case_store(str(tmp_path))
+    newer.open(load_case, case=1)
+    # Published copy of the old version is ignored: the process loads the case itself
+    assert newer.owner and not newer.attached
+    newer.release()
+
+
+def test_stale_lock_is_taken_over(tmp_path):
+    # Owner process takes the lock and is killed during the 'loading' (no manifest is published)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ('import sys, time; sys.path.insert(0, sys.argv[1]); import classes; '
+            'store = classes.Shared_case_store(sys.argv[2]); store.acquire(); print("locked", flush=True); time.sleep(60)')
+    owner = subprocess.Popen([sys.executable, '-c', code, root, str(tmp_path)], stdout=subprocess.PIPE, text=True)
+    try:
+        assert owner.stdout.readline().strip() == 'locked'
+        store = classes.Shared_case_store(str(tmp_path), poll=0.01)
+        assert store.owner_alive()
+        assert not store.acquire()
+    finally:
+        owner.kill()
+        owner.wait()
+    # The lock file is still there, but the lock was released with the process
+    assert os.path.exists(store.lock_path)
+    assert not store.owner_alive()
+    df_class = store.open(load_case, case=1)
+    assert store.owner and df_class.signals.length() == 60 * 500
+    store.release()
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import benchmark
+import classes
+
+
+def baseline_frame(ecg, co2, hr):
+    # Former give_me_df_with_parameters(): time for every point and outer merges on 'Time'
+    df = pd.DataFrame({'Time': np.arange(len(ecg)) / 500, 'ECG': ecg})
+    df2 = pd.DataFrame({'Time': np.arange(len(co2)) / 62.5, 'co2': co2})
+    df3 = pd.DataFrame({'Time': np.arange(len(hr)) * 2.0, 'Hr': hr})
+    df = df.merge(df2, on='Time', how='outer')
+    return df.merge(df3, on='Time', how='outer')
+
+
+def tracks(seconds, extra_hr=0):
+    ecg = benchmark.synthetic_ecg(seconds)
+    ecg = ecg * ((ecg > -0.4) & (ecg < 1.4))
+    co2 = benchmark.synthetic_co2(seconds)
+    co2[100:120] = np.nan
+    hr = 90 + 10 * np.sin(np.arange(seconds // 2 + extra_hr))
+    return ecg, co2, hr
+
+
+def store(ecg, co2, hr, dtype):
+    signals = classes.Signal_store(base='ECG')
+    signals.add('ECG', ecg, 500, dtype=dtype)
+    signals.add('co2', co2, 62.5, dtype=dtype)
+    signals.add('Hr', hr, 0.5, dtype=dtype)
+    return signals
+
+
+@pytest.mark.parametrize('dtype, rtol', [('float64', 0), ('float32', 1e-6)])
+@pytest.mark.parametrize('start, stop', [(0, 30000), (1234, 5678), (29990, 30000), (7, 8), (1000, 1001)])
+def test_frame_equals_merged_slice(dtype, rtol, start, stop):
+    ecg, co2, hr = tracks(60)
+    baseline = baseline_frame(ecg, co2, hr)
+    assert len(baseline) == ecg.size
+    expected = baseline.loc[(baseline.loc[:, 'Time'] >= start / 500) & (baseline.loc[:, 'Time'] < stop / 500)]
+    frame = store(ecg, co2, hr, dtype).frame(start, stop)
+    assert list(frame.columns) == ['Time', 'ECG', 'co2', 'Hr']
+    np.testing.assert_array_equal(frame.index, np.arange(start, stop))
+    np.testing.assert_array_equal(frame.loc[:, 'Time'].to_numpy(), expected.loc[:, 'Time'].to_numpy())
+    for name in ('ECG', 'co2', 'Hr'):
+        # int16 ECG (scaled codes) is checked by test_compact_array.py
+        np.testing.assert_allclose(frame.loc[:, name].to_numpy(), expected.loc[:, name].to_numpy(), rtol=rtol, atol=0)
+
+
+def test_frame_after_the_base_channel():
+    # Hr longer than the ECG: the merge adds rows only at the Hr times, the frame has every grid point
+    ecg, co2, hr = tracks(60, extra_hr=5)
+    baseline = baseline_frame(ecg, co2, hr)
+    signals = store(ecg, co2, hr, 'float64')
+    assert signals.length() == (hr.size - 1) * 1000 + 1
+    frame = signals.frame(0, signals.length())
+    rows = np.round(baseline.loc[:, 'Time'].to_numpy() * 500).astype(int)
+    merged = frame.loc[rows]
+    for name in ('Time', 'ECG', 'co2', 'Hr'):
+        np.testing.assert_array_equal(merged.loc[:, name].to_numpy(), baseline.loc[:, name].to_numpy())
+    # Other rows after the ECG are empty
+    extra = frame.drop(index=rows)
+    assert extra.loc[:, ['ECG', 'co2', 'Hr']].isna().all().all()
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import benchmark
+import classes
+import module
+
+
+SECONDS = 150
+
+
+@pytest.fixture(scope='module')
+def store():
+    return benchmark.synthetic_store(SECONDS)
+
+
+@pytest.mark.parametrize('start, stop', [(0, SECONDS * 500), (15000, 45000), (19000, 21000), (39990, 60010)])
+def test_tile_peaks_equal_whole_case_peaks(store, start, stop):
+    tile = classes.Data_store.tile_size
+    assert start // tile != (stop - 1) // tile
+    whole, _ = module.whole_case_peaks(store.signals.channels['ECG'][:], workers=1)
+    ecg_f, peaks, hr = store.transform_range(start, stop)
+    assert ecg_f.size == stop - start
+    assert peaks.size == hr.size
+    np.testing.assert_array_equal(peaks, whole[(whole >= start) & (whole < stop)])
+
+
+def test_border_duplicates_are_merged(monkeypatch):
+    # The same beat found by both tiles: 19995 (first tile) and 20003 (second tile)
+    tiles = {0: np.array([19000, 19995]), 1: np.array([20003, 20800]), 2: np.array([40000, 40030, 40100])}
+
+    def process_tile(self, number):
+        return {'ECG_f': np.zeros(self.tile_size, dtype=np.float32), 'peaks': tiles[number].astype(np.int32),
+                'hr': np.arange(tiles[number].size, dtype=np.float32)}
+
+    monkeypatch.setattr(classes.Data_store, 'process_tile', process_tile)
+    store = classes.Data_store(None)
+    _, peaks, hr = store.transform_range(0, 60000)
+    # Every pair closer than min_distance is merged (the first peak is kept), as in whole_case_peaks()
+    np.testing.assert_array_equal(peaks, [19000, 19995, 20800, 40000, 40100])
+    np.testing.assert_array_equal(hr, [0, 1, 1, 0, 2])
+    _, peaks, _ = store.transform_range(20000, 21000)
+    np.testing.assert_array_equal(peaks, [20003, 20800])
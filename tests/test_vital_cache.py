@@ -0,0 +1,95 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import classes
+
+
+class Fake_source:
+    # Tracks of the .vital file without vitaldb: value of the track depends on the file content
+    def __init__(self, monkeypatch):
+        self.calls = []
+        monkeypatch.setattr(classes.Vital_cache, 'read_source', self.read_source)
+        monkeypatch.setattr(classes.Vital_cache, 'read_sources', self.read_sources)
+
+    def values(self, track_names, interval, vital_path):
+        with open(vital_path, 'rb') as vital_file:
+            version = len(vital_file.read())
+        size = int(10 / interval)
+        return np.column_stack([np.arange(size) * (i + 1) + version for i, _ in enumerate(track_names)]).astype(float)
+
+    def read_source(self, case, track_names, interval, vital_path=None):
+        self.calls.append(list(track_names))
+        return self.values(track_names, interval, vital_path)
+
+    def read_sources(self, case, requests, vital_path=None):
+        self.calls.append([name for names, _ in requests for name in names])
+        return [self.values(names, interval, vital_path) for names, interval in requests]
+
+
+@pytest.fixture
+def source(monkeypatch):
+    return Fake_source(monkeypatch)
+
+
+@pytest.fixture
+def vital_path(tmp_path):
+    path = tmp_path / 'case.vital'
+    path.write_bytes(b'12345')
+    return str(path)
+
+
+def test_cached_read_is_memory_mapped(tmp_path, source, vital_path):
+    cache = classes.Vital_cache(str(tmp_path / 'cache'))
+    fresh = cache.load(367, 'SNUADC/ART', 0.002, vital_path)
+    assert source.calls == [['SNUADC/ART']]
+    cached = cache.load(367, 'SNUADC/ART', 0.002, vital_path)
+    assert source.calls == [['SNUADC/ART']]
+    np.testing.assert_array_equal(fresh, cached)
+    assert cached.shape == (5000, 1)
+    assert isinstance(cached, np.memmap) or isinstance(cached.base, np.memmap)
+    assert not cached.flags.writeable
+
+    manifest = cache.read_manifest()
+    entry = manifest[cache.key(367, 'SNUADC/ART', 0.002)]
+    assert entry['size'] == 5000 and entry['source']['size'] == 5
+    with open(os.path.join(cache.cache_dir, 'manifest.json')) as manifest_file:
+        assert json.load(manifest_file) == manifest
+
+
+def test_changed_source_is_read_again(tmp_path, source, vital_path):
+    cache = classes.Vital_cache(str(tmp_path / 'cache'))
+    first = np.array(cache.load(367, ['SNUADC/ECG_II', 'SNUADC/ECG_V5'], 0.002, vital_path))
+    assert first[0, 0] == 5
+    # Size change
+    with open(vital_path, 'ab') as vital_file:
+        vital_file.write(b'678')
+    second = np.array(cache.load(367, ['SNUADC/ECG_II', 'SNUADC/ECG_V5'], 0.002, vital_path))
+    assert len(source.calls) == 2
+    assert second[0, 0] == 8
+    # Same size, new modification time
+    with open(vital_path, 'wb') as vital_file:
+        vital_file.write(b'abcdefgh')
+    stat = os.stat(vital_path)
+    os.utime(vital_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cache.load(367, ['SNUADC/ECG_II', 'SNUADC/ECG_V5'], 0.002, vital_path)
+    assert len(source.calls) == 3
+    cache.load(367, ['SNUADC/ECG_II', 'SNUADC/ECG_V5'], 0.002, vital_path)
+    assert len(source.calls) == 3
+
+
+def test_load_many_reads_only_missing_and_stale_tracks(tmp_path, source, vital_path):
+    cache = classes.Vital_cache(str(tmp_path / 'cache'))
+    cache.load(367, 'Solar8000/HR', 2, vital_path)
+    requests = [(['SNUADC/ECG_II'], 0.002), ('Solar8000/HR', 2), ('Primus/CO2', 0.016)]
+    tracks = cache.load_many(367, requests, vital_path)
+    assert source.calls == [['Solar8000/HR'], ['SNUADC/ECG_II', 'Primus/CO2']]
+    assert [track.shape for track in tracks] == [(5000, 1), (5, 1), (625, 1)]
+    cache.load_many(367, requests, vital_path)
+    assert len(source.calls) == 2
+    with open(vital_path, 'ab') as vital_file:
+        vital_file.write(b'0')
+    cache.load_many(367, requests, vital_path)
+    assert source.calls[2] == ['SNUADC/ECG_II', 'Solar8000/HR', 'Primus/CO2']
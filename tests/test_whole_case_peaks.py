@@ -0,0 +1,50 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import benchmark
+import module
+
+
+SECONDS = 240
+
+
+@pytest.fixture(scope='module')
+def ecg():
+    return benchmark.synthetic_ecg(SECONDS, seed=5)
+
+
+@pytest.fixture(scope='module')
+def reference(ecg):
+    return module.whole_case_peaks(ecg, workers=1)
+
+
+def test_peaks_are_sorted_and_unique(reference):
+    peaks, hr = reference
+    assert peaks.size > SECONDS
+    assert (np.diff(peaks) >= 50).all()
+    assert np.isnan(hr[0]) and np.isfinite(hr[1:]).all()
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='workers import the test module')
+def test_workers_do_not_change_the_result(ecg, reference):
+    peaks, hr = module.whole_case_peaks(ecg, workers=2)
+    np.testing.assert_array_equal(peaks, reference[0])
+    np.testing.assert_array_equal(hr, reference[1])
+
+
+@pytest.mark.parametrize('segment, overlap', [(20000, 1000), (7000, 1000), (12345, 700), (SECONDS * 500, 1000)])
+def test_segment_borders_do_not_change_the_result(ecg, reference, segment, overlap):
+    peaks, hr = module.whole_case_peaks(ecg, segment=segment, overlap=overlap, workers=1)
+    np.testing.assert_array_equal(peaks, reference[0])
+    np.testing.assert_array_equal(hr, reference[1])
+
+
+def test_border_beat_is_found_once(ecg, reference):
+    # Borders right at the R-peaks: both segments see the beat, only one peak is kept
+    peaks = reference[0]
+    for border in peaks[10:80:13]:
+        for shift in (-3, 0, 3):
+            result, _ = module.whole_case_peaks(ecg[:60000], segment=int(border) + shift, workers=1)
+            np.testing.assert_array_equal(result, peaks[peaks < 60000])